@@ -0,0 +1,189 @@
+import copy
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from random_constr import ConstCommand, Element
+from classical_generator import ClassicalGenerator, DependencyGraph, IdentifierPool, Node, parse_args, main as base_main
+from discriminator import test_measure_construction
+from sample_config import basic_commands, triangle_commands, circle_commands, angle_commands, polygon_commands, rotate_polygon_commands
+
+# Beam search over command sequences: forks each partial construction, extends it by one command, and keeps the
+# extensions whose deepest measurable quantity is deepest, broadest and predicted constant by a few quick replays.
+# Usage: python pipeline.py --generator_class BeamSearchGenerator
+
+# first match wins, so that the angle commands (which are also in basic_commands) count as their own category
+COMMAND_CATEGORIES: Dict[str, str] = {}
+for category, names in (("rotate_polygon", rotate_polygon_commands), ("polygon", polygon_commands), ("triangle", triangle_commands),
+                        ("circle", circle_commands), ("angle", angle_commands), ("basic", basic_commands)):
+    for name in names:
+        COMMAND_CATEGORIES.setdefault(name, category)
+
+# generator attributes which every fork uses as is, rather than a copy
+SHARED_STATE = {"available_commands", "_output_types", "_macro_steps", "_constancy_cache"}
+
+CATEGORY_WEIGHT = 0.1  # per distinct category, relative to a frontier as deep as num_commands
+# probability of picking the input which makes the new command's cone largest, rather than a uniform one;
+# extensions of a uniformly sampled input rarely deepen the frontier, so without this the beam has little to choose from
+DEPTH_INPUT_FOCUS = 0.5
+# how many of the measurable quantities with the most ancestors are candidates for the frontier
+MAX_FRONTIER_CANDIDATES = 8
+
+
+class BeamSearchGenerator(ClassicalGenerator):
+    def __init__(self, seed=None, command_types=None, sampling_policy=None, macros=None, beam_width: int = 3, expansions: int = 3, ensemble_size: int = 3):
+        """
+        Args:
+            beam_width: number of partial constructions kept after every step
+            expansions: number of one-command extensions sampled for each of them
+            ensemble_size: number of replays used to predict whether a measurement is constant
+        """
+        super().__init__(seed, command_types, sampling_policy, macros)
+        self.beam_width = beam_width
+        self.expansions = expansions
+        self.ensemble_size = ensemble_size
+
+    def reset(self, seed=None):
+        super().reset(seed)
+        # construction text -> predicted constancy, shared by every fork (forks share labels, so the same quantity has the same text).
+        # the predictions are random, so a reused generator starts over to give the same results as a fresh one
+        self._constancy_cache: Dict[str, float] = {}
+
+    def _reset_construction(self):
+        super()._reset_construction()
+        # the frontier quantity this construction was scored by, which is the one written out
+        self._search_target: Optional[Node] = None
+
+    def _fork(self) -> 'BeamSearchGenerator':
+        """
+        Independent copy of the search state, without copying any Elements.
+        Elements and dependency graph nodes are never modified once a command has created them (labels are only rewritten on
+        the final, adopted state), so the forks share them, and only the containers which grow or shrink are copied.
+        """
+        child = copy.copy(self)
+        for name, value in self.__dict__.items():
+            if name not in SHARED_STATE and isinstance(value, (list, dict, set)):
+                setattr(child, name, copy.copy(value))
+            elif isinstance(value, IdentifierPool):
+                setattr(child, name, value.copy())
+        child.dependency_graph = DependencyGraph()
+        child.dependency_graph.nodes = dict(self.dependency_graph.nodes)
+        child.dependency_graph.order = list(self.dependency_graph.order)
+        return child
+
+    def _choose_input(self, cmd_name: str, candidates: List[Element], chosen: List[Element]) -> Element:
+        if random.random() >= DEPTH_INPUT_FOCUS:
+            return random.choice(candidates)
+        nodes = self.dependency_graph.nodes
+        chosen_cone = 0
+        for element in chosen:
+            if element in nodes:
+                chosen_cone |= nodes[element].cone
+        sizes = [(chosen_cone | nodes[element].cone).bit_count() if element in nodes else 0 for element in candidates]
+        largest = max(sizes)
+        return random.choice([element for element, size in zip(candidates, sizes) if size == largest])
+
+    def _frontier_candidates(self) -> List[Tuple[Node, List]]:
+        """
+        Non-degenerate measurable nodes and the (non-const) commands they depend on, deepest first.
+        Only the nodes with the most ancestors are considered; ancestor counts overstate depth for commands with many outputs (polygons).
+        """
+        measurable_nodes = ClassicalGenerator._measurable_nodes(self)
+        measurable_nodes.sort(key=lambda node: node.ancestor_count, reverse=True)
+        candidates = []
+        for node in measurable_nodes[:MAX_FRONTIER_CANDIDATES]:
+            try:
+                if self._is_degenerate_target(node):
+                    continue
+            except Exception:
+                continue
+            commands = [cmd for cmd in self.dependency_graph.necessary_commands(node) if not isinstance(cmd, ConstCommand)]
+            candidates.append((node, commands))
+        candidates.sort(key=lambda candidate: len(candidate[1]), reverse=True)
+        return candidates
+
+    def _target_text(self, target_node: Node) -> str:
+        """The construction measuring target_node, with the generator's current labels."""
+        lines = [f"{cmd}" for cmd in self.find_necessary_commands(target_node)]
+        lines.append(f"measure : {target_node.element.label} -> measured_value")
+        return "\n".join(lines)
+
+    def _predicted_constancy(self, target_node: Node) -> float:
+        """Fraction of the ensemble's replays which agree on the measurement (0 if it can't be replayed, or measures 0)."""
+        text = self._target_text(target_node)
+        if text not in self._constancy_cache:
+            results = test_measure_construction(None, num_tests=self.ensemble_size, file_contents=text)
+            if results is None or abs(results["mode"]) <= 0.0001:
+                self._constancy_cache[text] = 0.0
+            else:
+                self._constancy_cache[text] = results["mode_count"] / self.ensemble_size
+        return self._constancy_cache[text]
+
+    def _score(self, candidates: List[Tuple[Node, List]], num_commands: int) -> float:
+        """Frontier depth (relative to num_commands) plus category score of the first of candidates."""
+        if not candidates:
+            return 0.0
+        target_commands = candidates[0][1]
+        categories = {COMMAND_CATEGORIES.get(cmd.name, "basic") for cmd in target_commands}
+        return len(target_commands) / num_commands + CATEGORY_WEIGHT * len(categories)
+
+    def _select(self, states: List['BeamSearchGenerator'], num_commands: int) -> List['BeamSearchGenerator']:
+        """
+        The beam_width best states, each with its frontier quantity set.
+        States are first ranked optimistically, as if their deepest quantity were constant, and only the most promising
+        ones pay for the ensemble, walking down their quantities until one is predicted constant.
+        """
+        frontiers = [state._frontier_candidates() for state in states]
+        order = sorted(range(len(states)), key=lambda i: self._score(frontiers[i], num_commands), reverse=True)[:2 * self.beam_width]
+        scores = {}
+        for i in order:
+            state = states[i]
+            constant = []
+            for candidate in frontiers[i]:
+                if state._predicted_constancy(candidate[0]) >= 1:
+                    constant.append(candidate)
+                    break
+            state._search_target = constant[0][0] if constant else None
+            scores[i] = self._score(constant, num_commands)
+        return [states[i] for i in sorted(scores, key=scores.get, reverse=True)[:self.beam_width]]
+
+    def generate_construction(self, num_commands: int = 5, max_iterations: Optional[int] = None, deadline: Optional[float] = None, min_num_commands: Optional[int] = None):
+        # min_num_commands is unused: the beam drops constructions which fall behind instead of restarting them
+        beam = [self]
+        iterations = 0
+        while any(len(state.command_sequence) < num_commands for state in beam):
+            if max_iterations is not None and iterations >= max_iterations:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            iterations += 1
+            candidates = []
+            for state in beam:
+                if len(state.command_sequence) >= num_commands:
+                    candidates.append(state)
+                    continue
+                for _ in range(self.expansions):
+                    child = state._fork()
+                    command = child._execute_new_command()
+                    if command is None:
+                        continue
+                    child.command_sequence.append(command)
+                    child._update_dependency_graph(command)
+                    candidates.append(child)
+            if candidates:
+                beam = self._select(candidates, num_commands)
+        # adopt the best state found
+        best = self._select(beam, num_commands)[0]
+        if best is not self:
+            self.__dict__.update(best.__dict__)
+        return self.command_sequence
+
+    def _measurable_nodes(self) -> List[Node]:
+        # only the quantity the search checked; the ancestor-count ranking of compute_measure_targets would pick unchecked ones
+        return [self._search_target] if self._search_target is not None else []
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.generator_class = BeamSearchGenerator
+    base_main(args)
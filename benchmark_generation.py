@@ -0,0 +1,346 @@
+# Fixed-seed throughput / yield benchmark of the generators (attempts/sec, pruned lengths, pass rate, valid problems per CPU-second).
+# Usage: python benchmark_generation.py --save_baseline benchmarks/baseline.json
+#        python benchmark_generation.py --baseline benchmarks/baseline.json
+# --duplicate_check fails if two unseeded workers write the same construction.
+# --yield_corpus <dir> reports the pass yield of a fixed corpus by tolerance clustering and by rounded bins.
+
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import tempfile
+import platform
+from collections import Counter
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+np.seterr(all='raise') # same numerical strictness as the generator and discriminator
+
+from random_constr import ConstCommand
+from classical_generator import ClassicalGenerator, main as generator_main
+from polygon_rotation_generator import PolygonRotationGenerator
+from goal_directed_generator import GoalDirectedGenerator
+from beam_search_generator import BeamSearchGenerator
+from mutation_generator import MutationGenerator
+from discriminator import PASS_AGREEMENTS, test_measure_construction
+from seeding import attempt_seed_sequence, seed_global_streams, filename_key
+from canonical import canonical_hash_text
+from macro_miner import Macro, load_macros, construction_files
+
+GENERATOR_CLASSES = {
+    "ClassicalGenerator": ClassicalGenerator,
+    "PolygonRotationGenerator": PolygonRotationGenerator,
+    "GoalDirectedGenerator": GoalDirectedGenerator,
+    "BeamSearchGenerator": BeamSearchGenerator,
+    "MutationGenerator": MutationGenerator,
+}
+
+# metrics which are deterministic given the seeds, and metrics which depend on the machine
+EXACT_METRICS = ("constructions_written", "pass_rate", "mean_pruned_length")
+TIMING_METRICS = ("attempts_per_sec", "valid_per_cpu_sec")
+
+
+def config_key(generator_name: str, command_types: str, num_commands: int) -> str:
+    return f"{generator_name}/{command_types}/{num_commands}"
+
+
+def run_config(generator_class, command_types: List[str], num_commands: int, attempts: int, seed: int,
+               min_num_commands: int, num_tests: int, tmp_dir: str, macros: Optional[List[Macro]] = None, early_abort: bool = True,
+               sequential: bool = False) -> Dict[str, Any]:
+    """Run one benchmark configuration and return its metrics."""
+    generation_wall = 0.0
+    generation_cpu = 0.0
+    discrimination_cpu = 0.0
+    pruned_lengths = []
+    errors = Counter()
+    num_passed = 0
+    num_tested = 0  # constructions with at least one successful discriminator test
+    num_trials = 0
+    restarts = 0
+    generator = None
+    for i in range(attempts):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        text = None
+        try:
+            # one generator for the whole configuration, reset between attempts, like a generator driver worker
+            if generator is None:
+                generator = generator_class(seed=attempt_seed_sequence(seed, i), command_types=command_types, macros=macros)
+            else:
+                generator.reset(attempt_seed_sequence(seed, i))
+            # the same iteration cap as the generator driver, which also bounds the restarts of doomed constructions
+            generator.generate_construction(num_commands=num_commands, max_iterations=10 * num_commands,
+                                            min_num_commands=min_num_commands if early_abort else None)
+            restarts += generator.telemetry.restarts
+            if generator.compute_longest_construction(i, min_num_commands=min_num_commands):
+                text = generator.format_construction(f"Benchmark construction #{i+1}")
+                # measure is the last command, and isn't counted
+                pruned_lengths.append(sum(not isinstance(cmd, ConstCommand) for cmd in generator.pruned_command_sequence) - 1)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        generation_wall += time.perf_counter() - wall_start
+        generation_cpu += time.process_time() - cpu_start
+        if text is None:
+            continue
+
+        # the discriminator draws from the same global random streams; reseed the way its driver does, so verdicts are reproducible too
+        filename = f"construction_{i+1}.txt"
+        seed_global_streams(attempt_seed_sequence(seed, filename_key(filename)))
+        file_path = os.path.join(tmp_dir, filename)
+        with open(file_path, 'w') as f:
+            f.write(text)
+        cpu_start = time.process_time()
+        results = test_measure_construction(file_path, num_tests=num_tests, sequential=sequential)
+        discrimination_cpu += time.process_time() - cpu_start
+        os.remove(file_path)
+        if results is not None:
+            num_tested += 1
+            num_trials += results["trials"]
+        if results is not None and results["pass"]:
+            num_passed += 1
+
+    written = len(pruned_lengths)
+    total_cpu = generation_cpu + discrimination_cpu
+    return {
+        "attempts": attempts,
+        "errors": dict(errors),
+        "restarts": restarts,
+        "constructions_written": written,
+        "passed": num_passed,
+        "attempts_per_sec": attempts / generation_wall if generation_wall > 0 else 0.0,
+        "pass_rate": num_passed / written if written else 0.0,
+        "tests_per_file": num_trials / num_tested if num_tested else 0.0,
+        "valid_per_cpu_sec": num_passed / total_cpu if total_cpu > 0 else 0.0,
+        "generation_cpu_sec": generation_cpu,
+        "discrimination_cpu_sec": discrimination_cpu,
+        "mean_pruned_length": float(np.mean(pruned_lengths)) if pruned_lengths else 0.0,
+        "pruned_length_quantiles": {q: float(np.quantile(pruned_lengths, float(q))) for q in ("0.1", "0.5", "0.9")} if pruned_lengths else {},
+        "pruned_length_histogram": {str(k): v for k, v in sorted(Counter(pruned_lengths).items())},
+    }
+
+
+def construction_body(contents: str) -> str:
+    """A construction without its comment lines (description, seed), for comparing constructions."""
+    return "\n".join(line for line in contents.strip().split("\n") if not line.startswith("#"))
+
+
+def parallel_duplicate_check(generator_class, num_commands: int, attempts: int, max_workers: int,
+                             min_num_commands: int, output_dir: str) -> Dict[str, Any]:
+    """Run the multiprocess generator driver without a seed, and count constructions written more than once."""
+    generator_args = argparse.Namespace(
+        count=attempts,
+        first_attempt=0,
+        target_count=None,
+        time_budget=None,
+        attempt_timeout=30.0,
+        max_iterations=None,
+        generator_class=generator_class,
+        num_commands=num_commands,
+        min_num_commands=min_num_commands,
+        targets_per_run=1,
+        min_target_distance=0.5,
+        command_types=["all"],
+        multiprocess=True,
+        max_workers=max_workers,
+        output_dir=output_dir,
+        seed=None,
+        sampling_policy_file=None,
+        uniform_sampling=True,
+        telemetry_output=None,
+        health_min_attempts=50,
+        health_flag_rate=0.01,
+        # byte-identical copies are what a seeding bug would produce, so the driver mustn't drop them here
+        keep_duplicates=True,
+        macro_library=None,
+        store=None,
+    )
+    generator_main(generator_args)
+    bodies = Counter()
+    canonical_hashes = Counter()
+    for filename in os.listdir(output_dir):
+        with open(os.path.join(output_dir, filename), 'r') as f:
+            contents = f.read()
+        bodies[construction_body(contents)] += 1
+        canonical_hashes[canonical_hash_text(contents)] += 1
+    written = sum(bodies.values())
+    duplicates = written - len(bodies)
+    return {
+        "attempts": attempts,
+        "max_workers": max_workers,
+        "constructions_written": written,
+        "duplicates": duplicates,
+        "duplicate_rate": duplicates / written if written else 0.0,
+        # same construction up to labels and command order; these are dropped by the driver in normal runs
+        "canonical_duplicates": written - len(canonical_hashes),
+    }
+
+
+def corpus_yield(corpus_dir: str, num_tests: int, seed: int) -> Dict[str, Any]:
+    """Discriminate every construction file of a corpus, and count passes by tolerance clustering and by rounded-bin counting."""
+    files = construction_files(corpus_dir)
+    num_passed = 0
+    num_passed_rounded = 0
+    changed = []
+    for file_path in files:
+        seed_global_streams(attempt_seed_sequence(seed, filename_key(os.path.basename(file_path))))
+        results = test_measure_construction(file_path, num_tests=num_tests)
+        if results is None:
+            continue
+        # before clustering, the answer was the most common measurement rounded to 4 decimals
+        mode, mode_count = max(results["counts"].items(), key=lambda item: item[1])
+        passed_rounded = bool(mode_count >= PASS_AGREEMENTS and results["successful_tests"] >= PASS_AGREEMENTS and abs(mode) > 0.0001)
+        num_passed += bool(results["pass"])
+        num_passed_rounded += passed_rounded
+        if bool(results["pass"]) != passed_rounded or (passed_rounded and mode != results["mode"]):
+            changed.append(os.path.relpath(file_path, corpus_dir))
+    return {
+        "corpus": corpus_dir,
+        "files": len(files),
+        "passed": num_passed,
+        "passed_rounded": num_passed_rounded,
+        "pass_rate": num_passed / len(files) if files else 0.0,
+        # files whose verdict or answer differs between the two rules
+        "changed": changed,
+    }
+
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], timing_tolerance: float, exact_tolerance: float) -> List[str]:
+    """Return a description of every metric that regressed relative to the baseline."""
+    regressions = []
+    for key, metrics in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        for metric in EXACT_METRICS + TIMING_METRICS:
+            tolerance = timing_tolerance if metric in TIMING_METRICS else exact_tolerance
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            if new < old * (1 - tolerance):
+                regressions.append(f"{key} {metric}: {old:.4g} -> {new:.4g} ({100 * (new - old) / old:+.1f}%)")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict]):
+    print(f"{'configuration':45s} {'att/s':>8s} {'written':>8s} {'pass%':>7s} {'tests':>6s} {'valid/cpu-s':>12s} {'len p10/p50/p90':>16s} {'restarts':>9s} {'errors':>7s}")
+    for key, m in results.items():
+        q = m["pruned_length_quantiles"]
+        lengths = "/".join(f"{q[k]:.0f}" for k in ("0.1", "0.5", "0.9")) if q else "-"
+        print(f"{key:45s} {m['attempts_per_sec']:8.2f} {m['constructions_written']:8d} {100 * m['pass_rate']:7.2f} {m.get('tests_per_file', 0):6.1f} "
+              f"{m['valid_per_cpu_sec']:12.4f} {lengths:>16s} {m.get('restarts', 0):9d} {sum(m['errors'].values()):7d}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark generator throughput and yield at fixed seeds")
+    parser.add_argument("--generators", type=str, nargs="+", choices=list(GENERATOR_CLASSES), default=list(GENERATOR_CLASSES))
+    parser.add_argument("--command_types", type=str, nargs="+", choices=["basic", "triangle", "circle", "polygon", "all"],
+                        default=["basic", "triangle", "circle", "polygon", "all"], help="Command-type mixes to run (one configuration each)")
+    parser.add_argument("--num_commands", type=int, nargs="+", default=[25, 50], help="num_commands settings to run")
+    parser.add_argument("--attempts", type=int, default=50, help="Generation attempts per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="Root seed; attempt i draws from SeedSequence(seed, spawn_key=(i,))")
+    parser.add_argument("--min_num_commands", type=int, default=8, help="Minimum number of commands in the output sequence")
+    parser.add_argument("--num_tests", type=int, default=20, help="Discriminator tests per construction")
+    parser.add_argument("--output", type=str, default=None, help="Where to write the results (default: benchmarks/<timestamp>.json)")
+    parser.add_argument("--save_baseline", type=str, default=None, help="Also write the results to this baseline file")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare against this baseline file and exit non-zero on regressions")
+    parser.add_argument("--timing_tolerance", type=float, default=0.25, help="Allowed relative drop in machine-dependent metrics")
+    parser.add_argument("--exact_tolerance", type=float, default=0.0, help="Allowed relative drop in seed-deterministic metrics")
+    parser.add_argument("--duplicate_check", action="store_true", help="Also check that an unseeded multiprocess run writes no duplicate constructions")
+    parser.add_argument("--duplicate_check_attempts", type=int, default=400, help="Attempts for the duplicate check")
+    parser.add_argument("--max_workers", type=int, default=8, help="Worker processes for the duplicate check")
+    parser.add_argument("--macro_library", type=str, default=None, help="Run the generators with this macro library (macro_miner.py)")
+    parser.add_argument("--parents_dir", type=str, default=None, help="Passed constructions for MutationGenerator to mutate (it's skipped without them)")
+    parser.add_argument("--no_early_abort", action="store_true", help="Let doomed constructions run to the end instead of restarting them")
+    parser.add_argument("--sequential", action="store_true", help="Stop the discriminator tests of a construction as soon as its verdict is decided")
+    parser.add_argument("--yield_corpus", type=str, default=None, help="Also measure the pass yield of the construction files in this directory")
+    args = parser.parse_args()
+    return args
+
+def main(args):
+    results = {}
+    macros = load_macros(args.macro_library) if args.macro_library else None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for generator_name in args.generators:
+            generator_class = GENERATOR_CLASSES[generator_name]
+            if generator_class is MutationGenerator:
+                if not args.parents_dir:
+                    print("Skipping MutationGenerator, which needs --parents_dir")
+                    continue
+                generator_class = functools.partial(MutationGenerator, parent_files=construction_files(args.parents_dir))
+            # the pattern-constrained generators only make sense with everything enabled
+            mixes = args.command_types if generator_name in ("ClassicalGenerator", "BeamSearchGenerator", "MutationGenerator") else ["all"]
+            for command_types in mixes:
+                for num_commands in args.num_commands:
+                    # kept apart from the plain configurations, so that baselines without macros still compare like with like
+                    key = config_key(generator_name + ("+macros" if macros else "") + ("+no_early_abort" if args.no_early_abort else "")
+                                     + ("+sequential" if args.sequential else ""),
+                                     command_types, num_commands)
+                    print(f"Running {key}...")
+                    results[key] = run_config(generator_class, [command_types], num_commands, args.attempts,
+                                              args.seed, args.min_num_commands, args.num_tests, tmp_dir, macros, not args.no_early_abort,
+                                              args.sequential)
+        duplicate_check = None
+        if args.duplicate_check:
+            print("Running parallel duplicate check...")
+            duplicate_check = parallel_duplicate_check(ClassicalGenerator, min(args.num_commands), args.duplicate_check_attempts,
+                                                       args.max_workers, args.min_num_commands, os.path.join(tmp_dir, "duplicate_check"))
+    yield_results = None
+    if args.yield_corpus:
+        print(f"Measuring pass yield on {args.yield_corpus}...")
+        yield_results = corpus_yield(args.yield_corpus, args.num_tests, args.seed)
+    print_table(results)
+    if duplicate_check is not None:
+        print(f"\nDuplicate check: {duplicate_check['duplicates']} duplicates among {duplicate_check['constructions_written']} constructions "
+              f"from {duplicate_check['attempts']} unseeded attempts on {duplicate_check['max_workers']} workers "
+              f"({duplicate_check['canonical_duplicates']} up to labels and command order)")
+    if yield_results is not None:
+        print(f"\nCorpus yield: {yield_results['passed']} of {yield_results['files']} files in {yield_results['corpus']} passed "
+              f"({yield_results['passed_rounded']} by rounded-bin counting, {len(yield_results['changed'])} verdicts or answers differ)")
+
+    report = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "attempts": args.attempts,
+            "seed": args.seed,
+            "min_num_commands": args.min_num_commands,
+            "num_tests": args.num_tests,
+        },
+        "results": results,
+        "duplicate_check": duplicate_check,
+        "corpus_yield": yield_results,
+    }
+    output = args.output or os.path.join("benchmarks", f"{report['meta']['timestamp']}.json")
+    for path in filter(None, (output, args.save_baseline)):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote results to {path}")
+
+    status = 0
+    if duplicate_check is not None and duplicate_check["duplicates"] > 0:
+        print("Parallel workers wrote duplicate constructions")
+        status = 1
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline["meta"]["attempts"] != args.attempts or baseline["meta"]["seed"] != args.seed:
+            print("Warning: baseline was run with different attempts/seed, seed-deterministic metrics are not comparable")
+        regressions = compare_to_baseline(results, baseline["results"], args.timing_tolerance, args.exact_tolerance)
+        base_yield = baseline.get("corpus_yield")
+        if yield_results is not None and base_yield is not None and base_yield["corpus"] == yield_results["corpus"] \
+                and yield_results["passed"] < base_yield["passed"] * (1 - args.exact_tolerance):
+            regressions.append(f"corpus yield on {yield_results['corpus']}: {base_yield['passed']} -> {yield_results['passed']} passed")
+        if regressions:
+            print(f"\n{len(regressions)} regressions relative to {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions relative to {args.baseline}")
+    return status
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,116 @@
+# Canonical form of a construction, the same up to element names and the order of independent commands,
+# for spotting duplicates: commands are coloured Weisfeiler-Lehman style and listed in a canonical topological order.
+
+import hashlib
+from typing import Dict, List, Sequence, Tuple, Union
+
+from random_constr import Command, ConstCommand, const_type_to_str, parse_command
+
+AnyCommand = Union[Command, ConstCommand]
+
+
+def _digest(*parts) -> str:
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+def _inputs(command: AnyCommand) -> list:
+    return [] if isinstance(command, ConstCommand) else list(command.input_elements)
+
+def _outputs(command: AnyCommand) -> list:
+    return [command.element] if isinstance(command, ConstCommand) else list(command.output_elements or [])
+
+def _initial_colour(command: AnyCommand) -> str:
+    if isinstance(command, ConstCommand):
+        return _digest("const", const_type_to_str[command.datatype], float(command.value))
+    return _digest(command.name, len(command.input_elements), len(command.output_elements or []))
+
+def canonical_form(commands: Sequence[AnyCommand]) -> str:
+    """
+    Label-invariant, order-normalized listing of a construction (one line per command, elements numbered in order).
+    Inputs which no command in the list produces (in a fragment of a construction) are listed as parameters $0, $1, ...
+    """
+    commands = list(commands)
+    # element -> (index of the command producing it, output position)
+    producers: Dict[int, Tuple[int, int]] = {}
+    for c, command in enumerate(commands):
+        for position, element in enumerate(_outputs(command)):
+            if element is not None:
+                producers[id(element)] = (c, position)
+    # element -> [(index of a command consuming it, argument position)]
+    consumers: Dict[int, List[Tuple[int, int]]] = {}
+    for c, command in enumerate(commands):
+        for position, element in enumerate(_inputs(command)):
+            consumers.setdefault(id(element), []).append((c, position))
+
+    colours = [_initial_colour(command) for command in commands]
+    num_colours = len(set(colours))
+    for _ in range(len(commands)):
+        def element_colour(element) -> tuple:
+            if id(element) not in producers:
+                return ("unbound",)
+            c, position = producers[id(element)]
+            return colours[c], position
+        refined = []
+        for c, command in enumerate(commands):
+            input_colours = tuple(element_colour(element) for element in _inputs(command))
+            output_uses = tuple(
+                tuple(sorted((colours[user], position) for user, position in consumers.get(id(element), []))) if element is not None else ()
+                for element in _outputs(command)
+            )
+            refined.append(_digest(colours[c], input_colours, output_uses))
+        colours = refined
+        if len(set(colours)) == num_colours:
+            break
+        num_colours = len(set(colours))
+
+    # canonical topological order
+    element_index: Dict[int, Union[int, str]] = {}
+    parameters = []
+    lines = []
+    listed = [False] * len(commands)
+    while len(lines) < len(commands):
+        ready = [
+            c for c, command in enumerate(commands)
+            if not listed[c] and all(id(element) in element_index or id(element) not in producers for element in _inputs(command))
+        ]
+        if not ready:
+            raise ValueError("Construction has a dependency cycle")
+        def key(c: int) -> tuple:
+            return colours[c], tuple(str(element_index.get(id(element), "")) for element in _inputs(commands[c]))
+        c = min(ready, key=key)
+        listed[c] = True
+        command = commands[c]
+        input_indices = []
+        for element in _inputs(command):
+            if id(element) not in element_index:
+                # an input from outside (for a fragment of a construction): a parameter, numbered by first use
+                element_index[id(element)] = f"${len(parameters)}"
+                parameters.append(element)
+            input_indices.append(str(element_index[id(element)]))
+        output_indices = []
+        for element in _outputs(command):
+            if element is None:
+                output_indices.append("_")
+            else:
+                element_index[id(element)] = len(element_index) - len(parameters)
+                output_indices.append(str(element_index[id(element)]))
+        if isinstance(command, ConstCommand):
+            lines.append(f"const {const_type_to_str[command.datatype]} {float(command.value)!r} -> {' '.join(output_indices)}")
+        else:
+            lines.append(f"{command.name} : {' '.join(input_indices)} -> {' '.join(output_indices)}")
+    return "\n".join(lines)
+
+def canonical_hash(commands: Sequence[AnyCommand]) -> str:
+    return _digest(canonical_form(commands))
+
+def parse_construction_commands(text: str) -> List[AnyCommand]:
+    """The commands of a construction file's contents (comments and blank lines skipped)."""
+    element_dict = {}
+    commands = []
+    for line in text.split("\n"):
+        command = parse_command(line, element_dict)
+        if command is not None:
+            commands.append(command)
+    return commands
+
+def canonical_hash_text(text: str) -> str:
+    return canonical_hash(parse_construction_commands(text))
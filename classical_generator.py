@@ -6,6 +6,11 @@ import inspect
 import sys
 import os
 import argparse
+import time
+import itertools
+import heapq
+import functools
+import copy
 from typing import Dict, List, Set, Tuple, Any, Union, Optional, Generator, Callable
 import pdb
 import concurrent.futures
@@ -16,33 +21,150 @@ from geo_types import MEASURABLE_TYPES, AngleSize
 from random_constr import Command, Element, ConstCommand
 from translate_utils import invert_pi_expression
 from sample_config import get_commands, triangle_commands, polygon_commands, circle_commands
+from sampling_policy import CommandSamplingPolicy, load_policy
+from command_telemetry import CommandTelemetry, allowed_output_types
+from seeding import root_entropy, attempt_seed_sequence, seed_global_streams, describe_seed
+from canonical import canonical_hash, canonical_hash_text
+from macro_miner import Macro, load_macros
+from construction_store import ConstructionStore, open_store
+
+# probability of trying a mined macro (see macro_miner.py) instead of a single command at each step, when a library is loaded
+MACRO_PROBABILITY = 0.25
+# polygon_from_center_and_circumradius is only sampled while the construction has at most this many commands
+POLYGON_WINDOW = 3
+
+PRIMARY_IDENTIFIERS = tuple(chr(i) for i in range(65, 91))  # A-Z
+SECONDARY_IDENTIFIERS = tuple(f"{chr(i)}{j}" for i in range(65, 91) for j in range(1, 100))  # A1-Z99
+
+
+class IdentifierPool:
+    """
+    Identifiers drawn without replacement, either at random or the first one left (in the original order), in O(1).
+    A lazy Fisher-Yates shuffle: the identifiers left are the positions [0, size) of a virtual permutation of `identifiers`,
+    of which only the swapped entries are stored, so reset() costs as much as the draws since the last reset, not the pool size.
+    """
+    def __init__(self, identifiers: Tuple[str, ...]):
+        self.identifiers = identifiers  # shared, never modified
+        self.reset()
+
+    def reset(self):
+        self.size = len(self.identifiers)
+        self._index_at: Dict[int, int] = {}  # position -> index into identifiers, where it isn't the position itself
+        self._position_of: Dict[int, int] = {}  # the inverse
+        self._first = 0  # every identifier before this index has been drawn
+
+    def __len__(self) -> int:
+        return self.size
+
+    def copy(self) -> 'IdentifierPool':
+        """An independent pool with the same identifiers left (sharing the identifier tuple)."""
+        pool = copy.copy(self)
+        pool._index_at = dict(self._index_at)
+        pool._position_of = dict(self._position_of)
+        return pool
+
+    def _remove(self, position: int) -> str:
+        # swap with the last identifier left, which moves the drawn one out of [0, size)
+        index = self._index_at.get(position, position)
+        last = self.size - 1
+        last_index = self._index_at.get(last, last)
+        self._index_at[position], self._position_of[last_index] = last_index, position
+        self._index_at[last], self._position_of[index] = index, last
+        self.size -= 1
+        return self.identifiers[index]
+
+    def draw(self) -> str:
+        return self._remove(random.randrange(self.size))
+
+    def draw_first(self) -> str:
+        while self._position_of.get(self._first, self._first) >= self.size:
+            self._first += 1
+        return self._remove(self._position_of.get(self._first, self._first))
+
+
+@functools.lru_cache(maxsize=None)
+def command_table() -> Dict[str, Dict]:
+    """All commands from the commands module with their parameter and return types (introspected once per process)."""
+    commands_dict = {}
+
+    for name, func in inspect.getmembers(commands, inspect.isfunction):
+        if name.startswith('_'):
+            continue
+
+        sig = inspect.signature(func)
+
+        # Get parameter types
+        param_types = []
+        for param_name, param in sig.parameters.items():
+            if param.annotation != inspect.Parameter.empty:
+                param_types.append(param.annotation)
+            else:
+                # If no type annotation, use Any
+                param_types.append(Any)
+
+        # Get return type
+        return_type = sig.return_annotation if sig.return_annotation != inspect.Signature.empty else Any
+
+        commands_dict[name] = {
+            'func': func,
+            'param_types': param_types,
+            'return_type': return_type
+        }
+    return commands_dict
+
+@functools.lru_cache(maxsize=None)
+def command_output_types() -> Dict[str, Optional[Tuple[type, ...]]]:
+    return {name: allowed_output_types(info['return_type']) for name, info in command_table().items()}
+
 
 class Node:
     """A node in the dependency graph representing an Element."""
-    def __init__(self, element: Element, command: Optional[Command] = None):
+    def __init__(self, element: Element, command: Optional[Command] = None, index: int = 0):
         self.element = element
         self.command = command  # Command that generated this element
         self.parents = []  # Elements used as arguments to create this element
-        self.ancestor_count = 0  # Number of ancestors (computed during dependency graph construction)
+        self.index = index  # Insertion order in the graph; this node's bit in every ancestor mask
+        self.ancestors = 0  # Bitmask over node indices of all (transitive) ancestors
+        self.ancestor_count = 0  # Exact number of ancestors, kept in sync with the mask
+
+    @property
+    def bit(self) -> int:
+        return 1 << self.index
+
+    @property
+    def cone(self) -> int:
+        """Bitmask of this node together with all of its ancestors."""
+        return self.ancestors | self.bit
         
     def add_parent(self, parent_node: 'Node'):
         """Add a parent node (argument used to create this element)."""
         if parent_node not in self.parents:
             self.parents.append(parent_node)
+            self.ancestors |= parent_node.cone
+            self.ancestor_count = self.ancestors.bit_count()
             
     def __repr__(self):
         parent_labels = [p.element.label for p in self.parents]
         return f"Node({self.element.label}, parents={parent_labels}, ancestors={self.ancestor_count})"
 
 class DependencyGraph:
-    """A directed graph tracking Element dependencies in constructions."""
+    """
+    A directed graph tracking Element dependencies in constructions.
+
+    Every node is numbered in insertion order, and carries the exact set of its ancestors as an int bitmask.
+    Parents are always inserted before their children, so the mask is final after add_dependency, and
+    ancestor counts / necessary command sets are lookups instead of a DFS over the graph.
+    """
     def __init__(self):
         self.nodes: Dict[Element, Node] = {}
+        self.order: List[Node] = []  # node.index -> node
 
     def add_node(self, element: Element, command: Optional[Command] = None) -> Node:
         """Add a node to the graph."""
         if element not in self.nodes:
-            self.nodes[element] = Node(element, command)
+            node = Node(element, command, index=len(self.order))
+            self.nodes[element] = node
+            self.order.append(node)
         return self.nodes[element]
         
     def add_dependency(self, child_element: Element, parent_elements: List[Element], command: Command):
@@ -55,60 +177,76 @@ class DependencyGraph:
             parent_elements: List of parent elements
             command: The Command object that created the child element
         """
-        # Ensure all nodes exist
+        # Add parents first, so that they get lower indices than the child if they are new
+        parent_nodes = [self.add_node(parent_element) for parent_element in parent_elements]
         child_node = self.add_node(child_element, command)
-        
-        # Add parents
-        for parent_element in parent_elements:
-            parent_node = self.add_node(parent_element)
+        for parent_node in parent_nodes:
             child_node.add_parent(parent_node)
-            
-        # Update ancestor count for this node
-        child_node.ancestor_count = self._calculate_ancestor_count(child_node)
-    
-    def _calculate_ancestor_count(self, node: Node) -> int:
-        """
-        Calculate the number of ancestors for a node.
-        
-        The count includes:
-        - The sum of all ancestors of parent nodes
-        - Plus one for each parent node itself
-        """
-        count = 0
-        
-        # Count direct parents
-        direct_parents = len(node.parents)
-        
-        # Add the sum of all ancestors from parent nodes
-        for parent in node.parents:
-            count += parent.ancestor_count # I know this isn't actually correct; heuristic.
-        
-        # Add the direct parents count
-        count += direct_parents
-        
-        return count
+
+    def nodes_in(self, mask: int) -> Generator[Node, None, None]:
+        """Iterate over the nodes whose bits are set in mask, in insertion order."""
+        while mask:
+            low_bit = mask & -mask
+            yield self.order[low_bit.bit_length() - 1]
+            mask ^= low_bit
+
+    def get_ancestors(self, element: Element) -> List[Node]:
+        """All (transitive) ancestors of the node for element."""
+        return list(self.nodes_in(self.nodes[element].ancestors))
+
+    def necessary_commands(self, node: Node) -> Set[Union[Command, ConstCommand]]:
+        """The commands needed to construct node, i.e. the commands of every node in its cone."""
+        return {n.command for n in self.nodes_in(node.cone) if n.command is not None}
     
     def __repr__(self):
         return f"DependencyGraph with {len(self.nodes)} nodes"
 
 class ClassicalGenerator:
-    def __init__(self, seed=None, command_types=None):
-        """Initialize the generator with a random seed for reproducibility."""
-        if seed is not None:
+    def __init__(self, seed=None, command_types=None, sampling_policy: Optional[CommandSamplingPolicy] = None, macros: Optional[List[Macro]] = None):
+        """
+        Initialize the generator with a random seed for reproducibility.
+        seed is either an int, or a np.random.SeedSequence (one per attempt, see seeding.py), which is recorded in the saved file.
+        If sampling_policy is given, commands are tried in an order biased by its learned weights instead of uniformly.
+        If macros are given, some steps apply a whole mined fragment of passed constructions instead of one command.
+        """
+        # Get all available commands from the commands module
+        self.available_commands = self._get_commands()
+        self._output_types = command_output_types()
+        self.command_types = command_types
+        self.sampling_policy = sampling_policy
+        if command_types:
+            self.available_commands = {k: v for k, v in self.available_commands.items() if k in get_commands(command_types)}
+        # only the macros made of enabled commands, with their parsed steps
+        self._macro_steps = [(macro, macro.steps()) for macro in macros or [] if macro.command_names() <= set(self.available_commands)]
+        # macros are applied at any step, outside POLYGON_WINDOW, so with one containing polygon commands they stay reachable
+        self._macro_polygons = any(macro.command_names() & set(polygon_commands) for macro, _ in self._macro_steps)
+        self._max_arity = max((len(info['param_types']) for info in self.available_commands.values()), default=0)
+        self.identifier_pool = IdentifierPool(PRIMARY_IDENTIFIERS)
+        self.secondary_identifier_pool = IdentifierPool(SECONDARY_IDENTIFIERS)
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """
+        Start a new attempt, as if the generator had just been constructed with this seed.
+        Only the per-attempt state is reinitialized; the command tables, macros and sampling policy are kept,
+        so a worker can reuse one generator for all of its attempts (see generate_attempt).
+        """
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else None
+        if self.seed_sequence is not None:
+            seed_global_streams(self.seed_sequence)
+        elif seed is not None:
             random.seed(seed)
             np.random.seed(seed)
-        
+        self.telemetry = CommandTelemetry()
+        self._reset_construction()
+
+    def _reset_construction(self):
+        """Start a new construction from scratch (also used to restart a doomed attempt, see _doomed)."""
         self.init_identifier_pool()
-        
+
         # Keep track of used identifiers and their types
         self.identifiers: Dict[str, Element] = {}
         self.identifier_queue: List[str] = []
-        
-        # Get all available commands from the commands module
-        self.available_commands = self._get_commands()
-        self.command_types = command_types
-        if command_types:
-            self.available_commands = {k: v for k, v in self.available_commands.items() if k in get_commands(command_types)}
 
         self.command_sequence: List[Command] = []
         self.dependency_graph = DependencyGraph()
@@ -124,49 +262,26 @@ class ClassicalGenerator:
         self.all_circles: Dict[gt.Circle, bool] = {}
         self.all_triangles: Dict[gt.Triangle, bool] = {}
 
+        # kept up to date by _track_new_nodes: the number of non-const commands in the cone of every node (in dependency graph order),
+        # and in the construction of the best measure target so far (its measure command included)
+        self._cone_commands: List[int] = []
+        self._best_target_commands: int = 0
+
     def init_identifier_pool(self):
-        self.identifier_pool = [chr(i) for i in range(65, 91)]  # A-Z
-        self.secondary_identifier_pool = [f"{chr(i)}{j}" for i in range(65, 91) for j in range(1, 100)]  # A1-Z99
-        
+        self.identifier_pool.reset()
+        self.secondary_identifier_pool.reset()
+
     def _get_commands(self) -> Dict[str, Dict]:
         """Extract all commands from the commands module with their parameter and return types."""
-        commands_dict = {}
-        
-        for name, func in inspect.getmembers(commands, inspect.isfunction):
-            if name.startswith('_'):
-                continue
-                
-            sig = inspect.signature(func)
-            
-            # Get parameter types
-            param_types = []
-            for param_name, param in sig.parameters.items():
-                if param.annotation != inspect.Parameter.empty:
-                    param_types.append(param.annotation)
-                else:
-                    # If no type annotation, use Any
-                    param_types.append(Any)
-            
-            # Get return type
-            return_type = sig.return_annotation if sig.return_annotation != inspect.Signature.empty else Any
-            
-            commands_dict[name] = {
-                'func': func,
-                'param_types': param_types,
-                'return_type': return_type
-            }
-        return commands_dict
+        return dict(command_table())
 
     def _get_unused_identifier(self, hidden: bool = False, return_sequential: int = 0) -> str:
         """Get an unused identifier from the pool."""
         # arg hidden: use the secondary pool, because this ident is going to be missing from the translation anyway and we need to conserve good idents
-        id_pool = self.identifier_pool if self.identifier_pool and len(self.identifier_pool) > return_sequential and not hidden else self.secondary_identifier_pool
+        id_pool = self.identifier_pool if len(self.identifier_pool) > return_sequential and not hidden else self.secondary_identifier_pool
         if return_sequential > 0 and len(id_pool) > return_sequential:
-            identifier = id_pool.pop(0) # the next time we call this function, we will, by construction, get the next index
-        else:
-            idx = random.randrange(len(id_pool))
-            identifier = id_pool.pop(idx)
-        return identifier
+            return id_pool.draw_first() # the next time we call this function, we will, by construction, get the next index
+        return id_pool.draw()
 
     # Identifiers assigned in this specific way are not automatically removed from the identifier pool,
     # so user needs to make sure to do so themselves.
@@ -276,16 +391,26 @@ class ClassicalGenerator:
         """
         if label_factory is None:
             label_factory = self._get_unused_identifier
+        self.telemetry.record_attempt(cmd_name)
         try:
             if 'intersect' in cmd_name:
                 l1_constructed_by = input_elements[0].command
                 l2_constructed_by = input_elements[1].command
                 if 'orthogonal' in l1_constructed_by.name or 'orthogonal' in l2_constructed_by.name or 'bisector' in l1_constructed_by.name or 'bisector' in l2_constructed_by.name or 'tangent' in l1_constructed_by.name or 'tangent' in l2_constructed_by.name:
                     # we are trying to find the intersection of two lines, but likely one of them was constructed by being put through the other...
+                    self.telemetry.record_rejection(cmd_name)
                     return False, None
             command = Command(cmd_name, input_elements, label_factory=label_factory, label_dict=self.identifiers)
             command.apply()
             failed_command = False
+            # a command returning the wrong thing (e.g. None) would otherwise "succeed" and poison everything built on it
+            allowed_types = self._output_types.get(cmd_name)
+            if allowed_types is not None and not all(isinstance(output_elem.data, allowed_types) for output_elem in command.output_elements):
+                self.telemetry.record_type_mismatch(cmd_name)
+                for output_elem in command.output_elements:
+                    if output_elem.label in self.identifiers:
+                        del self.identifiers[output_elem.label]
+                return False, None
             for output_elem in command.output_elements:
                 try:
                     if isinstance(output_elem.data, gt.Line):
@@ -329,16 +454,28 @@ class ClassicalGenerator:
                     # undo the command, which here means we don't keep track of the elements it generated
                     if output_elem.label in self.identifiers:
                         del self.identifiers[output_elem.label]
+                self.telemetry.record_rejection(cmd_name)
                 return False, None
             if 'rotate_polygon' in cmd_name or cmd_name == 'polygon_from_center_and_circumradius':
                 self.poly_to_vertices[command.output_elements[-1]] = command.output_elements[:-1]
+            if cmd_name == 'polygon_from_center_and_circumradius':
+                self.made_polygon_already = True
             if cmd_name == 'triangle_ppp':
                 self.made_triangle_already = True
+            self.telemetry.record_success(cmd_name)
             return True, command
         except Exception as e:
             # traceback.print_exc()
+            self.telemetry.record_exception(cmd_name, e)
             return False, None
 
+    def _order_commands(self, command_names: List[str]) -> List[str]:
+        """Order in which to try commands: uniformly shuffled, or weighted by the sampling policy."""
+        if self.sampling_policy is None:
+            random.shuffle(command_names)
+            return command_names
+        return self.sampling_policy.order(command_names)
+
     def _sample_commands(self) -> Generator[str, None, None]:
         # Shuffle commands to try
         command_names = list(self.available_commands.keys())
@@ -353,7 +490,7 @@ class ClassicalGenerator:
                 yield 'equilateral_triangle'
             else:
                 yield 'point_'
-        random.shuffle(command_names)
+        command_names = self._order_commands(command_names)
         
 
 
@@ -392,7 +529,7 @@ class ClassicalGenerator:
             # decrease frequency of polygons
             if cmd_name == 'polygon_from_center_and_circumradius':
                 # make sure they only happen near the beginning of the sequence, which is more natural
-                if len(self.command_sequence) > 3:
+                if len(self.command_sequence) > POLYGON_WINDOW:
                     continue
                 # eliminate duplicates
                 if self.made_polygon_already:
@@ -408,11 +545,68 @@ class ClassicalGenerator:
         weights = [1, 2, 4, 1, 4, 1, 2, 1, 4]
         return random.choices(sides, weights)[0]
 
+    def _choose_input(self, cmd_name: str, candidates: List[Element], chosen: List[Element]) -> Element:
+        """Pick the next input of cmd_name among compatible candidates, given the inputs chosen so far."""
+        return random.choice(candidates)
+
+    def _execute_macro(self) -> Optional[Command]:
+        """
+        Apply a mined macro, chosen with probability proportional to its support and pass rate.
+        Every command of the macro but the last is added to the sequence here, and the last one is returned like a sampled command.
+        Returns None (and leaves no trace of the macro's commands) if the macro couldn't be applied.
+        """
+        weights = [macro.support * macro.pass_rate for macro, _ in self._macro_steps]
+        macro, steps = random.choices(self._macro_steps, weights)[0]
+        params: Dict[str, Element] = {}
+        produced: Dict[str, Element] = {}
+        applied: List[Command] = []
+        for cmd_name, input_refs, output_refs in steps:
+            param_types = self.available_commands[cmd_name]['param_types']
+            input_elements = []
+            valid_params = len(param_types) == len(input_refs)
+            for ref, param_type in zip(input_refs, param_types):
+                if not valid_params:
+                    break
+                if ref in produced:
+                    input_elements.append(produced[ref])
+                    continue
+                if ref not in params:
+                    # a parameter of the macro, filled like a command's input (distinct parameters get distinct elements)
+                    compatible = [element for element in self._find_compatible_elements(param_type) if element not in params.values()]
+                    if not compatible:
+                        valid_params = False
+                        break
+                    params[ref] = self._choose_input(cmd_name, compatible, input_elements)
+                input_elements.append(params[ref])
+            success, command = self._try_apply_command(cmd_name, input_elements) if valid_params else (False, None)
+            if success and len(command.output_elements) != len(output_refs):
+                applied.append(command)
+                success = False
+            if not success:
+                # undo the commands applied so far, which here means we don't keep track of the elements they generated
+                for command in applied:
+                    for output_elem in command.output_elements:
+                        if output_elem.label in self.identifiers:
+                            del self.identifiers[output_elem.label]
+                return None
+            applied.append(command)
+            for ref, output_elem in zip(output_refs, command.output_elements):
+                if ref != "_":
+                    produced[ref] = output_elem
+        for command in applied[:-1]:
+            self.command_sequence.append(command)
+            self._update_dependency_graph(command)
+        return applied[-1]
+
     def _execute_new_command(self) -> Command:
         """
         Sample a random command that can be executed with existing elements.
         Returns a tuple of (input_elements, command) or None if no valid command can be sampled.
         """
+        if self._macro_steps and self.command_sequence and random.random() < MACRO_PROBABILITY:
+            command = self._execute_macro()
+            if command is not None:
+                return command
         for cmd_name in self._sample_commands():
             cmd_info = self.available_commands[cmd_name]
             param_types = cmd_info['param_types']
@@ -426,7 +620,7 @@ class ClassicalGenerator:
                 compatible = self._find_compatible_elements(gt.Polygon)
                 if not compatible:
                     continue
-                polygon_element: Element = random.choice(compatible)
+                polygon_element: Element = self._choose_input(cmd_name, compatible, [])
                 n = len(polygon_element.data.points)
                 while True:
                     i, j = random.sample(range(n), 2)
@@ -457,7 +651,7 @@ class ClassicalGenerator:
                         break
                     
                     # Select a random compatible element
-                    selected = random.choice(available_elements)
+                    selected = self._choose_input(cmd_name, available_elements, input_elements)
                     input_elements.append(selected)
                     used_elements.add(selected)
             if valid_params:
@@ -475,18 +669,85 @@ class ClassicalGenerator:
         return None
 
 
-    def generate_construction(self, num_commands: int = 5) -> List[Command]:
-        """Generate a sequence of commands to form a valid construction."""
-        while len(self.command_sequence) < num_commands:
+    def generate_construction(self, num_commands: int = 5, max_iterations: Optional[int] = None, deadline: Optional[float] = None,
+                              min_num_commands: Optional[int] = None) -> List[Command]:
+        """
+        Generate a sequence of commands to form a valid construction.
+        Gives up early (with a shorter sequence) after max_iterations sampling rounds, or once time.monotonic() passes deadline,
+        so that an attempt which keeps failing to sample a command can't spin forever.
+        If min_num_commands is given, a construction which can no longer produce an acceptable measure target is
+        given up as soon as that's certain (see _doomed), and a new one started if there are enough iterations left.
+        """
+        iterations = 0
+        while not self._construction_complete(num_commands):
+            if max_iterations is not None and iterations >= max_iterations:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            iterations += 1
             # Sample a command that can be executed
             command = self._execute_new_command()
-            if command is None: # should not actually happen
+            if command is None: # can happen when we sample the wrong args for every command we try
                 continue
             self.command_sequence.append(command)
             self._update_dependency_graph(command)
+            if min_num_commands is not None:
+                self._track_new_nodes()
+                if self._doomed(num_commands, min_num_commands):
+                    if max_iterations is not None and max_iterations - iterations < num_commands:
+                        break # not enough iterations left for a new construction, just stop wasting them on this one
+                    self.telemetry.record_restart()
+                    self._reset_construction()
         
         return self.command_sequence
 
+    def _track_new_nodes(self):
+        """Update the cone sizes and the best measure target with the nodes added since the last call."""
+        for node in self.dependency_graph.order[len(self._cone_commands):]:
+            num_commands = len({id(other.command) for other in self.dependency_graph.nodes_in(node.cone)
+                                if other.command is not None and not isinstance(other.command, ConstCommand)})
+            self._cone_commands.append(num_commands)
+            if num_commands + 1 <= self._best_target_commands or not any(isinstance(node.element.data, m_type) for m_type in MEASURABLE_TYPES):
+                continue
+            try:
+                if self._is_degenerate_target(node):
+                    continue
+            except Exception:
+                continue
+            self._best_target_commands = num_commands + 1
+
+    def _doomed(self, num_commands: int, min_num_commands: int) -> bool:
+        """
+        Whether the rest of the construction (up to num_commands commands) certainly can't produce a measure target
+        which _build_target_construction accepts. Only certain failures count, so no construction that could pass is thrown away.
+        """
+        remaining = max(0, self._max_length(num_commands) - len(self.command_sequence)) # macros can overshoot
+        if self._best_target_commands < min_num_commands:
+            # every new command takes at most _max_arity inputs, so after `remaining` more commands the deepest cone
+            # contains at most the commands of the _max_arity ** remaining largest cones so far, plus the new ones
+            if remaining < 8:
+                largest = sum(heapq.nlargest(self._max_arity ** remaining, self._cone_commands))
+            else:
+                largest = len(self.command_sequence)
+            if min(largest, len(self.command_sequence)) + remaining + 1 < min_num_commands: # +1 for the measure command
+                return True
+        required = self._required_interesting_commands()
+        if required and not any(cmd.name in required for cmd in self.command_sequence if not isinstance(cmd, ConstCommand)):
+            # polygon commands need a polygon, and polygons can only be made near the beginning
+            reachable = set(required) - set(polygon_commands)
+            if self.made_polygon_already or self._macro_polygons or len(self.command_sequence) <= POLYGON_WINDOW:
+                reachable |= set(required)
+            if not reachable & set(self.available_commands):
+                return True
+        return False
+
+    def _construction_complete(self, num_commands: int) -> bool:
+        return len(self.command_sequence) >= num_commands
+
+    def _max_length(self, num_commands: int) -> int:
+        """The most commands generate_construction(num_commands) can end up with."""
+        return num_commands
+
     def prune_construction(self, min_num_commands: int = 8):
         """
         Prune the construction to include only the commands needed to construct the longest quantity. Do this to make it faster to produce longer constructions.
@@ -510,92 +771,72 @@ class ClassicalGenerator:
         """
         Find the commands needed to construct the target node.
         """
-        required_commands = set()
-        visited = set()
-
-        def dfs(node):
-            if node.element.label in visited:
-                return
-            visited.add(node.element.label)
-            for parent in node.parents:
-                dfs(parent)
-            if node.command:
-                required_commands.add(node.command)
-        
-        dfs(target_node)
+        required_commands = self.dependency_graph.necessary_commands(target_node)
         # Convert to list and sort by original command order
         command_order = {cmd: i for i, cmd in enumerate(self.command_sequence)}
         ordered_commands = sorted(required_commands, key=lambda cmd: command_order.get(cmd, float('inf')))
         return ordered_commands
 
-    def compute_longest_construction(self, j, min_num_commands: int = 8):
-        """
-        Find the measurable quantity with the most ancestors and create a pruned
-        construction sequence that includes only the commands needed to construct it.
-        """
-        # Find all measurable quantities
+    def _measurable_nodes(self) -> List[Node]:
+        """All nodes in the dependency graph whose element is of a measurable type."""
         measurable_nodes = []
         for label, node in self.dependency_graph.nodes.items():
             element = node.element
             # Check if the element's data is a measurable type
             if any(isinstance(element.data, m_type) for m_type in MEASURABLE_TYPES):
                 measurable_nodes.append(node)
-        while True:
-            if not measurable_nodes:
-                # If no measurable quantities found, keep the original sequence
-                self.pruned_command_sequence = self.command_sequence.copy()
-                return False
-            # Find the measurable quantity with the most ancestors
-            target_node = max(measurable_nodes, key=lambda node: node.ancestor_count)
-            if target_node.command.name == 'chord_c' or target_node.command.input_elements[0].command.name == 'chord_c':
-                # degenerate construction, chord is constructed by length, and we are either measuring it directly or one of the points that came out of it
-                measurable_nodes.remove(target_node)
-                continue
-            if target_node.command.name == 'radius_c':
-                radius_command = target_node.command
-                radius_found_by = radius_command.input_elements[0].command.name
-                if radius_found_by in ('circle_pp', 'circle_pm', 'mirror_cp', 'mirror_cl') or 'tangent' in radius_found_by:
-                    # degenerate construction, we started with the radius, contructed a circle, and then measured the radius.
-                    measurable_nodes.remove(target_node)
-                    continue
-            if target_node.command.name == 'distance_pp' or target_node.command.name == 'segment_pp':
-                inputs = target_node.command.input_elements
-                for input_order in ((inputs[0], inputs[1]), (inputs[1], inputs[0])):
-                    p2_constructed_by = input_order[1].command
-                    if (p2_constructed_by.name == 'mirror_pp' and p2_constructed_by.input_elements[1] == input_order[0]) \
-                    or ('rotate' in p2_constructed_by.name and p2_constructed_by.input_elements[2] == input_order[0]):
-                        # degenerate construction, we measured a mirrored/rotated point's distance, which is the same distance.
-                        measurable_nodes.remove(target_node)
-                    continue
-                dist_names = ('point_pm', 'point_at_distance_along_line', 'point_c', 'translate_pv')
-                if target_node.command.input_elements[0].command.name in dist_names or target_node.command.input_elements[1].command.name in dist_names:
-                    # degenerate construction, we started with the distance, constructed a point, and then measured the distance.
-                    # strictly speaking we need to check that the other arg is the other point in distance_pp, but i don't care, we can throw away some extras.
-                    measurable_nodes.remove(target_node)
-                    continue
-            if target_node.command.name == 'angle_ppp':
-                if not 'pi' in invert_pi_expression(target_node.element.data.angle):
-                    measurable_nodes.remove(target_node)
-                    continue
-                if np.isclose(target_node.element.data.angle, np.pi): # degenerate angle, things lie on a straight line...
-                    measurable_nodes.remove(target_node)
-                    continue
-                if np.isclose(target_node.element.data.angle, np.pi/2): # probably constructed explicitly via perpendicular line, so kind of stupid
-                    measurable_nodes.remove(target_node)
-                    continue
-                p3_constructed_by = target_node.command.input_elements[2].command
-                p1_constructed_by = target_node.command.input_elements[0].command
-                if 'rotate' in p1_constructed_by.name or 'rotate' in p3_constructed_by.name:
-                    # this condition isn't strict enough, but basically paranoidly remove dumb angle constructions
-                    measurable_nodes.remove(target_node)
-                    continue
-            break
-        
+        return measurable_nodes
+
+    def _is_degenerate_target(self, target_node: Node) -> bool:
+        """Heuristics for measure targets which are trivially determined by how they were constructed."""
+        first_input = target_node.command.input_elements[0] if target_node.command.input_elements else None
+        if target_node.command.name == 'chord_c' or (first_input is not None and first_input.command is not None and first_input.command.name == 'chord_c'):
+            # degenerate construction, chord is constructed by length, and we are either measuring it directly or one of the points that came out of it
+            return True
+        if target_node.command.name == 'radius_c':
+            radius_command = target_node.command
+            radius_found_by = radius_command.input_elements[0].command.name
+            if radius_found_by in ('circle_pp', 'circle_pm', 'mirror_cp', 'mirror_cl') or 'tangent' in radius_found_by:
+                # degenerate construction, we started with the radius, contructed a circle, and then measured the radius.
+                return True
+        if target_node.command.name == 'distance_pp' or target_node.command.name == 'segment_pp':
+            inputs = target_node.command.input_elements
+            for input_order in ((inputs[0], inputs[1]), (inputs[1], inputs[0])):
+                p2_constructed_by = input_order[1].command
+                if (p2_constructed_by.name == 'mirror_pp' and p2_constructed_by.input_elements[1] == input_order[0]) \
+                or ('rotate' in p2_constructed_by.name and len(p2_constructed_by.input_elements) > 2 and p2_constructed_by.input_elements[2] == input_order[0]):
+                    # degenerate construction, we measured a mirrored/rotated point's distance, which is the same distance.
+                    return True
+            dist_names = ('point_pm', 'point_at_distance_along_line', 'point_c', 'translate_pv')
+            if target_node.command.input_elements[0].command.name in dist_names or target_node.command.input_elements[1].command.name in dist_names:
+                # degenerate construction, we started with the distance, constructed a point, and then measured the distance.
+                # strictly speaking we need to check that the other arg is the other point in distance_pp, but i don't care, we can throw away some extras.
+                return True
+        if target_node.command.name == 'angle_ppp':
+            if not 'pi' in invert_pi_expression(target_node.element.data.angle):
+                return True
+            if np.isclose(target_node.element.data.angle, np.pi): # degenerate angle, things lie on a straight line...
+                return True
+            if np.isclose(target_node.element.data.angle, np.pi/2): # probably constructed explicitly via perpendicular line, so kind of stupid
+                return True
+            p3_constructed_by = target_node.command.input_elements[2].command
+            p1_constructed_by = target_node.command.input_elements[0].command
+            if 'rotate' in p1_constructed_by.name or 'rotate' in p3_constructed_by.name:
+                # this condition isn't strict enough, but basically paranoidly remove dumb angle constructions
+                return True
+        return False
+
+    def _build_target_construction(self, target_node: Node, min_num_commands: int = 8) -> bool:
+        """
+        Build the pruned command sequence measuring target_node, with fresh readable labels.
+        Sets self.pruned_command_sequence and returns True if the result is acceptable.
+        """
         ordered_commands = self.find_necessary_commands(target_node)
 
         # Add a measure command for the target node
         # Create a new measure command for the target element
-        measure_command = Command('measure', [target_node.element], label_dict=self.identifiers)
+        # (its output is kept out of self.identifiers so that several targets can be measured from the same run)
+        measure_command = Command('measure', [target_node.element], label_dict={})
         measure_command.apply()
         self._update_dependency_graph(measure_command)
         ordered_commands.append(measure_command)        
@@ -654,14 +895,8 @@ class ClassicalGenerator:
             return False
 
         # we still need to check for this, because in principle we could always just construct something with only basic commands.
-        if 'all' not in self.command_types and self.command_types != ['basic']:
-            required_interesting_commands = []
-            if 'triangle' in self.command_types:
-                required_interesting_commands.extend(triangle_commands)
-            if 'polygon' in self.command_types:
-                required_interesting_commands.extend(polygon_commands)
-            if 'circle' in self.command_types:
-                required_interesting_commands.extend(circle_commands)
+        required_interesting_commands = self._required_interesting_commands()
+        if required_interesting_commands:
             found = False
             for cmd in ordered_commands:
                 if isinstance(cmd, ConstCommand):
@@ -671,57 +906,340 @@ class ClassicalGenerator:
                     break
             if not found:
                 return False
+        if not self._accept_construction(ordered_commands):
+            return False
         self.pruned_command_sequence = ordered_commands
         return True
 
+    def _required_interesting_commands(self) -> List[str]:
+        """Commands of which a construction must contain at least one for the command types it was generated with (none if any will do)."""
+        required_interesting_commands = []
+        if self.command_types and 'all' not in self.command_types and self.command_types != ['basic']:
+            if 'triangle' in self.command_types:
+                required_interesting_commands.extend(triangle_commands)
+            if 'polygon' in self.command_types:
+                required_interesting_commands.extend(polygon_commands)
+            if 'circle' in self.command_types:
+                required_interesting_commands.extend(circle_commands)
+        return required_interesting_commands
+
+    def _accept_construction(self, ordered_commands: List[Command]) -> bool:
+        """Hook for subclasses to impose extra requirements on a pruned construction (which ends in its measure command)."""
+        return True
+
+    def compute_measure_targets(self, j, max_targets: int = 1, min_num_commands: int = 8, min_target_distance: float = 0.5) -> Generator[List[Command], None, None]:
+        """
+        Rank every non-degenerate measurable quantity by its number of ancestors, and yield a pruned
+        construction for each of up to max_targets of them.
+        A target is skipped if the Jaccard distance between its ancestor set and that of a target
+        already yielded is below min_target_distance, so that the constructions are meaningfully different.
+        Labels are reassigned for every target, so each construction has to be consumed (e.g. saved)
+        before the next one is requested.
+        """
+        measurable_nodes = self._measurable_nodes()
+        if not measurable_nodes:
+            # If no measurable quantities found, keep the original sequence
+            self.pruned_command_sequence = self.command_sequence.copy()
+            return
+        measurable_nodes.sort(key=lambda node: node.ancestor_count, reverse=True)
+        chosen_cones: List[int] = []
+        for target_node in measurable_nodes:
+            if len(chosen_cones) >= max_targets:
+                return
+            # _build_target_construction counts the cone's non-const commands plus the measure command; every command in the
+            # cone has an output in it, so that is at most ancestor_count + 1 + 1
+            if target_node.ancestor_count + 2 < min_num_commands:
+                # the cone can't contain enough commands, and the rest of the list is even smaller
+                return
+            if self._is_degenerate_target(target_node):
+                continue
+            cone = target_node.cone
+            if any(1 - (cone & other).bit_count() / (cone | other).bit_count() < min_target_distance for other in chosen_cones):
+                continue
+            if not self._build_target_construction(target_node, min_num_commands=min_num_commands):
+                continue
+            chosen_cones.append(cone)
+            yield self.pruned_command_sequence
+
+    def compute_longest_construction(self, j, min_num_commands: int = 8):
+        """
+        Find the measurable quantity with the most ancestors and create a pruned
+        construction sequence that includes only the commands needed to construct it.
+        """
+        for _ in self.compute_measure_targets(j, max_targets=1, min_num_commands=min_num_commands):
+            return True
+        return False
+
+    def format_construction(self, description: str = "Generated construction") -> str:
+        """The pruned construction in the construction file format."""
+        lines = [f"# {description}"]
+        if self.seed_sequence is not None:
+            lines.append(f"# seed: {describe_seed(self.seed_sequence)}")
+        lines += [f"{cmd}" for cmd in self.pruned_command_sequence]
+        return "\n".join(lines) + "\n"
+
     def save_construction(self, filename: str, description: str = "Generated construction"):
         with open(filename, 'w') as f:
-            f.write(f"# {description}\n")
-            for cmd in self.pruned_command_sequence:
-                f.write(f"{cmd}\n")
+            f.write(self.format_construction(description))
 
 
-def write_construction(i, args):
-    seed = args.seed + i if args.seed is not None else None
-    generator_class = args.generator_class
-    generator = generator_class(seed=seed, command_types=args.command_types)
-    generator.generate_construction(num_commands=args.num_commands)
-    
-    # Prune the construction to include only essential commands
-    success = generator.compute_longest_construction(i, min_num_commands=args.min_num_commands)
-    if not success:
-        return
+# the generator each process (the driver, or a pool worker) reuses for its attempts, and the settings it was made with
+_worker_generator: Optional[ClassicalGenerator] = None
+_worker_generator_key = None
+
+def _generator_for(args, seed_sequence) -> ClassicalGenerator:
+    """A generator reset for a new attempt; it's only constructed again when the generator settings change (e.g. in the next pipeline round)."""
+    global _worker_generator, _worker_generator_key
+    key = (repr(args.generator_class), tuple(args.command_types or ()), tuple(macro.form for macro in args.macros or ()))
+    if _worker_generator is None or key != _worker_generator_key:
+        _worker_generator = args.generator_class(seed=seed_sequence, command_types=args.command_types, sampling_policy=args.sampling_policy, macros=args.macros)
+        _worker_generator_key = key
+    else:
+        # the policy is updated between pipeline rounds, and is only used for sampling, so it's swapped in rather than keyed on
+        _worker_generator.sampling_policy = args.sampling_policy
+        _worker_generator.reset(seed_sequence)
+    return _worker_generator
+
+def generate_attempt(i, args) -> Tuple[List[Tuple[str, str, str]], CommandTelemetry]:
+    """
+    Run generation attempt i. Returns the attempt's constructions as (filename, contents, canonical hash) tuples,
+    and its command telemetry; the driver saves the constructions which aren't duplicates.
+    """
+    # an independent stream per attempt, whichever worker runs it
+    seed_sequence = attempt_seed_sequence(args.seed_entropy, i)
+    generator = _generator_for(args, seed_sequence)
+    deadline = time.monotonic() + args.attempt_timeout if args.attempt_timeout else None
+    generator.generate_construction(num_commands=args.num_commands, max_iterations=args.max_iterations, deadline=deadline, min_num_commands=args.min_num_commands)
     
-    # Create unique filename if generating multiple constructions
-    filename = os.path.join(args.output_dir, f"construction_{i+1}.txt")
-        
-    generator.save_construction(filename, f"Generated construction #{i+1}")
+    # Prune the construction to include only essential commands, once per extracted measure target
+    targets = generator.compute_measure_targets(i, max_targets=args.targets_per_run, min_num_commands=args.min_num_commands, min_target_distance=args.min_target_distance)
+    constructions = []
+    for k, _ in enumerate(targets):
+        # Create unique filename if generating multiple constructions
+        if k == 0:
+            filename = os.path.join(args.output_dir, f"construction_{i+1}.txt")
+        else:
+            filename = os.path.join(args.output_dir, f"construction_{i+1}_{k+1}.txt")
+        contents = generator.format_construction(f"Generated construction #{i+1}" + (f", target {k+1}" if k else ""))
+        constructions.append((filename, contents, canonical_hash(generator.pruned_command_sequence)))
+    return constructions, generator.telemetry
 
-def parse_args():
+def save_constructions(constructions: List[Tuple[str, str, str]]):
+    for filename, contents, _ in constructions:
+        with open(filename, 'w') as f:
+            f.write(contents)
+
+def store_constructions(store: ConstructionStore, constructions: List[Tuple[str, str, str]], attempt: int, seed_entropy: int):
+    """
+    Append an attempt's constructions to a ConstructionStore, keyed by filename, instead of writing a file for each,
+    and their canonical hashes to "canonical", whose index is the set of constructions seen;
+    then mark the attempt as done (under its index, in "attempts"), so that a resumed run doesn't repeat it.
+    """
+    for filename, contents, key in constructions:
+        store.append("constructions", {"key": os.path.basename(filename), "attempt": attempt, "seed_entropy": seed_entropy,
+                                       "canonical_hash": key, "text": contents})
+        store.append("canonical", {"key": key, "construction": os.path.basename(filename)})
+    store.append("attempts", {"key": str(attempt), "constructions": [os.path.basename(filename) for filename, _, _ in constructions]})
+
+class GenerationProgress:
+    """Counts for a generation run, the stopping rule for target-count / time-budget modes, and live yield and remaining-time estimates."""
+    def __init__(self, max_attempts: Optional[int] = None, target_count: Optional[int] = None, time_budget: Optional[float] = None, report_interval: float = 10.0,
+                 keep_duplicates: bool = False):
+        self.max_attempts = max_attempts
+        self.target_count = target_count
+        self.time_budget = time_budget
+        self.report_interval = report_interval
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+        self.attempts = 0
+        self.written = 0
+        self.errors = 0
+        # attempts done before, e.g. by the run being resumed
+        self.skipped = 0
+        self.duplicates = 0
+        self.telemetry = CommandTelemetry()
+        # canonical hashes of the constructions written so far (see canonical.py)
+        self.seen: Set[str] = set()
+        self.keep_duplicates = keep_duplicates
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def record(self, result: Tuple[List[Tuple[str, str, str]], CommandTelemetry]) -> List[Tuple[str, str, str]]:
+        """Count a finished attempt. Returns the (filename, contents, canonical hash) of its constructions which should be saved."""
+        constructions, telemetry = result
+        self.attempts += 1
+        self.telemetry.merge(telemetry)
+        to_save = []
+        for filename, contents, key in constructions:
+            if key in self.seen and not self.keep_duplicates:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+            to_save.append((filename, contents, key))
+        self.written += len(to_save)
+        return to_save
+
+    def record_error(self):
+        self.attempts += 1
+        self.errors += 1
+
+    def done(self, num_started: int) -> bool:
+        """Whether to stop starting new attempts."""
+        if self.max_attempts is not None and num_started >= self.max_attempts:
+            return True
+        if self.target_count is not None and self.written >= self.target_count:
+            return True
+        if self.time_budget is not None and self.elapsed() >= self.time_budget:
+            return True
+        return False
+
+    def summary(self) -> str:
+        elapsed = self.elapsed()
+        yield_rate = self.written / self.attempts if self.attempts else 0.0
+        rate = self.written / elapsed if elapsed > 0 else 0.0
+        message = f"{self.attempts} attempts, {self.written} constructions written ({100 * yield_rate:.1f}% yield, {rate:.2f}/s), {self.duplicates} duplicates dropped, {self.errors} errors, {elapsed:.0f}s elapsed"
+        if self.skipped:
+            message += f", {self.skipped} attempts done before skipped"
+        if self.target_count is not None and rate > 0:
+            message += f", ~{max(0, self.target_count - self.written) / rate:.0f}s to target"
+        if self.time_budget is not None:
+            message += f", {max(0.0, self.time_budget - elapsed):.0f}s of budget left"
+        return message
+
+    def maybe_report(self):
+        if time.monotonic() - self.last_report_time >= self.report_interval:
+            self.last_report_time = time.monotonic()
+            print(self.summary())
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Generate classical geometric constructions")
-    parser.add_argument("--seed", type=int, help="Random seed for reproducibility")
+    parser.add_argument("--seed", type=int, help="Root seed for reproducibility; attempt i draws from SeedSequence(seed, spawn_key=(i,))")
     parser.add_argument("--num_commands", type=int, default=25, help="Number of commands to generate")
     parser.add_argument("--output_dir", type=str, default="generated_constructions/", help="Output directory")
     # note as a result of the multiprocessing, this is the number of construction attempts, not the number of constructions actually generated
-    parser.add_argument("--count", type=int, default=20, help="Number of constructions to attempt")
+    parser.add_argument("--count", type=int, default=None, help="Number of constructions to attempt (default 20, or unlimited with --target_count/--time_budget)")
+    parser.add_argument("--telemetry_output", type=str, default=None, help="Write per-command attempt/success/exception counts to this JSON file")
+    parser.add_argument("--health_min_attempts", type=int, default=50, help="Only flag commands as broken after this many attempts")
+    parser.add_argument("--health_flag_rate", type=float, default=0.01, help="Flag commands whose success rate is at most this")
+    parser.add_argument("--first_attempt", type=int, default=0, help="Index of the first attempt (offsets seeds and filenames)")
+    parser.add_argument("--target_count", type=int, default=None, help="Stop once this many constructions have been written")
+    parser.add_argument("--time_budget", type=float, default=None, help="Stop starting new attempts after this many seconds")
+    parser.add_argument("--attempt_timeout", type=float, default=30.0, help="Per-attempt cap in seconds on generating the command sequence (0 for none)")
+    parser.add_argument("--max_iterations", type=int, default=None, help="Per-attempt cap on command sampling rounds (default 10 * num_commands)")
+    parser.add_argument("--keep_duplicates", action="store_true", help="Also write constructions which are the same as one already written (up to labels and command order)")
     parser.add_argument("--min_num_commands", type=int, default=8, help="Minimum number of commands in the output sequence")
+    parser.add_argument("--targets_per_run", type=int, default=1, help="Maximum number of measure targets (and output files) to extract from each generated sequence")
+    parser.add_argument("--min_target_distance", type=float, default=0.5, help="Minimum Jaccard distance between the ancestor sets of targets extracted from the same sequence")
     parser.add_argument("--max_workers", type=int, default=16, help="Maximum number of threads to use")
     parser.add_argument("--multiprocess", action="store_true", help="use multiprocessing")
     parser.add_argument("--command_types", type=str, nargs="+", choices=["polygon", "circle", "triangle", "basic", "all"], default=["all"],
                         help="Types of geometric commands to include")
-    args = parser.parse_args()
-    return args
+    parser.add_argument("--sampling_policy_file", type=str, default=None, help="State file of the learned command sampling weights (default: sample commands uniformly)")
+    parser.add_argument("--uniform_sampling", action="store_true", help="Ignore --sampling_policy_file and sample commands uniformly (for unbiased baselines)")
+    parser.add_argument("--macro_library", type=str, default=None, help="Macro library written by macro_miner.py; some steps then apply a whole macro")
+    parser.add_argument("--store", type=str, default=None, help="Append the constructions to this construction store (see construction_store.py) instead of writing a file each to --output_dir")
+    return parser
 
-def main(args):
-    # Create output directory if it doesn't exist
-    os.makedirs(args.output_dir, exist_ok=True)
+def parse_args():
+    return build_parser().parse_args()
+
+def prepare_args(args):
+    """Load what the generation attempts need (sampling policy, macros, seed entropy) into args, and fill in the defaults."""
+    args.sampling_policy = load_policy(args)
+    args.macros = load_macros(args.macro_library) if args.macro_library else None
+    if args.macros:
+        print(f"Loaded {len(args.macros)} macros from {args.macro_library}")
+    args.seed_entropy = root_entropy(args.seed)
+    print(f"Seed entropy: {args.seed_entropy} (pass as --seed to reproduce this run)")
+    if args.count is None and args.target_count is None and args.time_budget is None:
+        args.count = 20
+    if args.max_iterations is None:
+        args.max_iterations = 10 * args.num_commands
+
+def main(args) -> GenerationProgress:
+    prepare_args(args)
+    progress = GenerationProgress(max_attempts=args.count, target_count=args.target_count, time_budget=args.time_budget,
+                                  keep_duplicates=args.keep_duplicates)
+    store = open_store(args.store) if args.store else None
+    if store is not None:
+        # constructions already in the store (e.g. from earlier pipeline rounds) count as seen
+        progress.seen.update(store.keys("canonical"))
+    else:
+        # Create output directory if it doesn't exist
+        os.makedirs(args.output_dir, exist_ok=True)
+        # likewise for the constructions already in the output directory
+        for filename in os.listdir(args.output_dir):
+            if filename.endswith(".txt"):
+                try:
+                    with open(os.path.join(args.output_dir, filename), 'r') as f:
+                        progress.seen.add(canonical_hash_text(f.read()))
+                except Exception as e:
+                    print(f"Could not hash existing construction {filename}: {e}")
+
+    def save(constructions, attempt):
+        if store is None:
+            save_constructions(constructions)
+        else:
+            store_constructions(store, constructions, attempt, args.seed_entropy)
+
+    def done_before(attempt):
+        return store is not None and store.has("attempts", str(attempt))
+    # attempt indices (and with them seeds and filenames) continue from first_attempt, so that repeated calls don't collide
     if not args.multiprocess:
-        for i in range(args.count):
-            write_construction(i, args)
+        for i in itertools.count():
+            if progress.done(i):
+                break
+            if done_before(args.first_attempt + i):
+                progress.skipped += 1
+                continue
+            try:
+                save(progress.record(generate_attempt(args.first_attempt + i, args)), args.first_attempt + i)
+            except Exception as e:
+                print(f"Error in generation attempt: {e}")
+                progress.record_error()
+                save([], args.first_attempt + i)
+            progress.maybe_report()
     else:
         with concurrent.futures.ProcessPoolExecutor(max_workers=args.max_workers) as executor:
-            futures = [executor.submit(write_construction, i, args) for i in range(args.count)]
-            concurrent.futures.wait(futures)
+            # keep a bounded number of attempts in flight, so that we can stop as soon as the target is met
+            in_flight = {}  # future -> attempt index
+            num_started = 0
+            while True:
+                while len(in_flight) < 2 * args.max_workers and not progress.done(num_started):
+                    if done_before(args.first_attempt + num_started):
+                        progress.skipped += 1
+                        num_started += 1
+                        continue
+                    in_flight[executor.submit(generate_attempt, args.first_attempt + num_started, args)] = args.first_attempt + num_started
+                    num_started += 1
+                if not in_flight:
+                    break
+                finished, _ = concurrent.futures.wait(in_flight, timeout=progress.report_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    attempt = in_flight.pop(future)
+                    try:
+                        save(progress.record(future.result()), attempt)
+                    except Exception as e:
+                        print(f"Error in generation attempt: {e}")
+                        progress.record_error()
+                        save([], attempt)
+                progress.maybe_report()
+                if progress.done(num_started):
+                    # drop attempts which haven't started yet, and let the running ones finish
+                    for future in list(in_flight):
+                        if future.cancel():
+                            del in_flight[future]
+    if store is not None:
+        store.close()
+    print(f"Generation finished: {progress.summary()}")
+    if progress.duplicates:
+        print(f"Dropped {progress.duplicates} duplicate constructions before discrimination, translation and grading")
+    print(progress.telemetry.report(min_attempts=args.health_min_attempts, max_success_rate=args.health_flag_rate))
+    if args.telemetry_output:
+        progress.telemetry.save(args.telemetry_output)
+        print(f"Wrote command telemetry to {args.telemetry_output}")
+    return progress
 
 
 if __name__ == "__main__":
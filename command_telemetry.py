@@ -0,0 +1,120 @@
+# Per-command health counters for the generator (successes, exceptions, wrong output types, rejections),
+# merged from the workers and printed at the end of a run.
+
+import json
+import typing
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def allowed_output_types(return_type) -> Optional[Tuple[type, ...]]:
+    """
+    Classes an output element of a command annotated with return_type may have, or None if it can't be checked.
+    e.g. List[gt.Point] -> (gt.Point,), Union[gt.Polygon, gt.Point] -> (gt.Polygon, gt.Point)
+    """
+    if return_type is Any:
+        return None
+    if isinstance(return_type, type):
+        return (return_type,)
+    args = typing.get_args(return_type)
+    if not args:
+        return None
+    allowed = []
+    for arg in args:
+        if arg is Ellipsis:
+            continue
+        arg_types = allowed_output_types(arg)
+        if arg_types is None:
+            return None
+        allowed.extend(arg_types)
+    return tuple(allowed)
+
+
+class CommandTelemetry:
+    def __init__(self):
+        self.attempts: Counter = Counter()
+        self.successes: Counter = Counter()
+        self.rejections: Counter = Counter()
+        self.type_mismatches: Counter = Counter()
+        self.exceptions: Dict[str, Counter] = {}  # command name -> exception type name -> count
+        self.restarts = 0  # constructions thrown away as soon as they couldn't produce a valid problem any more
+
+    def record_attempt(self, cmd_name: str):
+        self.attempts[cmd_name] += 1
+
+    def record_success(self, cmd_name: str):
+        self.successes[cmd_name] += 1
+
+    def record_rejection(self, cmd_name: str):
+        self.rejections[cmd_name] += 1
+
+    def record_type_mismatch(self, cmd_name: str):
+        self.type_mismatches[cmd_name] += 1
+
+    def record_exception(self, cmd_name: str, exception: BaseException):
+        self.exceptions.setdefault(cmd_name, Counter())[type(exception).__name__] += 1
+
+    def record_restart(self):
+        self.restarts += 1
+
+    def merge(self, other: 'CommandTelemetry'):
+        self.restarts += other.restarts
+        self.attempts.update(other.attempts)
+        self.successes.update(other.successes)
+        self.rejections.update(other.rejections)
+        self.type_mismatches.update(other.type_mismatches)
+        for cmd_name, counts in other.exceptions.items():
+            self.exceptions.setdefault(cmd_name, Counter()).update(counts)
+
+    def success_rate(self, cmd_name: str) -> float:
+        return self.successes[cmd_name] / self.attempts[cmd_name] if self.attempts[cmd_name] else 0.0
+
+    def flagged_commands(self, min_attempts: int = 50, max_success_rate: float = 0.01) -> List[str]:
+        """Commands which were tried often enough to judge, and (nearly) never succeeded."""
+        return sorted(cmd_name for cmd_name, attempts in self.attempts.items()
+                      if attempts >= min_attempts and self.success_rate(cmd_name) <= max_success_rate)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            cmd_name: {
+                "attempts": self.attempts[cmd_name],
+                "successes": self.successes[cmd_name],
+                "rejections": self.rejections[cmd_name],
+                "type_mismatches": self.type_mismatches[cmd_name],
+                "exceptions": dict(self.exceptions.get(cmd_name, {})),
+            }
+            for cmd_name in sorted(self.attempts)
+        }
+
+    def save(self, filename: str):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def health_table(self, max_rows: Optional[int] = 25) -> str:
+        """Commands sorted from least to most successful, with their most common failure."""
+        rows = [f"{'command':45s} {'attempts':>9s} {'success%':>9s} {'rejected':>9s} {'bad type':>9s}  most common exception"]
+        cmd_names = sorted(self.attempts, key=lambda cmd_name: (self.success_rate(cmd_name), -self.attempts[cmd_name]))
+        for cmd_name in cmd_names[:max_rows]:
+            exceptions = self.exceptions.get(cmd_name)
+            top_exception = "-"
+            if exceptions:
+                exception_name, count = exceptions.most_common(1)[0]
+                top_exception = f"{exception_name} ({count})"
+            rows.append(f"{cmd_name:45s} {self.attempts[cmd_name]:9d} {100 * self.success_rate(cmd_name):9.2f} "
+                        f"{self.rejections[cmd_name]:9d} {self.type_mismatches[cmd_name]:9d}  {top_exception}")
+        if max_rows is not None and len(cmd_names) > max_rows:
+            rows.append(f"... {len(cmd_names) - max_rows} more commands")
+        return "\n".join(rows)
+
+    def report(self, min_attempts: int = 50, max_success_rate: float = 0.01, max_rows: Optional[int] = 25) -> str:
+        lines = ["Command health:", self.health_table(max_rows)]
+        if self.restarts:
+            lines.append(f"{self.restarts} doomed constructions were restarted early")
+        flagged = self.flagged_commands(min_attempts, max_success_rate)
+        if flagged:
+            lines.append(f"WARNING: {len(flagged)} commands succeeded in at most {100 * max_success_rate:.1f}% of {min_attempts}+ attempts, "
+                         f"and may be broken: {', '.join(flagged)}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"CommandTelemetry({sum(self.attempts.values())} attempts over {len(self.attempts)} commands)"
@@ -246,7 +246,8 @@ def intersect_lc(line: gt.Line, circle: gt.Circle) -> List[gt.Point]:
         gt.Point(x*line.v + y*line.n + circle.c),
         gt.Point(-x*line.v + y*line.n + circle.c),
     ]
-    return random.shuffle(intersections)
+    random.shuffle(intersections)
+    return intersections
 
 def intersect_cc(circle1: gt.Circle, circle2: gt.Circle) -> List[gt.Point]:
     center_diff = circle2.c - circle1.c
@@ -268,7 +269,8 @@ def intersect_cc(circle1: gt.Circle, circle2: gt.Circle) -> List[gt.Point]:
         gt.Point(center + center_dev)
         for center_dev in center_deviation * 0.5*gt.vector_perp_rot(center_diff) / center_dist_squared
     ]
-    return random.shuffle(intersections)
+    random.shuffle(intersections)
+    return intersections
 
 def intersect_cl(c: gt.Circle, l: gt.Line) -> List[gt.Point]:
     return intersect_lc(l,c)
@@ -626,7 +628,7 @@ def diagonal_p(p1: gt.Point, p2: gt.Point) -> gt.Segment:
 
         
 
-def externally_tangent_c(new_radius: int, c1: gt.Circle) -> gt.Circle:
+def externally_tangent_c(new_radius: int, c1: gt.Circle) -> List[Union[gt.Point, gt.Circle]]:
     """Create a circle that is externally tangent to the given circle c1.
     Returns the new circle and its center point."""
     # Choose a random direction for the new circle's center
@@ -643,7 +645,7 @@ def externally_tangent_c(new_radius: int, c1: gt.Circle) -> gt.Circle:
     
     return [new_center, new_circle]
 
-def internally_tangent_c(new_radius: int, c1: gt.Circle) -> gt.Circle:
+def internally_tangent_c(new_radius: int, c1: gt.Circle) -> List[Union[gt.Point, gt.Circle]]:
     """Create a circle that is internally tangent to the given circle c1.
     Returns the new circle and its center point."""
     assert(new_radius < c1.r)
@@ -714,7 +716,7 @@ def chord_c(length: Union[gt.Measure, int], circle: gt.Circle) -> Tuple[gt.Point
     return pt1, pt2, seg
     
 # this one is special, can only be sampled first
-def equilateral_triangle(side_length: Union[gt.Measure, int]) -> gt.Triangle:
+def equilateral_triangle(side_length: Union[gt.Measure, int]) -> Tuple[gt.Triangle, gt.Point, gt.Point, gt.Point, gt.Segment, gt.Segment, gt.Segment]:
     if isinstance(side_length, gt.Measure):
         side_length = side_length.x
     assert side_length > 0, "Side length must be positive"
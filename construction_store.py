@@ -0,0 +1,183 @@
+# Sharded, append-only store of a run's records (JSONL shards with a key -> offset index per stage, and a manifest.json),
+# replacing the per-file directories for long runs. One process writes a store; its stages share it via open_store.
+
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+SHARD_RECORDS = 100000
+
+_stores: Dict[str, "ConstructionStore"] = {}
+
+
+class ConstructionStore:
+    def __init__(self, directory: str, shard_records: int = SHARD_RECORDS, meta: Optional[dict] = None):
+        """Open the store in directory, creating it (with meta in its manifest) if it doesn't exist."""
+        self.directory = directory
+        self.shard_records = shard_records
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"run_id": os.path.basename(os.path.normpath(directory)), "created": time.time(), "meta": meta or {}, "stages": {}}
+        # stage -> key -> (shard, offset) of its latest record
+        self.index: Dict[str, Dict[str, Tuple[str, int]]] = {}
+        # stage -> its shards, oldest first
+        self.shards: Dict[str, list] = {}
+        self._shard_counts: Dict[str, int] = {}
+        self._writers = {}  # stage -> (shard file, index file) of its last shard
+        self._readers = {}  # shard -> open file
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".jsonl"):
+                stage = filename.rsplit("-", 1)[0]
+                self.shards.setdefault(stage, []).append(filename)
+                self.index.setdefault(stage, {})
+                self._load_shard(stage, filename)
+        self.save_manifest()
+
+    def _load_shard(self, stage: str, shard: str):
+        index = self.index[stage]
+        shard_path = os.path.join(self.directory, shard)
+        index_path = shard_path[:-len(".jsonl")] + ".index"
+        size = os.path.getsize(shard_path)
+        count = 0
+        end = 0
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                for line in f:
+                    key, _, offset = line.rstrip("\n").partition("\t")
+                    if not offset or int(offset) >= size:
+                        continue
+                    index[key] = (shard, int(offset))
+                    count += 1
+                    end = max(end, int(offset))
+        # index whatever was appended after the last indexed record, and cut a line which was being written when the run stopped
+        with open(shard_path, 'rb+') as f, open(index_path, 'a') as index_file:
+            f.seek(end)
+            if count:
+                f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    key = json.loads(line)["key"]
+                except (ValueError, KeyError):
+                    key = None
+                if key is None or not line.endswith(b"\n"):
+                    f.truncate(offset)
+                    break
+                index[key] = (shard, offset)
+                index_file.write(f"{key}\t{offset}\n")
+                count += 1
+        self._shard_counts[shard] = count
+
+    def _writer(self, stage: str):
+        shards = self.shards.setdefault(stage, [])
+        self.index.setdefault(stage, {})
+        if not shards or self._shard_counts[shards[-1]] >= self.shard_records:
+            if stage in self._writers:
+                for f in self._writers.pop(stage):
+                    f.close()
+            shard = f"{stage}-{len(shards):05d}.jsonl"
+            shards.append(shard)
+            self._shard_counts[shard] = 0
+        if stage not in self._writers:
+            shard_path = os.path.join(self.directory, shards[-1])
+            self._writers[stage] = (open(shard_path, 'ab'), open(shard_path[:-len(".jsonl")] + ".index", 'a'))
+        return shards[-1], self._writers[stage]
+
+    def append(self, stage: str, record: dict):
+        """Append a record (a JSON-serializable dict with a "key") to a stage."""
+        shard, (shard_file, index_file) = self._writer(stage)
+        offset = shard_file.seek(0, os.SEEK_END)
+        shard_file.write((json.dumps(record) + "\n").encode())
+        shard_file.flush()
+        index_file.write(f"{record['key']}\t{offset}\n")
+        index_file.flush()
+        self.index[stage][record["key"]] = (shard, offset)
+        self._shard_counts[shard] += 1
+
+    def _read(self, shard: str, offset: int) -> dict:
+        if shard not in self._readers:
+            self._readers[shard] = open(os.path.join(self.directory, shard), 'rb')
+        f = self._readers[shard]
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def get(self, stage: str, key: str) -> Optional[dict]:
+        """The latest record of a stage with this key, or None."""
+        location = self.index.get(stage, {}).get(key)
+        return None if location is None else self._read(*location)
+
+    def has(self, stage: str, key: str) -> bool:
+        return key in self.index.get(stage, {})
+
+    def keys(self, stage: str):
+        return self.index.get(stage, {}).keys()
+
+    def count(self, stage: str) -> int:
+        return len(self.index.get(stage, {}))
+
+    def end(self, stage: str) -> Tuple[int, int]:
+        """(shard number, offset) where the next record of a stage goes; records(stage, since=...) reads what's appended after."""
+        shards = self.shards.get(stage, [])
+        if not shards:
+            return (0, 0)
+        return (len(shards) - 1, os.path.getsize(os.path.join(self.directory, shards[-1])))
+
+    def records(self, stage: str, since: Tuple[int, int] = (0, 0)) -> Iterator[dict]:
+        """The latest record of every key of a stage, in the order they were appended, read sequentially (from since, an end())."""
+        index = self.index.get(stage, {})
+        first_shard, first_offset = since
+        for number, shard in enumerate(self.shards.get(stage, [])):
+            if number < first_shard:
+                continue
+            if stage in self._writers:
+                self._writers[stage][0].flush()
+            with open(os.path.join(self.directory, shard), 'rb') as f:
+                offset = first_offset if number == first_shard else 0
+                f.seek(offset)
+                for line in f:
+                    record = json.loads(line)
+                    if index.get(record["key"]) == (shard, offset):
+                        yield record
+                    offset += len(line)
+
+    def save_manifest(self):
+        self.manifest["stages"] = {stage: {"shards": shards, "records": self.count(stage)} for stage, shards in self.shards.items()}
+        self.manifest["updated"] = time.time()
+        manifest_path = os.path.join(self.directory, "manifest.json")
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def close(self):
+        self.save_manifest()
+        for files in list(self._writers.values()) + [(f,) for f in self._readers.values()]:
+            for f in files:
+                f.close()
+        self._writers = {}
+        self._readers = {}
+
+    def round(self, timestamp: int) -> Optional[dict]:
+        """The manifest's counts of a discriminator round (see discriminator.StoreSink), or None."""
+        return self.manifest.get("rounds", {}).get(str(timestamp))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_store(directory: str) -> ConstructionStore:
+    """This process's store in directory, opened the first time it's asked for. close() only releases its files, so it stays usable."""
+    key = f"{os.getpid()}:{os.path.abspath(directory)}"
+    if key not in _stores:
+        _stores[key] = ConstructionStore(directory)
+    return _stores[key]
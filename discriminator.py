@@ -2,36 +2,147 @@ import os
 import pdb
 import sys
 import traceback
-from typing import Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from dataclasses import dataclass, field
 import numpy as np
 np.seterr(all='raise') # RuntimeWarnings like divide by zero, degenerate determinants, etc. will now raise exceptions, invalidating some constructions.
 import shutil
+import itertools
 import time
 import argparse
+import json
 from collections import Counter
-from random_constr import Construction
+from random_constr import Command, Construction
+from seeding import root_entropy, attempt_seed_sequence, seed_global_streams, filename_key
+from canonical import canonical_hash_text
+import verdict_cache
+from construction_store import ConstructionStore, open_store
 import concurrent.futures
-def test_measure_construction(file_path, num_tests=20, precision=4, verbosity=0):
+
+# a construction passes if at least this many tests give the same (nonzero) value
+PASS_AGREEMENTS = 18
+# two measurements agree if they differ by at most 10 ** -precision, or by this much relative to their size, whichever is larger
+# (numerical noise on a large length or area can exceed the absolute tolerance)
+AGREEMENT_REL_TOL = 1e-9
+
+def dominant_cluster(measurements: List[float], precision: int = 4, rel_tol: float = AGREEMENT_REL_TOL) -> Tuple[int, float, float]:
+    """
+    (size, center, spread) of the largest group of measurements which agree with its smallest member within the tolerance.
+    A sweep over the sorted values, so unlike counting values rounded to `precision` decimals,
+    measurements on either side of a rounding boundary (2.49996 and 2.50004) agree.
+    Adding a measurement grows the largest group by at most one, which sequential_verdict relies on.
+    The center is the group's median, and the spread its range.
+    """
+    values = sorted(measurements)
+    best_start, best_end = 0, 0
+    end = 0
+    for start, value in enumerate(values):
+        end = max(end, start)
+        tolerance = max(10 ** -precision, rel_tol * abs(value))
+        while end < len(values) and values[end] - value <= tolerance:
+            end += 1
+        if end - start > best_end - best_start:
+            best_start, best_end = start, end
+    group = values[best_start:best_end]
+    if not group:
+        return 0, 0.0, 0.0
+    return len(group), float(np.median(group)), group[-1] - group[0]
+
+def sequential_verdict(measurements: List[float], trials: int, max_disagreements: int, min_agreements: int, precision: int = 4) -> Optional[bool]:
+    """
+    The verdict of the sequential stopping rule after `trials` tests which produced these measurements
+    (failed tests and None values are in trials, but not in measurements), or None if it isn't decided yet.
+    A construction fails as soon as more than max_disagreements tests are outside the dominant cluster (see dominant_cluster),
+    and passes once it has min_agreements tests (unless its center is 0).
+    With max_disagreements = num_tests - PASS_AGREEMENTS and min_agreements = PASS_AGREEMENTS,
+    this is exactly the verdict the full num_tests would give, decided as soon as the remaining tests can't change it
+    (except that a file whose first tests all raise is an error rather than a failure, as it stops before any succeeds).
+    """
+    best_count, center, _ = dominant_cluster(measurements, precision)
+    if trials - best_count > max_disagreements:
+        return False
+    if best_count >= min_agreements:
+        return abs(round(center, precision)) > 10 ** -precision
+    return None
+
+def backward_cone_size(element, producers: Dict[int, Command]) -> int:
+    """Number of commands (consts excluded) needed to construct element; producers maps element ids to the commands producing them."""
+    seen = set()
+    stack = [element]
+    while stack:
+        command = producers.get(id(stack.pop()))
+        if command is None or id(command) in seen:
+            continue
+        seen.add(id(command))
+        stack.extend(command.input_elements)
+    return len(seen)
+
+def invariant_candidates(construction: Construction, candidate_values: Dict[str, List[float]], trials: int, max_disagreements: int, min_agreements: int,
+                         precision: int = 4) -> List[dict]:
+    """
+    The measurable elements (other than the measured one) whose values would have passed as the measured one,
+    with their value and backward cone size, largest cone first: each of them could be measured in a problem of its own.
+    """
+    producers = {id(element): command for command in construction.nc_commands for element in command.output_elements or [] if element is not None}
+    invariants = []
+    for label, values in candidate_values.items():
+        if sequential_verdict(values, trials, max_disagreements, min_agreements, precision) is not True:
+            continue
+        count, center, spread = dominant_cluster(values, precision)
+        element = construction.element_dict[label]
+        invariants.append({"label": label, "type": type(element.data).__name__, "value": round(center, precision), "agreements": count,
+                           "spread": spread, "cone_size": backward_cone_size(element, producers)})
+    invariants.sort(key=lambda candidate: candidate["cone_size"], reverse=True)
+    return invariants
+
+def record_candidate_values(construction: Construction, candidate_values: Dict[str, List[float]]):
+    """Append the current value of every measurable element except the measured one (after a test in which every command ran)."""
+    for command in construction.nc_commands:
+        for element in command.output_elements or []:
+            if element is None or element is construction.to_measure or not element.has_value():
+                continue
+            try:
+                value = element.value()
+            except Exception:
+                continue # e.g. the area of a degenerate polygon; counts as a disagreement
+            if value is not None:
+                candidate_values.setdefault(element.label, []).append(value)
+
+def test_measure_construction(file_path, num_tests=20, precision=4, verbosity=0, file_contents=None, sequential=False, max_disagreements=None, min_agreements=PASS_AGREEMENTS,
+                              construction=None, diagnostics=None, all_candidates=False):
     """
     Test a geometric construction that ends with a measure statement.
     
     Args:
-        file_path: Path to the construction file
-        num_tests: Number of tests to run
-        precision: Number of decimal places to round measurements to
+        file_path: Path to the construction file (or None, with file_contents)
+        num_tests: Number of tests to run (at most, in sequential mode)
+        precision: Measurements agree within 10 ** -precision (see dominant_cluster); the answer is rounded to this many decimal places
         verbose: Whether to print detailed output
+        file_contents: The construction itself, instead of a file
+        construction: An already loaded Construction, instead of a file
+        diagnostics: If given, filled with the exception counts by type and by the command which raised them ("exceptions", "failing_commands"),
+            the number of None values ("none_values") and of tests run ("trials"), even when there is no measurement to return
+        all_candidates: Also record the value of every other measurable element in every test, and report the ones which pass
+            the same agreement rule as the measured one ("invariants", see invariant_candidates; in the diagnostics too).
+            In sequential mode, the tests then go on until every candidate is decided
+        sequential: Stop as soon as the verdict is decided (see sequential_verdict), instead of running all num_tests tests
+        max_disagreements, min_agreements: the sequential stopping rule; max_disagreements defaults to num_tests - PASS_AGREEMENTS,
+            so that the defaults give the same verdicts as the full num_tests tests
     
     Returns:
         A dictionary with statistics about the measurements
     """
-    construction = Construction()
-    try:
-        construction.load(file_path)
-    except Exception as e:
-        if verbosity >= 1:
-            print(f"Error loading {file_path}: {str(e)}")
-            traceback.print_exc()
-        return None
+    if max_disagreements is None:
+        max_disagreements = max(0, num_tests - PASS_AGREEMENTS)
+    if construction is None:
+        construction = Construction()
+        try:
+            construction.load(file_path, file_contents=file_contents)
+        except Exception as e:
+            if verbosity >= 1:
+                print(f"Error loading {file_path}: {str(e)}")
+                traceback.print_exc()
+            return None
     
     if construction.statement_type != "measure":
         if verbosity >= 1:
@@ -40,13 +151,35 @@ def test_measure_construction(file_path, num_tests=20, precision=4, verbosity=0)
     
     measurements = []
     failures = 0
+    exceptions = Counter()  # type name -> number of tests which raised it
+    failing_commands = Counter()  # command name -> number of tests in which it raised ("measure" if measuring raised)
+    none_values = 0
+    trials = 0
+    verdict = None
+    
+    # label -> its values, in the tests in which every command ran, for every measurable element other than the measured one
+    candidate_values: Dict[str, List[float]] = {}
     
     already_printed = False
     for i in range(num_tests):
+        if sequential:
+            if verdict is None:
+                verdict = sequential_verdict(measurements, trials, max_disagreements, min_agreements, precision)
+            if verdict is not None and not any(sequential_verdict(values, trials, max_disagreements, min_agreements, precision) is None
+                                               for values in candidate_values.values()):
+                break
+        trials += 1
+        command = None
         try:
-            construction.run_commands()
+            # construction.run_commands, keeping track of the command running
+            for command in construction.nc_commands:
+                command.apply()
+            command = None
+            if all_candidates:
+                record_candidate_values(construction, candidate_values)
             value = construction.to_measure.value()
             if value is None:
+                none_values += 1
                 print("Got None value from construction: ")
                 print(construction.nc_commands)
                 print(construction.to_measure)
@@ -56,15 +189,26 @@ def test_measure_construction(file_path, num_tests=20, precision=4, verbosity=0)
                 print(f"Test {i+1}: {value}")
         except Exception as e:
             failures += 1
+            exceptions[type(e).__name__] += 1
+            failing_commands[command.name if command is not None else "measure"] += 1
             if verbosity >= 2 and not already_printed:
                 already_printed = True
                 print(f"Test {i+1} failed: {str(e)}")
                 traceback.print_exc()
     
+    if sequential and verdict is None:
+        # all num_tests tests ran; only possible with a custom rule
+        verdict = sequential_verdict(measurements, trials, max_disagreements, min_agreements, precision) or False
+
+    invariants = invariant_candidates(construction, candidate_values, trials, max_disagreements, min_agreements, precision) if all_candidates else None
+    if diagnostics is not None:
+        diagnostics.update(exceptions=dict(exceptions), failing_commands=dict(failing_commands), none_values=none_values, trials=trials)
+        if all_candidates:
+            diagnostics["invariants"] = invariants
     if not measurements:
         return None
     
-    # Round measurements to specified precision for analysis
+    # Rounded values, for reference; agreement is decided by dominant_cluster
     rounded_measurements = [round(m, precision) for m in measurements]
     counts = Counter(rounded_measurements)
     
@@ -74,66 +218,380 @@ def test_measure_construction(file_path, num_tests=20, precision=4, verbosity=0)
     min_val = min(measurements)
     max_val = max(measurements)
     
-    # Most common value and its count
-    most_common = counts.most_common(1)[0]
-    mode = most_common[0]
-    mode_count = most_common[1]
+    # The value most tests agree on, and how many
+    mode_count, center, spread = dominant_cluster(measurements, precision)
+    mode = round(center, precision)
     
     results = {
         "successful_tests": len(measurements),
         "failed_tests": failures,
+        "exceptions": dict(exceptions),
+        "failing_commands": dict(failing_commands),
+        "none_values": none_values,
+        "trials": trials,
+        "invariants": invariants,
         "average": avg,
         "median": median,
         "min": min_val,
         "max": max_val,
         "mode": mode,
         "mode_count": mode_count,
+        "cluster_center": center,
+        "cluster_spread": spread,
         "all_values": measurements,
         "counts": dict(counts),
         # heuristic: a lot of degenerate constructions are creating measurements that are 0.0
-        "pass": mode_count >= 18 and len(measurements) >= 18 and abs(mode) > 0.0001
+        "pass": verdict if sequential else mode_count >= PASS_AGREEMENTS and len(measurements) >= PASS_AGREEMENTS and abs(mode) > 0.0001
     }
     
     if verbosity >= 3:
         print(f"\nResults Summary:")
-        print(f"Tests: {len(measurements)} successful, {failures} failed")
+        print(f"Tests: {len(measurements)} successful, {failures} failed, {trials} of {num_tests} run")
         print(f"Average: {avg}")
         print(f"Median: {median}")
         print(f"Min: {min_val}")
         print(f"Max: {max_val}")
-        print(f"Most common value: {mode} (occurs {mode_count} times out of {len(measurements)})")
+        print(f"Most common value: {mode} (occurs {mode_count} times out of {len(measurements)}, spread {spread:.3g})")
         print(f"PASS: {results['pass']}")
     return results
 
-def process_file(directory_path, filename, passed_dir="passed", failed_dir="failed", num_tests=20, verbosity=False, move_files=True) -> tuple[Optional[str], Optional[float]]:
-    file_path = os.path.join(directory_path, filename)
+@dataclass
+class Verdict:
+    name: str  # the filename, or whatever the caller named the construction
+    status: str  # "pass", "fail" or "error" (couldn't be loaded, or no test succeeded)
+    answer: Optional[float] = None  # the measured value, if it passed
+    trials: Optional[int] = None  # tests run; 0 if the verdict came from the verdict cache, None for errors
+    results: Optional[dict] = None  # test_measure_construction's statistics, when the construction was tested
+    reason: Optional[str] = None  # why it didn't pass, one of FAILURE_REASONS
+    details: dict = field(default_factory=dict)  # the construction's commands, and evidence for the reason (see failure_reason)
+
+
+# why a construction didn't pass:
+#   load_error: the file couldn't be parsed or its consts applied
+#   not_measure: it doesn't end with a measure statement
+#   degenerate: commands raised (e.g. intersecting parallel lines) in too many tests; details name the commands
+#   none_value: the measured quantity was None in too many tests
+#   non_constant: the measurements disagree; details give the spread
+#   zero_measure: the measurements agree on 0
+#   worker_error: evaluating it raised, or the worker process evaluating it died
+FAILURE_REASONS = ("load_error", "not_measure", "degenerate", "none_value", "non_constant", "zero_measure", "worker_error")
+
+def failure_reason(test_results: Optional[dict], diagnostics: dict, precision: int = 4) -> Tuple[Optional[str], dict]:
+    """The reason a tested construction didn't pass (None if it passed), and the evidence for it."""
+    details = {key: diagnostics[key] for key in ("failing_commands", "exceptions", "none_values") if diagnostics.get(key)}
+    if test_results is not None and test_results["pass"]:
+        return None, details
+    if test_results is None:
+        # not a single measurement
+        return ("degenerate" if diagnostics["failing_commands"] else "none_value"), details
+    details["mode_count"] = test_results["mode_count"]
+    details["cluster_spread"] = test_results["cluster_spread"]
+    details["range"] = test_results["max"] - test_results["min"]
+    if test_results["successful_tests"] > test_results["mode_count"]:
+        return "non_constant", details
+    if abs(test_results["mode"]) <= 10 ** -precision:
+        return "zero_measure", details
+    # every measurement agreed, but too few tests measured anything
+    return ("degenerate" if test_results["failed_tests"] >= test_results["none_values"] else "none_value"), details
+
+
+def evaluate_one(name: str, construction: Union[str, Construction], num_tests=20, verbosity=0, seed_entropy=None,
+                 sequential=False, max_disagreements=None, min_agreements=PASS_AGREEMENTS, verdict_cache_path=None, all_candidates=False) -> Verdict:
+    """
+    Judge one construction, given as the text of a construction file or as a loaded Construction.
+    If seed_entropy is given, the tests draw from a stream derived from it and the name.
+    With verdict_cache_path, a construction judged before (with the same test parameters) isn't tested again, see verdict_cache.py;
+    only text constructions are looked up, since the canonical hash is computed from the text.
+    With all_candidates, every other measurable element is checked for invariance too (see test_measure_construction),
+    and the invariant ones are in details["invariants"]; the cache, which doesn't keep them, is then bypassed.
+    """
     if verbosity: 
-        print(f"Testing {filename}...")
+        print(f"Testing {name}...")
+
+    text = construction if isinstance(construction, str) else None
+    if text is not None:
+        construction = Construction()
+        try:
+            construction.load(file_contents=text)
+        except Exception as e:
+            if verbosity >= 1:
+                print(f"Error loading {name}: {str(e)}")
+                traceback.print_exc()
+            return Verdict(name, "error", reason="load_error", details={"exception": f"{type(e).__name__}: {e}"})
+    commands = [command.name for command in construction.nc_commands]
+    if construction.statement_type != "measure":
+        if verbosity >= 1:
+            print(f"Construction {name} does not end with a measure statement")
+        return Verdict(name, "error", reason="not_measure", details={"commands": commands})
+
+    key = None
+    if verdict_cache_path is not None and text is not None and not all_candidates:
+        try:
+            key = canonical_hash_text(text)
+        except Exception:
+            pass # unparsable; the test reports it
+    parameters = verdict_cache.test_parameters(num_tests, sequential=sequential, max_disagreements=max_disagreements, min_agreements=min_agreements,
+                                               rel_tol=AGREEMENT_REL_TOL, pass_agreements=PASS_AGREEMENTS)
+    cached = verdict_cache.lookup(verdict_cache_path, key, parameters) if key is not None else None
+    if cached is not None:
+        status, answer, reason = cached
+        if verbosity >= 1:
+            print(f"{status.upper()} (cached)")
+        return Verdict(name, status, answer, 0, reason=reason, details={"commands": commands})
+
+    if seed_entropy is not None:
+        # per-file stream, so verdicts don't depend on which worker tested the file or in what order
+        seed_global_streams(attempt_seed_sequence(seed_entropy, filename_key(name)))
     
     # Test the construction
-    test_results = test_measure_construction(file_path, num_tests, verbosity=verbosity)
+    diagnostics = {}
+    test_results = test_measure_construction(None, num_tests, verbosity=verbosity, construction=construction, diagnostics=diagnostics,
+                                             sequential=sequential, max_disagreements=max_disagreements, min_agreements=min_agreements,
+                                             all_candidates=all_candidates)
+    reason, details = failure_reason(test_results, diagnostics)
+    details["commands"] = commands
+    if all_candidates:
+        details["invariants"] = diagnostics["invariants"]
 
     if test_results is None:
         if verbosity >= 1: 
-            print(f"Failed to test {filename}")
-        if move_files:
-            shutil.move(file_path, os.path.join(failed_dir, filename))
-        return "error", None
-    
-    passed = test_results["pass"]
-    
-    # Move file to appropriate directory
-    destination = os.path.join(passed_dir if passed else failed_dir, filename)
-    if move_files:
-        shutil.move(file_path, destination)
-    
-    if verbosity >= 1: 
-        print(f"{'PASSED' if passed else 'FAILED'}: {test_results['mode_count']} of {test_results['successful_tests']} tests gave the same result")
-    
-    if passed:
-        return "pass", test_results["mode"]
+            print(f"Failed to test {name}")
+        verdict = Verdict(name, "error", reason=reason, details=details)
     else:
-        return "fail", None
+        passed = test_results["pass"]
+        if verbosity >= 1: 
+            print(f"{'PASSED' if passed else 'FAILED'}: {test_results['mode_count']} of {test_results['successful_tests']} tests gave the same result")
+        verdict = Verdict(name, "pass" if passed else "fail", test_results["mode"] if passed else None, test_results["trials"], test_results, reason, details)
+    if key is not None:
+        verdict_cache.store(verdict_cache_path, key, parameters, verdict.status, verdict.answer, test_results, reason)
+    return verdict
+
+def evaluate_chunk(chunk: List[Tuple[str, str]], options: dict) -> List[Verdict]:
+    """evaluate_one on every construction of a chunk; one process pool task."""
+    verdicts = []
+    for name, construction in chunk:
+        try:
+            verdicts.append(evaluate_one(name, construction, **options))
+        except Exception as e:
+            print(f"Error processing {name}: {e}")
+            verdicts.append(Verdict(name, "error", reason="worker_error", details={"exception": f"{type(e).__name__}: {e}"}))
+    return verdicts
+
+def evaluate(constructions: Iterable[Tuple[str, Union[str, Construction]]], max_workers: Optional[int] = None, chunk_size: int = 16,
+             **options) -> Iterator[Verdict]:
+    """
+    Judge (name, construction) pairs, yielding a Verdict for each; the options are evaluate_one's.
+    Without max_workers, they're tested one by one in this process, and the verdicts come in order.
+    With it, they're tested in a process pool (text constructions only) in chunks of chunk_size, and the verdicts come as chunks finish.
+    Only a few chunks per worker are in flight at a time, so constructions are read from the iterable as they're needed,
+    and memory doesn't grow with the number of constructions.
+    Nothing is written to disk (except the verdict cache), so stages can be chained in memory; see FileSink for the file-based flow.
+    """
+    if not max_workers:
+        for name, construction in constructions:
+            yield evaluate_one(name, construction, **options)
+        return
+    constructions = iter(constructions)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}  # future -> its chunk
+        exhausted = False
+        while True:
+            while len(in_flight) < 2 * max_workers and not exhausted:
+                chunk = list(itertools.islice(constructions, chunk_size))
+                if not chunk:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(evaluate_chunk, chunk, options)] = chunk
+            if not in_flight:
+                break
+            finished, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                chunk = in_flight.pop(future)
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    # the worker died (e.g. killed for memory); the whole chunk is lost
+                    print(f"Error processing {', '.join(name for name, _ in chunk)}: {e}")
+                    for name, _ in chunk:
+                        yield Verdict(name, "error", reason="worker_error", details={"exception": f"{type(e).__name__}: {e}"})
+
+def read_construction_files(directory: str) -> Iterator[Tuple[str, str]]:
+    """(filename, contents) of the construction files in a directory, read lazily."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt'):
+                continue
+            with open(entry.path, 'r') as f:
+                yield entry.name, f.read()
+
+class FileSink:
+    """
+    Moves every judged file from source_dir to passed_dir or failed_dir, and appends the answers of the passed ones to answers.txt
+    as they come, so nothing is held until the end of the run and an interrupted run keeps the answers of the files it moved.
+    """
+    def __init__(self, source_dir: str, passed_dir: str, failed_dir: str, move_files: bool = True):
+        self.source_dir = source_dir
+        self.passed_dir = passed_dir
+        self.failed_dir = failed_dir
+        self.move_files = move_files
+        self.answers_file = open(os.path.join(passed_dir, "answers.txt"), 'a') if move_files else None
+
+    def __call__(self, verdict: Verdict):
+        if not self.move_files:
+            return
+        shutil.move(os.path.join(self.source_dir, verdict.name), os.path.join(self.passed_dir if verdict.status == "pass" else self.failed_dir, verdict.name))
+        if verdict.status == "pass":
+            self.answers_file.write(f"{verdict.name}: {verdict.answer}\n")
+            self.answers_file.flush()
+
+    def close(self):
+        if self.answers_file is not None:
+            self.answers_file.close()
+
+
+def read_store_constructions(store: ConstructionStore) -> Iterator[Tuple[str, str]]:
+    """(key, text) of the constructions in a store which have no verdict yet; only those are read."""
+    for key in list(store.keys("constructions")):
+        if not store.has("verdicts", key):
+            yield key, store.get("constructions", key)["text"]
+
+class StoreSink:
+    """
+    Appends every verdict to a ConstructionStore's "verdicts", tagged with the run's timestamp, instead of moving files.
+    The manifest's "rounds" keep, per timestamp, where its verdicts start and how many there are and passed,
+    so later stages read only the round's verdicts.
+    """
+    def __init__(self, store: ConstructionStore, timestamp: int):
+        self.store = store
+        self.timestamp = timestamp
+        self.round = store.round(timestamp)
+        if self.round is None:
+            self.round = store.manifest.setdefault("rounds", {})[str(timestamp)] = {"verdicts_from": store.end("verdicts"), "verdicts": 0, "passed": 0}
+        else:
+            # resumed: the counts in the manifest may be older than the verdicts appended since
+            statuses = [record["status"] for record in store.records("verdicts", since=self.round["verdicts_from"]) if record["round"] == timestamp]
+            self.round.update(verdicts=len(statuses), passed=statuses.count("pass"))
+        store.save_manifest()
+
+    def __call__(self, verdict: Verdict):
+        record = {"key": verdict.name, "round": self.timestamp, "status": verdict.status, "answer": verdict.answer, "reason": verdict.reason,
+                  "trials": verdict.trials, "details": verdict.details}
+        if verdict.results is not None:
+            record["stats"] = {key: verdict.results[key] for key in ("mode_count", "successful_tests", "failed_tests", "cluster_spread")}
+        if not self.store.has("verdicts", verdict.name):
+            self.round["verdicts"] += 1
+            self.round["passed"] += verdict.status == "pass"
+        self.store.append("verdicts", record)
+
+    def close(self):
+        self.store.close()
+
+
+class EvaluationProgress:
+    """Verdict counts of a discriminator run, with periodic progress and throughput reports."""
+    def __init__(self, report_interval: float = 10.0):
+        self.report_interval = report_interval
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+        self.statuses = Counter()
+        # tests run on the files which passed or failed (errors and cached verdicts excluded)
+        self.num_trials = 0
+        self.num_tested = 0
+        self.num_cached = 0
+
+    def record(self, verdict: Verdict):
+        self.statuses[verdict.status] += 1
+        self.num_trials += verdict.trials or 0
+        self.num_cached += verdict.trials == 0
+        self.num_tested += bool(verdict.trials)
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.start_time
+        judged = sum(self.statuses.values())
+        return (f"{judged} judged in {elapsed:.0f}s ({judged / elapsed if elapsed > 0 else 0.0:.1f}/s): "
+                f"{self.statuses['pass']} passed, {self.statuses['fail']} failed, {self.statuses['error']} errors")
+
+    def maybe_report(self):
+        if time.monotonic() - self.last_report_time >= self.report_interval:
+            self.last_report_time = time.monotonic()
+            print(self.summary())
+
+
+class FailureReport:
+    """
+    Machine-readable account of a run: one JSON line per file (status, failure reason and its evidence, length) written as verdicts come,
+    and at the end the counts by reason, and histograms by command and by construction length, so that generator tuning can go
+    after the most common rejection causes.
+    """
+    def __init__(self, files_path: str, meta: dict):
+        self.files_path = files_path
+        self.meta = meta
+        self.files = open(files_path, 'w')
+        self.reasons = Counter()
+        # command name -> files containing it, how many passed, and their failure reasons; plus the tests in which the command raised
+        self.by_command: Dict[str, Dict] = {}
+        # number of commands (measure excluded) -> files, passed, failure reasons
+        self.by_length: Dict[int, Dict] = {}
+        # with all_candidates: invariant elements other than the measured one, and the files that have any, by status
+        self.invariants = Counter()
+        self.files_with_invariants = Counter()
+
+    @staticmethod
+    def _bucket() -> Dict:
+        return {"files": 0, "passed": 0, "reasons": Counter()}
+
+    def record(self, verdict: Verdict):
+        commands = verdict.details.get("commands", [])
+        entry = {"file": verdict.name, "status": verdict.status, "reason": verdict.reason, "length": len(commands),
+                 **{key: value for key, value in verdict.details.items() if key != "commands"}}
+        self.files.write(json.dumps(entry) + "\n")
+        self.reasons["pass" if verdict.status == "pass" else verdict.reason or verdict.status] += 1
+        buckets = [self.by_command.setdefault(name, {**self._bucket(), "raised": 0}) for name in set(commands)]
+        buckets.append(self.by_length.setdefault(len(commands), self._bucket()))
+        for bucket in buckets:
+            bucket["files"] += 1
+            bucket["passed"] += verdict.status == "pass"
+            if verdict.reason is not None:
+                bucket["reasons"][verdict.reason] += 1
+        for name, count in verdict.details.get("failing_commands", {}).items():
+            self.by_command.setdefault(name, {**self._bucket(), "raised": 0})["raised"] += count
+        if verdict.details.get("invariants"):
+            self.invariants[verdict.status] += len(verdict.details["invariants"])
+            self.files_with_invariants[verdict.status] += 1
+
+    def write(self, path: str):
+        self.files.close()
+        report = {
+            "meta": self.meta,
+            "files": self.files_path,
+            "reasons": dict(self.reasons.most_common()),
+            # the commands rejected files are most often made of first
+            "by_command": dict(sorted(self.by_command.items(), key=lambda item: item[1]["files"] - item[1]["passed"], reverse=True)),
+            "by_length": dict(sorted(self.by_length.items())),
+        }
+        if self.invariants:
+            report["invariants"] = {"candidates": dict(self.invariants), "files": dict(self.files_with_invariants)}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    def print_summary(self, top: int = 5):
+        print("Failure reasons: " + ", ".join(f"{reason} {count}" for reason, count in self.reasons.most_common() if reason != "pass"))
+        raised = sorted(self.by_command.items(), key=lambda item: item[1]["raised"], reverse=True)[:top]
+        if raised and raised[0][1]["raised"]:
+            print("Commands raising most often: " + ", ".join(f"{name} {bucket['raised']}" for name, bucket in raised if bucket["raised"]))
+        if self.invariants:
+            print("Other invariant elements: " + ", ".join(f"{self.invariants[status]} in {self.files_with_invariants[status]} {status}ed files"
+                                                          for status in ("pass", "fail") if self.invariants[status]))
+
+
+def report_name(report_dir: str, timestamp: int) -> str:
+    """The name of a run's report: its timestamp, or, if a report of that timestamp exists (the run is being resumed), the next free <timestamp>_<n>."""
+    name = str(timestamp)
+    n = 1
+    while os.path.exists(os.path.join(report_dir, f"{name}.json")) or os.path.exists(os.path.join(report_dir, f"{name}_files.jsonl")):
+        name = f"{timestamp}_{n}"
+        n += 1
+    return name
 
 
 def parse_args():
@@ -144,83 +602,84 @@ def parse_args():
     parser.add_argument("--nomovefiles", action="store_false", dest="move_files", help="Don't move files to passed/ or failed/")
     parser.add_argument("--max_workers", type=int, default=16, help="Maximum number of processes to use")
     parser.add_argument("--multiprocess", action="store_true", help="Run tests in parallel")
+    parser.add_argument("--all_candidates", action="store_true", help="Also find the other measurable elements which are invariant over the same tests "
+                        "(listed per file in the report, largest backward cone first); bypasses the verdict cache")
+    parser.add_argument("--report_dir", type=str, default="discriminator_reports", help="Where to write the failure-reason report of a directory run ('' for none)")
+    parser.add_argument("--chunk_size", type=int, default=16, help="Files per process pool task in multiprocess mode")
+    parser.add_argument("--seed", type=int, default=None, help="Root seed; each file's tests draw from a stream derived from it and the filename")
+    parser.add_argument("--sequential", action="store_true", help="Stop testing a file as soon as its verdict is decided, instead of running all --num_tests tests")
+    parser.add_argument("--max_disagreements", type=int, default=None, help="Sequential mode: fail once more than this many tests disagree with every value "
+                        f"(default --num_tests - {PASS_AGREEMENTS}, which gives the same verdicts as the full tests; 0 fails at the first disagreement)")
+    parser.add_argument("--verdict_cache", type=str, default=None, help="SQLite file of verdicts by canonical construction hash (verdict_cache.py); "
+                        "constructions already judged with the same test parameters aren't tested again")
+    parser.add_argument("--min_agreements", type=int, default=PASS_AGREEMENTS, help="Sequential mode: pass once this many tests agree (on a nonzero value)")
+    parser.add_argument("--store", type=str, default=None, help="Judge the constructions without a verdict in this construction store (see construction_store.py) "
+                        "and append the verdicts to it, instead of --path")
+    parser.add_argument("--timestamp", type=int, default=None, help="Output timestamp to use instead of the current time (e.g. to finish an interrupted run's round)")
     args = parser.parse_args()
     return args
 
 def main(args):
-    
-    if os.path.isdir(args.path):
-        timestamp = int(time.time())
+    seed_entropy = root_entropy(args.seed)
+    print(f"Seed entropy: {seed_entropy}")
+    timestamp = None
+    if args.store or os.path.isdir(args.path):
+        timestamp = args.timestamp or int(time.time())
+        # back-to-back runs (e.g. pipeline rounds) can start within the same second
+        while args.timestamp is None and (os.path.exists(os.path.join("passed/", str(timestamp))) or os.path.exists(os.path.join("failed/", str(timestamp)))):
+            timestamp += 1
         print(f"Output timestamp: {timestamp}")
-        passed_dir = os.path.join("passed/", str(timestamp))
-        failed_dir = os.path.join("failed/", str(timestamp))
-
-        if args.move_files:
-            os.makedirs(passed_dir, exist_ok=True)
-            os.makedirs(failed_dir, exist_ok=True)
-            
-        
-        all_answers = []
-        
-        num_passed = 0
-        num_failed = 0
-        num_errors = 0
-        if not args.multiprocess:
-            # Run sequentially
-            for filename in os.listdir(args.path):
-                if not filename.endswith('.txt'):
-                    continue
-                results = process_file(args.path, filename, passed_dir=passed_dir, failed_dir=failed_dir, num_tests=args.num_tests, verbosity=args.verbosity, move_files=args.move_files)
-                if results[0] == "pass":
-                    all_answers.append(f"{filename}: {results[1]}")
-                    num_passed += 1
-                elif results[0] == "fail":
-                    num_failed += 1
-                else:
-                    num_errors += 1
+        if args.store:
+            store = open_store(args.store)
+            constructions = read_store_constructions(store)
+            sink = StoreSink(store, timestamp)
         else:
-            # Use ProcessPool for parallel processing
-            files_to_process = [f for f in os.listdir(args.path) if f.endswith('.txt')]
-            
-            with concurrent.futures.ProcessPoolExecutor(max_workers=args.max_workers) as executor:
-                future_to_file = {
-                    executor.submit(
-                        process_file, 
-                        args.path, 
-                        filename, 
-                        passed_dir=passed_dir, 
-                        failed_dir=failed_dir, 
-                        num_tests=args.num_tests, 
-                        verbosity=args.verbosity, 
-                        move_files=args.move_files
-                    ): filename for filename in files_to_process
-                }
+            passed_dir = os.path.join("passed/", str(timestamp))
+            failed_dir = os.path.join("failed/", str(timestamp))
+
+            if args.move_files:
+                os.makedirs(passed_dir, exist_ok=True)
+                os.makedirs(failed_dir, exist_ok=True)
                 
-                for future in concurrent.futures.as_completed(future_to_file):
-                    filename = future_to_file[future]
-                    try:
-                        results = future.result()
-                        if results[0] == "pass":
-                            all_answers.append(f"{filename}: {results[1]}")
-                            num_passed += 1
-                        elif results[0] == "fail":
-                            num_failed += 1
-                        else:
-                            num_errors += 1
-                    except Exception as e:
-                        print(f"Error processing {filename}: {e}")
-                        num_errors += 1
-
-        if args.move_files:
-            answers_path = os.path.join(passed_dir, "answers.txt")
-            with open(answers_path, 'a') as f:
-                for answer in all_answers:
-                    f.write(f"{answer}\n")
-        print(f"\nSummary: {num_passed} passed, {num_failed} failed, {num_errors} errors")
+            
+            constructions = read_construction_files(args.path)
+            sink = FileSink(args.path, passed_dir, failed_dir, args.move_files)
+        progress = EvaluationProgress()
+        report = None
+        if args.report_dir:
+            os.makedirs(args.report_dir, exist_ok=True)
+            name = report_name(args.report_dir, timestamp)
+            report = FailureReport(os.path.join(args.report_dir, f"{name}_files.jsonl"),
+                                   {"timestamp": timestamp, "path": str(args.store or args.path), "num_tests": args.num_tests, "sequential": args.sequential, "seed_entropy": seed_entropy})
+        options = dict(num_tests=args.num_tests, verbosity=args.verbosity, seed_entropy=seed_entropy, sequential=args.sequential,
+                       max_disagreements=args.max_disagreements, min_agreements=args.min_agreements, verdict_cache_path=args.verdict_cache,
+                       all_candidates=args.all_candidates)
+        max_workers = args.max_workers if args.multiprocess else None
+        try:
+            for verdict in evaluate(constructions, max_workers=max_workers, chunk_size=args.chunk_size, **options):
+                sink(verdict)
+                progress.record(verdict)
+                if report is not None:
+                    report.record(verdict)
+                progress.maybe_report()
+        finally:
+            sink.close()
+        print(f"\nSummary: {progress.summary()}")
+        if args.verdict_cache:
+            print(f"{progress.num_cached} verdicts from the verdict cache {args.verdict_cache}")
+        if progress.num_tested:
+            print(f"Average tests per tested file: {progress.num_trials / progress.num_tested:.2f} (of at most {args.num_tests}{', sequential' if args.sequential else ''})")
+        if report is not None:
+            report_path = os.path.join(args.report_dir, f"{name}.json")
+            report.write(report_path)
+            report.print_summary()
+            print(f"Wrote failure-reason report to {report_path}")
     else:
         if args.verbosity < 2:
             args.verbosity = 2
-        test_measure_construction(args.path, args.num_tests, verbosity=args.verbosity) 
+        seed_global_streams(attempt_seed_sequence(seed_entropy, filename_key(os.path.basename(args.path))))
+        test_measure_construction(args.path, args.num_tests, verbosity=args.verbosity, sequential=args.sequential,
+                                  max_disagreements=args.max_disagreements, min_agreements=args.min_agreements)
     return timestamp
 
 if __name__ == "__main__":
@@ -1,43 +1,52 @@
-import dotenv
+# Generates construction files with an LLM (any OpenAI-compatible endpoint), streaming concurrent requests and
+# measure-testing each file in a process pool as it arrives; only the ones that pass are written.
+# Usage: python generator.py --num_requests 10 --files_per_request 20
+# With a local stand-in server: python generator.py --base_url http://localhost:8000/v1 --model <served model>
+
+import argparse
+import asyncio
+import concurrent.futures
+import inspect
 import os
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import dotenv
+import httpx
+import openai
 
-dotenv.load_dotenv()
+import commands
+from random_constr import Construction
+from discriminator import test_measure_construction
+from seeding import root_entropy, attempt_seed_sequence, seed_global_streams, filename_key
+from canonical import canonical_hash_text
+from macro_miner import construction_files
 
-api_key = os.getenv("OPENAI_API_KEY")
+CONTEXT_FILES = ["commands.py", "geo_types.py", "discriminator.py", "random_constr.py", "golden_ratio.txt"]
 
-import openai
+prompt = """Please generate %d new geometric constructions which satisfy the criteria described in the system prompt.
+Format each construction as follows:
+FILE_START: construction_name_1.txt
+[construction content]
+FILE_END
 
-openai.api_key = api_key
+FILE_START: construction_name_2.txt
+[construction content]
+FILE_END
 
-client = openai.OpenAI()
+... and so on for all such constructions.
+"""
 
-def generate_response(prompt, context=None, model="gpt-4.1-mini", num_files=10):
-    try:
-        messages = []
-        
-        # Add system message with context if provided
-        if context:
-            messages.append({"role": "system", "content": context})
-        
-        # Add user message
-        messages.append({"role": "user", "content": prompt % num_files})
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Error generating response: {e}")
-        return None
 
-def create_context():
+def create_context(examples_dir: Optional[str] = "passed", num_examples: int = 6):
+    # the first few example files by name, so that every request (and every run on the same corpus) gets the same context
+    example_files = construction_files(examples_dir)[:num_examples]
     context = "Here are the relevant files:\n\n"
-    
-    for filename in ["commands.py", "geo_types.py", "measure_test.py", "random_constr.py", "golden_ratio.txt", \
-                      "passed/batch1/angle_bisector_length.txt", "passed/batch1/circle_radius.txt",
-                      "passed/batch1/cyclic_quadrilateral.txt", "passed/batch1/incircle_radius.txt",
-                      "passed/batch1/triangle_ratio.txt", "passed/batch1/triangle_altitude.txt"]:
+    for filename in CONTEXT_FILES + example_files:
+        if not os.path.exists(filename):
+            print(f"Leaving {filename} out of the context, it doesn't exist")
+            continue
         with open(filename, 'r') as f:
             commands_content = f.read()
         short_filename = os.path.basename(filename)
@@ -45,6 +54,7 @@ def create_context():
         context += commands_content
         context += "\n```\n"
 
+    command_names = sorted(name for name, _ in inspect.getmembers(commands, inspect.isfunction) if not name.startswith('_'))
     context += "\n\n As a brief explanation of the above files: \n"
     context += "All of the quoted .txt files are example 'geometric construction files'"
     context += " which specify in a narrow language a method of constructing points in the plane via 'commands', and which also meet the below described criteria.\n"
@@ -58,53 +68,194 @@ def create_context():
     context += "Note furthermore that the ONLY valid commands are the ones defined in commands.py, and that any other commands will result in the construction being rejected.\n"
     context += "For example, there is no command simply named 'segment', but there is a command 'segment_pp' which constructs a segment from two points.\n"
     context += "Explicitly, the only valid commands are: \n"
-    context += "angle_ppp, angular_bisector_ll, angular_bisector_ppp, angular_bisector_ss, are_collinear_ppp, are_complementary_aa, are_concurrent, are_concurrent_lll, are_concyclic_pppp, are_congruent_aa, are_congruent_ss, are_equal_mi, are_equal_mm, are_equal_pp, are_parallel_ll, are_parallel_ls, are_parallel_rr, are_parallel_sl, are_parallel_ss, are_perpendicular_ll, are_perpendicular_lr, are_perpendicular_ls, are_perpendicular_rl, are_perpendicular_sl, are_perpendicular_ss, area, area_P, center_c, circle_pm, circle_pp, circle_ppp, circle_ps, contained_by_pc, contained_by_pl, distance_pp, equality_PP, equality_Pm, equality_aa, equality_mi, equality_mm, equality_ms, equality_pp, equality_si, equality_sm, equality_ss, intersect_Cl, intersect_cc, intersect_cl, intersect_cs, intersect_lc, intersect_ll, intersect_lr, intersect_ls, intersect_rl, intersect_rr, intersect_rs, intersect_sl, intersect_sr, intersect_ss, line_bisector_pp, line_bisector_s, line_pl, line_pp, line_pr, line_ps, measure, midpoint_pp, midpoint_s, minus_A, minus_a, minus_m, minus_mm, minus_ms, minus_sm, minus_ss, mirror_cc, mirror_cl, mirror_cp, mirror_ll, mirror_lp, mirror_pc, mirror_pl, mirror_pp, mirror_ps, orthogonal_line_pl, orthogonal_line_pr, orthogonal_line_ps, point_, point_c, point_l, point_pm, point_pmpm, point_s, polar_pc, polygon, polygon_ppi, power_mi, power_si, product_bb, product_ff, product_fm, product_iA, product_if, product_im, product_is, product_mf, product_mm, product_ms, product_sm, product_ss, prove_b, radius_c, ratio_ii, ratio_mi, ratio_mm, ratio_ms, ratio_si, ratio_sm, ratio_ss, ray_pp, rotate_pAp, rotate_pap, segment_pp, semicircle, sum_mi, sum_mm, sum_ms, sum_ss, tangent_pc, touches_cc, touches_cl, touches_lc, translate_pv, vector_pp."
+    context += ", ".join(command_names) + "."
     context += "One final thing to observe is that it is invalid to define the same symbol twice. For example, including the phrase "
     context += "<example>\n"
     context += "rotate_pAp : B angle_90_rad A -> C\n"
     context += "point_pm : B leg2 -> C\n"
     context += "</example>\n"
     context += "will render an entire construction invalid because the symbol 'C' is defined twice.\n"
-    context += "Finally, measure_test.py provides end-to-end examples of parsing and executing the commands in the geometric constructions, as well as testing the constructions to see if they constrain the quantity of the variable named by the 'measure' command.\n"
+    context += "Finally, discriminator.py provides end-to-end examples of parsing and executing the commands in the geometric constructions, as well as testing the constructions to see if they constrain the quantity of the variable named by the 'measure' command.\n"
     context += "random_constr.py, similarly, provides some examples and important functions."
     context += "Ultimately, the task is to generate a large number of files which construct some geometric object and then measure it, in such a way that the value of the measure is constrained to a specific value.\n"
-    context += "measure_test.py will be used to filter out constructions which do not meet the required criteria.\n"
+    context += "discriminator.py will be used to filter out constructions which do not meet the required criteria.\n"
     context += "No particular value is placed on the elegance or educational value of the constructions generated. However, variety in constructions is desirable, subject to the above constraints.\n"
 
     return context
 
 
-context = create_context()
+class FileBlockParser:
+    """Incremental parser for FILE_START: <name> ... FILE_END blocks in streamed text."""
+    def __init__(self):
+        self.buffer = ""
+        self.name: Optional[str] = None
+        self.lines: List[str] = []
 
-prompt = """Please generate %d new geometric constructions which satisfy the criteria described in the system prompt.
-Format each construction as follows:
-FILE_START: construction_name_1.txt
-[construction content]
-FILE_END
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Add streamed text, and return the (filename, contents) of the blocks it completed."""
+        self.buffer += text
+        blocks = []
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            blocks += self._line(line)
+        return blocks
 
-FILE_START: construction_name_2.txt
-[construction content]
-FILE_END
+    def close(self) -> List[Tuple[str, str]]:
+        """The end of the response; a block without its FILE_END was cut off, and is dropped."""
+        blocks = self._line(self.buffer) if self.buffer else []
+        self.buffer = ""
+        self.name = None
+        return blocks
 
-... and so on for all such constructions.
-"""
-def handle_response(response):
-    # Split the response into individual files
-    files = response.split("FILE_START:")
-    files = [file.strip() for file in files if file.strip()]
-    
-    # Process each file
-    for file in files:
-        # Extract the filename and content
-        filename = file.split("\n")[0].strip()
-        content = "\n".join(file.split("\n")[1:-1]).strip() # remove first line (FILE_START: filename) and last line (FILE_END)
-
-        # Write the file to the current directory
-        with open(f"generated_constructions/{filename}", 'w') as f:
-            f.write(content)
-
-for i in range(1): 
-    response = generate_response(prompt, context=context, num_files=100)
-    # print(response)
-    handle_response(response)
-    # print(response)
+    def _line(self, line: str) -> List[Tuple[str, str]]:
+        stripped = line.strip()
+        if stripped.startswith("FILE_START:"):
+            self.name = stripped[len("FILE_START:"):].strip()
+            self.lines = []
+        elif stripped.startswith("FILE_END"):
+            if self.name is not None:
+                block = (self.name, "\n".join(self.lines).strip() + "\n")
+                self.name = None
+                return [block]
+        elif self.name is not None and not stripped.startswith("```"): # models like to put the contents in code fences
+            self.lines.append(stripped)
+        return []
+
+
+def validate_construction(filename: str, contents: str, num_tests: int, seed_entropy: int) -> Tuple[str, str]:
+    """(status, detail) of a generated construction, where status is 'pass', 'load_error', 'no_measure' or 'fail'. Runs in a worker process."""
+    # the same per-file streams as the discriminator, so verdicts are reproducible
+    seed_global_streams(attempt_seed_sequence(seed_entropy, filename_key(filename)))
+    construction = Construction()
+    try:
+        construction.load(None, file_contents=contents)
+    except Exception as e:
+        return "load_error", f"{type(e).__name__}: {e}"
+    if construction.statement_type != "measure":
+        return "no_measure", ""
+    results = test_measure_construction(None, num_tests=num_tests, file_contents=contents)
+    if results is None:
+        return "fail", "no run could be measured"
+    if not results["pass"]:
+        return "fail", f"most common value {results['mode']} in {results['mode_count']} of {num_tests} runs"
+    return "pass", str(results["mode"])
+
+
+class LLMGenerationRun:
+    def __init__(self, args, client: openai.AsyncOpenAI, context: str, pool: concurrent.futures.Executor):
+        self.args = args
+        self.client = client
+        self.context = context
+        self.pool = pool
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.statuses: Counter = Counter()
+        self.retries = 0
+        self.seen = set()  # canonical hashes of the constructions written
+        self.validations: List[asyncio.Task] = []
+
+    def messages(self, num_files: int) -> List[dict]:
+        # the context first and unchanged, so that it's a shared prefix of every request
+        return [
+            {"role": "system", "content": self.context},
+            {"role": "user", "content": prompt % num_files},
+        ]
+
+    async def validate_and_save(self, request_index: int, block_index: int, name: str, contents: str):
+        # the request and block numbers keep names from different requests (which all start at construction_name_1.txt) apart
+        filename = f"llm_{request_index}_{block_index}_{os.path.basename(name) or 'construction.txt'}"
+        if not filename.endswith(".txt"):
+            filename += ".txt"
+        status, detail = await asyncio.get_running_loop().run_in_executor(
+            self.pool, validate_construction, filename, contents, self.args.num_tests, self.args.seed_entropy)
+        if status == "pass":
+            construction_hash = canonical_hash_text(contents)
+            if construction_hash in self.seen:
+                status = "duplicate"
+            else:
+                self.seen.add(construction_hash)
+                with open(os.path.join(self.args.output_dir, filename), 'w') as f:
+                    f.write(contents)
+        elif self.args.verbose:
+            print(f"{filename}: {status} {detail}")
+        self.statuses[status] += 1
+
+    async def request(self, request_index: int):
+        remaining = self.args.files_per_request
+        num_blocks = 0
+        for attempt in range(self.args.max_retries + 1):
+            if remaining <= 0:
+                break
+            if attempt > 0:
+                self.retries += 1
+                await asyncio.sleep(self.args.retry_delay * 2 ** (attempt - 1))
+            parser = FileBlockParser()
+            async with self.semaphore:
+                try:
+                    stream = await self.client.chat.completions.create(
+                        model=self.args.model, messages=self.messages(remaining), temperature=self.args.temperature, stream=True)
+                    finished = False
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        finished = finished or chunk.choices[0].finish_reason is not None
+                        blocks = parser.feed(chunk.choices[0].delta.content or "")
+                        if finished:
+                            blocks += parser.close()
+                        for name, contents in blocks:
+                            num_blocks += 1
+                            remaining -= 1
+                            self.validations.append(asyncio.create_task(self.validate_and_save(request_index, num_blocks, name, contents)))
+                    if finished:
+                        break # a complete response; fewer files than asked for is the model's choice, not an error
+                    # the blocks that did arrive are kept, and the retry only asks for the rest
+                    print(f"Request {request_index} was cut off after {num_blocks} constructions, {self.args.max_retries - attempt} retries left")
+                except (openai.APIError, httpx.HTTPError) as e:
+                    print(f"Request {request_index} failed ({type(e).__name__}: {e}), {self.args.max_retries - attempt} retries left")
+
+    async def run(self):
+        await asyncio.gather(*(self.request(i) for i in range(self.args.num_requests)))
+        # the tasks of the last blocks may still be running
+        await asyncio.gather(*self.validations)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate construction files with an LLM, keeping the ones which pass the measure test")
+    parser.add_argument("--model", type=str, default="gpt-4.1-mini", help="Chat completions model")
+    parser.add_argument("--base_url", type=str, default=None, help="Base URL of an OpenAI-compatible server (default: the OpenAI API)")
+    parser.add_argument("--num_requests", type=int, default=1, help="Number of completion requests")
+    parser.add_argument("--files_per_request", type=int, default=100, help="Constructions asked for in each request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of requests in flight")
+    parser.add_argument("--max_retries", type=int, default=3, help="Retries of a failed request")
+    parser.add_argument("--retry_delay", type=float, default=2.0, help="Seconds before the first retry, doubled for every further one")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--examples_dir", type=str, default="passed", help="Passed constructions to show the model as examples (searched recursively)")
+    parser.add_argument("--num_examples", type=int, default=6, help="Number of example constructions in the context")
+    parser.add_argument("--num_tests", type=int, default=20, help="Measure test runs per construction")
+    parser.add_argument("--max_workers", type=int, default=8, help="Worker processes checking constructions")
+    parser.add_argument("--output_dir", type=str, default="generated_constructions", help="Where to write the constructions which pass")
+    parser.add_argument("--seed", type=int, default=None, help="Root seed for the measure tests (see seeding.py)")
+    parser.add_argument("--verbose", action="store_true", help="Print why each rejected construction failed")
+    return parser.parse_args()
+
+def main(args):
+    dotenv.load_dotenv()
+    os.makedirs(args.output_dir, exist_ok=True)
+    args.seed_entropy = root_entropy(args.seed)
+    # a local stand-in server doesn't need a real key; retries are done here, around the whole streamed response
+    api_key = os.getenv("OPENAI_API_KEY") or ("unused" if args.base_url else None)
+    client = openai.AsyncOpenAI(api_key=api_key, base_url=args.base_url, max_retries=0)
+    context = create_context(args.examples_dir, args.num_examples)
+    start_time = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.max_workers) as pool:
+        run = LLMGenerationRun(args, client, context, pool)
+        asyncio.run(run.run())
+    elapsed = time.monotonic() - start_time
+    num_files = sum(run.statuses.values())
+    print(f"{args.num_requests} requests ({run.retries} retries) returned {num_files} constructions in {elapsed:.0f}s: "
+          + ", ".join(f"{count} {status}" for status, count in run.statuses.most_common()))
+    print(f"Wrote {run.statuses['pass']} passing constructions to {args.output_dir}")
+    return run
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,308 @@
+import math
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generator, List, Tuple, Union
+
+import geo_types as gt
+from random_constr import Command, Element, ConstCommand
+from geo_types import MEASURABLE_TYPES
+from classical_generator import ClassicalGenerator, Node, parse_args, main as base_main
+
+# Generates constructions whose measured quantity depends on a pattern of commands (GOAL_PATTERNS), planning
+# backward from the pattern instead of sampling freely and discarding misses like PolygonRotationGenerator.
+# Usage: python pipeline.py --generator_class GoalDirectedGenerator
+
+@dataclass
+class GoalPattern:
+    name: str
+    # command name -> minimum number of distinct commands of that name the measured quantity must depend on
+    required: Dict[str, int]
+    # command name -> command name: the measured quantity must reach the first without going through the second
+    # (e.g. depend on the original polygon other than through its rotation)
+    direct_paths: Dict[str, str] = field(default_factory=dict)
+    # commands which make the problem family degenerate, never sampled
+    excluded: Tuple[str, ...] = ()
+
+
+GOAL_PATTERNS = {
+    # the same family as PolygonRotationGenerator, translated by missing_angle_translate
+    "polygon_rotation": GoalPattern(
+        name="polygon_rotation",
+        required={"polygon_from_center_and_circumradius": 1, "rotate_polygon_about_center": 1, "diagonal_p": 3},
+        direct_paths={"polygon_from_center_and_circumradius": "rotate_polygon_about_center"},
+        # invariant under rotation, or a second way to rotate
+        excluded=("area_P", "circumcircle_p", "rotate_polygon_about_center_by_equivalent_angle"),
+    ),
+}
+
+# probability of picking an input which adds the most required commands to the goal cone, rather than any compatible input
+GOAL_INPUT_FOCUS = 0.9
+
+
+class GoalDirectedGenerator(ClassicalGenerator):
+    def __init__(self, seed=None, command_types=None, sampling_policy=None, macros=None, pattern: GoalPattern = GOAL_PATTERNS["polygon_rotation"]):
+        super().__init__(seed, command_types, sampling_policy, macros)
+        self.pattern = pattern
+        missing_commands = [name for name in pattern.required if name not in self.available_commands]
+        if missing_commands:
+            raise ValueError(f"Goal pattern {pattern.name} needs commands {missing_commands}, which are not in command types {command_types}")
+        self.num_required = sum(pattern.required.values())
+        self._plannable_commands = [name for name in self.available_commands if self._is_plannable(name)]
+        self._producers: Dict[Any, List[str]] = {}
+        for name in self._plannable_commands:
+            for output_type in self._output_types[name] or ():
+                self._producers.setdefault(output_type, []).append(name)
+        self._type_cost_cache: Dict[frozenset, Dict[Any, float]] = {}
+        self._num_commands = 0
+
+    def _is_plannable(self, cmd_name: str) -> bool:
+        """Commands the planner may propose; the same exclusions as ClassicalGenerator._sample_commands, minus the ones about sequence position."""
+        if cmd_name in self.pattern.excluded:
+            return False
+        if any(word in cmd_name for word in ('prove', 'measure', 'minus', 'sum', 'ratio', 'product', 'power_')) or cmd_name == 'area_P':
+            return False
+        if self.available_commands[cmd_name]['return_type'] == gt.Boolean:
+            return False
+        return self._output_types[cmd_name] is not None
+
+    # --- relaxed planning over element types ---
+
+    def _input_types(self, cmd_name: str) -> List[Any]:
+        if cmd_name == 'diagonal_p':
+            return [gt.Polygon] # sampled as two vertices of a polygon, see _execute_new_command
+        return self.available_commands[cmd_name]['param_types']
+
+    @staticmethod
+    def _is_free_type(param_type) -> bool:
+        """Types _find_compatible_elements makes a new constant for, so they never need a command."""
+        if param_type in (int, float, gt.AngleSize, Any):
+            return True
+        return getattr(param_type, "__origin__", None) is Union and any(t in (int, float) for t in param_type.__args__)
+
+    def _input_cost(self, param_type, type_costs: Dict[Any, float]) -> float:
+        if self._is_free_type(param_type):
+            return 0
+        # compatibility is by exact type (see _is_compatible_type), so a non-numeric Union is never satisfiable
+        return type_costs.get(param_type, math.inf)
+
+    def _command_cost(self, cmd_name: str, type_costs: Dict[Any, float]) -> float:
+        """Lower bound on the number of commands to run before and including cmd_name (h_max)."""
+        return 1 + max((self._input_cost(t, type_costs) for t in self._input_types(cmd_name)), default=0)
+
+    def _type_costs(self) -> Dict[Any, float]:
+        """Lower bound on the number of commands needed to have an element of each type, from the current elements."""
+        available = frozenset(type(element.data) for element in self.identifiers.values())
+        if available in self._type_cost_cache:
+            return self._type_cost_cache[available]
+        type_costs: Dict[Any, float] = {t: 0 for t in available}
+        changed = True
+        while changed:
+            changed = False
+            for cmd_name in self._plannable_commands:
+                cost = self._command_cost(cmd_name, type_costs)
+                if cost == math.inf:
+                    continue
+                for output_type in self._output_types[cmd_name]:
+                    if cost < type_costs.get(output_type, math.inf):
+                        type_costs[output_type] = cost
+                        changed = True
+        self._type_cost_cache[available] = type_costs
+        return type_costs
+
+    def _plan_commands(self, missing: Dict[str, int], type_costs: Dict[Any, float]) -> List[str]:
+        """
+        Chain backward from the missing required commands through the cheapest producers of their input types,
+        and return the commands on that relaxed plan which can run now, required commands first.
+        """
+        runnable = []
+        frontier = list(missing)
+        seen = set(frontier)
+        while frontier:
+            cmd_name = frontier.pop(0)
+            cost = self._command_cost(cmd_name, type_costs)
+            if cost == math.inf:
+                continue
+            if cost == 1:
+                runnable.append(cmd_name)
+                continue
+            for param_type in self._input_types(cmd_name):
+                param_cost = self._input_cost(param_type, type_costs)
+                if param_cost == 0:
+                    continue
+                for producer in self._producers.get(param_type, []):
+                    if producer not in seen and self._command_cost(producer, type_costs) == param_cost:
+                        seen.add(producer)
+                        frontier.append(producer)
+        return runnable
+
+    # --- progress towards the goal, in terms of cones ---
+
+    def _update_goal_instances(self):
+        self._goal_instances = []
+        for command in self.command_sequence:
+            if isinstance(command, ConstCommand) or command.name not in self.pattern.required:
+                continue
+            mask = 0
+            for output_elem in command.output_elements:
+                node = self.dependency_graph.nodes.get(output_elem)
+                if node is not None:
+                    mask |= node.bit
+            self._goal_instances.append((command.name, mask))
+
+    def _goal_score(self, cone: int) -> int:
+        """How many of the required commands (capped at the required counts) the cone contains."""
+        counts = Counter(name for name, mask in self._goal_instances if mask & cone)
+        return sum(min(count, counts[name]) for name, count in self.pattern.required.items())
+
+    def _missing_commands(self) -> Dict[str, int]:
+        """Required commands which haven't been run often enough anywhere in the sequence yet."""
+        counts = Counter(name for name, _ in self._goal_instances)
+        return {name: count - counts[name] for name, count in self.pattern.required.items() if counts[name] < count}
+
+    def _goal_satisfied(self) -> bool:
+        """Whether some measurable quantity already depends on the whole pattern."""
+        return any(self._goal_score(node.cone) >= self.num_required for node in ClassicalGenerator._measurable_nodes(self))
+
+    def _has_measurable_output(self, cmd_name: str) -> bool:
+        return any(issubclass(t, MEASURABLE_TYPES) for t in self._output_types[cmd_name])
+
+    def _commands_needed(self, missing: Dict[str, int], type_costs: Dict[Any, float]) -> float:
+        """Lower bound on the number of commands still needed to satisfy the pattern in a single cone."""
+        if not missing:
+            return 0 if self._goal_satisfied() else 1 # at least one command to merge the cones, or measure the one that has it all
+        preconditions = max(self._command_cost(name, type_costs) - 1 for name in missing)
+        return sum(missing.values()) + preconditions
+
+    # --- overrides ---
+
+    def _reset_construction(self):
+        super()._reset_construction()
+        self._goal_instances: List[Tuple[str, int]] = []  # (command name, bitmask of its output nodes) for every required command run so far
+
+    def generate_construction(self, num_commands: int = 5, max_iterations=None, deadline=None, min_num_commands=None) -> List[Command]:
+        self._num_commands = num_commands
+        if max_iterations is None:
+            # past the budget only goal commands are sampled, which can run out for good, so there has to be a cap
+            max_iterations = 10 * num_commands
+        return super().generate_construction(num_commands, max_iterations, deadline, min_num_commands)
+
+    def _max_length(self, num_commands: int) -> int:
+        return 2 * num_commands
+
+    def _construction_complete(self, num_commands: int) -> bool:
+        # the budget is soft: past it, only goal commands are sampled, until the goal is met (or max_iterations runs out)
+        if len(self.command_sequence) < num_commands:
+            return False
+        self._update_goal_instances()
+        return self._goal_satisfied() or len(self.command_sequence) >= 2 * num_commands
+
+    def _sample_commands(self) -> Generator[str, None, None]:
+        if len(self.command_sequence) == 0:
+            yield 'point_'
+        self._update_goal_instances()
+        type_costs = self._type_costs()
+        missing = self._missing_commands()
+        if missing:
+            focus = self._plan_commands(missing, type_costs)
+        elif not self._goal_satisfied():
+            # everything has been run, but in different branches, or only something unmeasurable depends on all of it:
+            # try the commands whose (greedily chosen) inputs would depend on the most required commands, measurable ones first
+            best_score = max(self._goal_score(node.cone) for node in self.dependency_graph.order)
+            scores = {name: self._lookahead_score(name) for name in self._plannable_commands
+                      if name not in self.pattern.required and self._command_cost(name, type_costs) == 1}
+            focus = [name for name, score in scores.items() if score >= best_score]
+            focus = self._order_commands(focus)
+            focus.sort(key=lambda name: (-scores[name], not self._has_measurable_output(name)))
+        else:
+            focus = []
+        tried = set()
+        for cmd_name in focus:
+            tried.add(cmd_name)
+            yield cmd_name
+
+        budget_left = self._num_commands - len(self.command_sequence)
+        if budget_left <= self._commands_needed(missing, type_costs):
+            # anything else could make the goal unreachable within the budget
+            return
+        for cmd_name in super()._sample_commands():
+            # required commands are only run when the plan asks for them
+            if cmd_name in tried or cmd_name in self.pattern.required or cmd_name in self.pattern.excluded:
+                continue
+            yield cmd_name
+
+    def _element_cone(self, element: Element) -> int:
+        node = self.dependency_graph.nodes.get(element)
+        return node.cone if node is not None else 0
+
+    def _best_input_gains(self, candidates: List[Element], chosen_cone: int) -> Tuple[int, List[Element]]:
+        """The largest number of required commands any candidate adds to chosen_cone, and the candidates which add that many."""
+        base_score = self._goal_score(chosen_cone)
+        best_gain, best = 0, []
+        for element in candidates:
+            gain = self._goal_score(chosen_cone | self._element_cone(element)) - base_score
+            if gain > best_gain:
+                best_gain, best = gain, [element]
+            elif gain == best_gain and gain > 0:
+                best.append(element)
+        return best_gain, best
+
+    def _lookahead_score(self, cmd_name: str) -> int:
+        """Goal score of the output of cmd_name if its inputs were picked greedily to maximize it."""
+        cone = 0
+        used = set()
+        for param_type in self._input_types(cmd_name):
+            if self._is_free_type(param_type):
+                continue
+            candidates = [element for element in self.identifiers.values() if type(element.data) == param_type and element not in used]
+            if not candidates:
+                return 0
+            _, best = self._best_input_gains(candidates, cone)
+            if best:
+                used.add(best[0])
+                cone |= self._element_cone(best[0])
+        return self._goal_score(cone)
+
+    def _choose_input(self, cmd_name: str, candidates: List[Element], chosen: List[Element]) -> Element:
+        """Mostly pick an input which adds the most required commands to the cone of the inputs chosen so far."""
+        chosen_cone = 0
+        for element in chosen:
+            chosen_cone |= self._element_cone(element)
+        best_gain, best = self._best_input_gains(candidates, chosen_cone)
+        if best_gain > 0 and random.random() < GOAL_INPUT_FOCUS:
+            return random.choice(best)
+        return random.choice(candidates)
+
+    def _measurable_nodes(self) -> List[Node]:
+        self._update_goal_instances()
+        return [node for node in super()._measurable_nodes() if self._goal_score(node.cone) >= self.num_required]
+
+    def _reaches_directly(self, node: Node, cmd_name: str, blocked_cmd_name: str) -> bool:
+        """Whether node depends on a cmd_name command through a path which doesn't go through a blocked_cmd_name command."""
+        stack = [node]
+        visited = set()
+        while stack:
+            node = stack.pop()
+            if node.index in visited:
+                continue
+            visited.add(node.index)
+            if node.command is not None and not isinstance(node.command, ConstCommand):
+                if node.command.name == cmd_name:
+                    return True
+                if node.command.name == blocked_cmd_name:
+                    continue
+            stack.extend(node.parents)
+        return False
+
+    def _accept_construction(self, ordered_commands: List[Command]) -> bool:
+        target_node = self.dependency_graph.nodes[ordered_commands[-1].input_elements[0]]
+        for cmd_name, blocked_cmd_name in self.pattern.direct_paths.items():
+            if not self._reaches_directly(target_node, cmd_name, blocked_cmd_name):
+                return False
+        return True
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.generator_class = GoalDirectedGenerator
+    base_main(args)
@@ -0,0 +1,145 @@
+# Mines fragments of passed constructions which pass more often than average into macros the generator
+# can apply as one step (--macro_library).
+# Usage: python macro_miner.py --passed_dir passed --failed_dir failed --output macros.json
+
+import argparse
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from random_constr import ConstCommand
+from canonical import canonical_form, parse_construction_commands
+
+# commands whose inputs the generator picks with special semantics (polygon vertices, number of sides), which it only uses
+# as the first step (free points), or which aren't construction steps
+MACRO_EXCLUDED_COMMANDS = {"measure", "prove", "point_", "diagonal_p", "polygon_from_center_and_circumradius"}
+
+
+@dataclass
+class Macro:
+    name: str
+    form: str  # canonical listing; "$k" is parameter k, other numbers are elements produced inside the macro
+    num_params: int
+    support: int  # passed files containing the fragment
+    fails: int  # failed files containing the fragment
+
+    @property
+    def pass_rate(self) -> float:
+        return (self.support + 1) / (self.support + self.fails + 2)
+
+    def steps(self) -> List[Tuple[str, List[str], List[str]]]:
+        """(command name, input refs, output refs) for every command of the macro, in order."""
+        steps = []
+        for line in self.form.split("\n"):
+            cmd_name, rest = line.split(" : ")
+            inputs, outputs = rest.split("->")
+            steps.append((cmd_name, inputs.split(), outputs.split()))
+        return steps
+
+    def command_names(self) -> Set[str]:
+        return {cmd_name for cmd_name, _, _ in self.steps()}
+
+
+def construction_files(directory: Optional[str]) -> List[str]:
+    """Every construction file under directory (all timestamps), skipping the answer keys."""
+    files = []
+    if directory is None or not os.path.isdir(directory):
+        return files
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(".txt") and filename != "answers.txt":
+                files.append(os.path.join(root, filename))
+    return sorted(files)
+
+def connected_fragments(commands: list, max_size: int) -> Set[frozenset]:
+    """Index sets of every connected group of 2..max_size commands (connected through the elements they share)."""
+    producer = {}
+    for c, command in enumerate(commands):
+        for element in command.output_elements:
+            if element is not None:
+                producer[id(element)] = c
+    neighbours: Dict[int, Set[int]] = {c: set() for c in range(len(commands))}
+    for c, command in enumerate(commands):
+        for element in command.input_elements:
+            if id(element) in producer:
+                neighbours[c].add(producer[id(element)])
+                neighbours[producer[id(element)]].add(c)
+    fragments = set()
+    frontier = {frozenset([c]) for c in range(len(commands))}
+    for _ in range(max_size - 1):
+        grown = set()
+        for fragment in frontier:
+            for c in fragment:
+                for neighbour in neighbours[c] - fragment:
+                    grown.add(fragment | {neighbour})
+        fragments |= grown
+        frontier = grown
+    return fragments
+
+def file_fragments(filename: str, max_size: int) -> Set[str]:
+    """Canonical forms of the fragments of one construction file."""
+    with open(filename, 'r') as f:
+        commands = parse_construction_commands(f.read())
+    # consts are left out, so that their values become parameters (filled with fresh constants when the macro is applied)
+    commands = [command for command in commands if not isinstance(command, ConstCommand) and command.name not in MACRO_EXCLUDED_COMMANDS]
+    return {canonical_form([commands[c] for c in sorted(fragment)]) for fragment in connected_fragments(commands, max_size)}
+
+def mine_macros(passed_files: List[str], failed_files: List[str], min_support: int = 5, max_size: int = 3, max_macros: int = 50) -> List[Macro]:
+    support: Counter = Counter()
+    fails: Counter = Counter()
+    for counter, files in ((support, passed_files), (fails, failed_files)):
+        for filename in files:
+            try:
+                counter.update(file_fragments(filename, max_size))
+            except Exception as e:
+                print(f"Skipping {filename}: {e}")
+    overall_pass_rate = (len(passed_files) + 1) / (len(passed_files) + len(failed_files) + 2)
+    macros = []
+    for form, count in support.items():
+        if count < min_support:
+            continue
+        num_params = len({token for token in form.split() if token.startswith("$")})
+        macro = Macro(name="", form=form, num_params=num_params, support=count, fails=fails[form])
+        if macro.pass_rate > overall_pass_rate:
+            macros.append(macro)
+    # most passes beyond what an average fragment would have got first
+    macros.sort(key=lambda macro: (macro.pass_rate - overall_pass_rate) * (macro.support + macro.fails), reverse=True)
+    macros = macros[:max_macros]
+    for i, macro in enumerate(macros):
+        macro.name = f"macro_{i}"
+    return macros
+
+def save_macros(macros: List[Macro], filename: str):
+    with open(filename, 'w') as f:
+        json.dump([asdict(macro) for macro in macros], f, indent=1)
+
+def load_macros(filename: str) -> List[Macro]:
+    with open(filename, 'r') as f:
+        return [Macro(**entry) for entry in json.load(f)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mine frequent sub-constructions of passed problems into macro-commands")
+    parser.add_argument("--passed_dir", type=str, default="passed", help="Directory of passed constructions (searched recursively)")
+    parser.add_argument("--failed_dir", type=str, default="failed", help="Directory of failed constructions, for the pass rates (searched recursively)")
+    parser.add_argument("--output", type=str, default="macros.json", help="Where to write the macro library")
+    parser.add_argument("--min_support", type=int, default=5, help="Minimum number of passed files a fragment must appear in")
+    parser.add_argument("--max_size", type=int, default=3, help="Maximum number of commands in a macro")
+    parser.add_argument("--max_macros", type=int, default=50, help="Maximum number of macros to keep")
+    return parser.parse_args()
+
+def main(args):
+    passed_files = construction_files(args.passed_dir)
+    failed_files = construction_files(args.failed_dir)
+    print(f"Mining {len(passed_files)} passed and {len(failed_files)} failed constructions")
+    macros = mine_macros(passed_files, failed_files, args.min_support, args.max_size, args.max_macros)
+    save_macros(macros, args.output)
+    print(f"Wrote {len(macros)} macros to {args.output}")
+    for macro in macros[:10]:
+        print(f"{macro.name}: support {macro.support}, pass rate {macro.pass_rate:.2f}")
+        print("    " + macro.form.replace("\n", "\n    "))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -13,6 +13,7 @@ import concurrent.futures
 import threading
 from base_translate import translate_problem as base_translate_problem
 from missing_angle_translate import translate_problem as missing_angle_translate_problem
+from construction_store import open_store
 global_timestamp = str(int(time.time()))
 
 
@@ -29,21 +30,16 @@ def process_file_contents(filename: str, contents: str, answer: str, output_dir:
     return json.dumps({"question": problem, "answer": answer, "hash": hash, "original_filename": filename, "stats": stats})
 
 
-def process_timestamp_dirs(args: argparse.Namespace) -> None:
+def directory_tasks(args: argparse.Namespace, hashes: Dict[str, bool]) -> List[tuple]:
     """
     Search the 'passed' directory for subdirectories that look like timestamps
-    and process their contents if they come after the specified timestamp.
+    and collect translation tasks for their contents if they come after the specified timestamp.
     
     Args:
         after: Optional timestamp to filter directories (process only dirs with 
                timestamps greater than this value)
         hashes: Dictionary of file hashes that have already been processed
-        max_workers: Maximum number of parallel workers to use
     """
-    if args.hash_check:
-        hashes = read_hashes(args.output_dir)
-    else:
-        hashes = {}
     passed_dir = "passed"
     
     # Get all subdirectories that look like timestamps
@@ -68,9 +64,12 @@ def process_timestamp_dirs(args: argparse.Namespace) -> None:
     # Process each directory
     for timestamp, dir_path in timestamp_dirs:
         print(f"Processing directory: {dir_path} (timestamp: {timestamp})")
-        # Process all files in the directory
+        # Process all files in the directory; answers by filename, so each file's answer is one lookup
+        answers = {}
         with open(os.path.join(dir_path, "answers.txt"), 'r') as f:
-            answer_lines = f.read().strip().split("\n")
+            for line in f:
+                filename, _, answer = line.strip().partition(": ")
+                answers[filename] = answer
         for file_path in glob.glob(os.path.join(dir_path, "*.txt")):
             if "answers.txt" in file_path:
                 continue
@@ -79,11 +78,53 @@ def process_timestamp_dirs(args: argparse.Namespace) -> None:
             hash = hashlib.sha256(contents.encode()).hexdigest()
             if args.hash_check and hash in hashes:
                 continue
-            for line in answer_lines:
-                if line.startswith(filename):
-                    answer = line.split(" ")[1]
-                    break
-            all_tasks.append((f"{dir_path}/{filename}", contents, answer, args.output_dir, hash, args.translator_type))
+            if filename not in answers:
+                print(f"No answer for {filename} in {dir_path}/answers.txt")
+                continue
+            all_tasks.append((f"{dir_path}/{filename}", contents, answers[filename], args.output_dir, hash, args.translator_type))
+    return all_tasks
+
+
+def store_tasks(args: argparse.Namespace, hashes: Dict[str, bool]) -> List[tuple]:
+    """
+    Translation tasks for the passed constructions in a construction store, looked up by key (see construction_store.py).
+    Constructions translated before (by an interrupted run which is being resumed) are skipped: they're marked in the store's
+    "translations", or, if the run stopped between writing the output file and marking them, their hash is in the output file.
+    With --timestamp, only the verdicts from that round on are read (see discriminator.StoreSink).
+    """
+    store = open_store(args.store)
+    round_counts = store.round(args.timestamp) if args.timestamp is not None else None
+    written = {}
+    if args.output_name and os.path.exists(os.path.join(args.output_dir, args.output_name)):
+        with open(os.path.join(args.output_dir, args.output_name), 'r') as f:
+            written = {json.loads(line)["hash"]: True for line in f if line.strip()}
+    all_tasks = []
+    for verdict in store.records("verdicts", since=round_counts["verdicts_from"] if round_counts is not None else (0, 0)):
+        if verdict["status"] != "pass" or store.has("translations", verdict["key"]):
+            continue
+        if args.timestamp is not None and (verdict["round"] < args.timestamp if args.interpret_timestamp_as_after else verdict["round"] != args.timestamp):
+            continue
+        contents = store.get("constructions", verdict["key"])["text"]
+        hash = hashlib.sha256(contents.encode()).hexdigest()
+        if (args.hash_check and hash in hashes) or hash in written:
+            continue
+        all_tasks.append((f"{args.store}/{verdict['key']}", contents, str(verdict["answer"]), args.output_dir, hash, args.translator_type))
+    store.close()
+    print(f"Translating {len(all_tasks)} constructions from {args.store}")
+    return all_tasks
+
+
+def process_timestamp_dirs(args: argparse.Namespace) -> None:
+    """Translate the passed constructions (from passed/<timestamp> directories, or from a construction store) into one JSONL file."""
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.hash_check:
+        hashes = read_hashes(args.output_dir)
+    else:
+        hashes = {}
+    if args.store:
+        all_tasks = store_tasks(args, hashes)
+    else:
+        all_tasks = directory_tasks(args, hashes)
     
     if args.translator_type == "base":
         name_extension = "mechanically_translated"
@@ -96,13 +137,22 @@ def process_timestamp_dirs(args: argparse.Namespace) -> None:
     # Process all tasks in parallel
     if args.sequential:
         for task in all_tasks:
-            problem_json_string = process_file_contents(*task)
+            try:
+                problem_json_string = process_file_contents(*task)
+            except Exception as e:
+                print(f"Error translating {task[0]}: {e}")
+                continue
             all_problem_json_strings.append(problem_json_string)
     else:
         with concurrent.futures.ProcessPoolExecutor(max_workers=args.max_workers) as executor:
             futures = {executor.submit(process_file_contents, *task): task[0] for task in all_tasks}
             for future in concurrent.futures.as_completed(futures):
-                problem_json_string = future.result()
+                try:
+                    problem_json_string = future.result()
+                except Exception as e:
+                    # one construction the translator can't handle shouldn't lose the others
+                    print(f"Error translating {futures[future]}: {e}")
+                    continue
                 if problem_json_string is None:
                     continue
                 all_problem_json_strings.append(problem_json_string)
@@ -118,6 +168,16 @@ def process_timestamp_dirs(args: argparse.Namespace) -> None:
             f.write(problem_json_string + "\n")
             count += 1
 
+    if args.store:
+        # mark everything tried (including what the translator threw out), so a resumed run doesn't translate it again
+        store = open_store(args.store)
+        for task in all_tasks:
+            store.append("translations", {"key": os.path.basename(task[0]), "hash": task[4], "output_file": output_file})
+        round_counts = store.round(args.timestamp) if args.timestamp is not None and not args.interpret_timestamp_as_after else None
+        if round_counts is not None:
+            round_counts["translations"] = round_counts.get("translations", 0) + count
+        store.close()
+
     print (f"Wrote {count} translations to: {output_file}")
 
 
@@ -148,6 +208,8 @@ def parse_args():
                         help="Maximum number of parallel workers")
     parser.add_argument("--sequential", action="store_true",
                         help="Process files singlethreaded (for debugging)")
+    parser.add_argument("--store", type=str, default=None,
+                        help="Translate the passed constructions of this construction store (of --timestamp's round, if given) instead of passed/")
     parser.add_argument("--translator_type", type=str, choices=["missing_angle", "base"], default="base",
                         help="Type of translator to use")
     args = parser.parse_args()
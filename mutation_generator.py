@@ -0,0 +1,209 @@
+import functools
+import random
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from geo_types import MEASURABLE_TYPES, AngleSize
+from random_constr import Command, ConstCommand, Element, const_type_to_str
+from classical_generator import ClassicalGenerator, Node, build_parser, main as base_main
+from canonical import parse_construction_commands, canonical_hash_text
+from macro_miner import MACRO_EXCLUDED_COMMANDS, construction_files
+
+# Makes new constructions by replaying passed ones with a mutation (const, swap, insert or retarget, see MUTATIONS),
+# recording the parent's canonical hash and the mutations in each file.
+# Usage: python mutation_generator.py --parents_dir passed
+
+MUTATIONS = ("const", "swap", "insert", "retarget")
+# commands swapped in must be ones the generator would sample itself
+SWAP_EXCLUDED_WORDS = ("prove", "measure", "minus", "sum", "ratio", "product", "power_", "area_P")
+# most commands sampled by one insert mutation (it stops early once a new measurable quantity appears)
+INSERT_STEPS = 3
+# probability of taking a new command's input from the parent's construction, rather than any compatible element
+PARENT_INPUT_FOCUS = 0.8
+# parents (or mutations of them) tried per attempt before giving up
+MAX_REPLAYS = 10
+# commands giving a polygon's vertices and then the polygon, so their number of outputs follows its number of sides
+POLYGON_COMMANDS = ("polygon_from_center_and_circumradius", "rotate_polygon_about_center")
+
+
+class MutationGenerator(ClassicalGenerator):
+    def __init__(self, seed=None, command_types=None, sampling_policy=None, macros=None, parent_files: Optional[List[str]] = None, max_mutations: int = 2):
+        """
+        Args:
+            parent_files: passed construction files to mutate
+            max_mutations: each child gets between 1 and this many (different) mutations
+        """
+        super().__init__(seed, command_types, sampling_policy, macros)
+        if not parent_files:
+            raise ValueError("MutationGenerator needs a corpus of passed constructions to mutate")
+        self.parent_files = parent_files
+        self.max_mutations = max_mutations
+        self._alternatives_cache: Dict[str, List[str]] = {}
+
+    def _reset_construction(self):
+        super()._reset_construction()
+        self.parent_hash: Optional[str] = None
+        self.mutations: List[str] = []
+        self._parent_target: Optional[Node] = None  # the parent's measured quantity, in this construction
+        self._parent_cone = 0  # bitmask of the parent's nodes
+        self._inserted_mask = 0  # bitmask of the nodes made by insert/retarget
+
+    def _alternatives(self, cmd_name: str) -> List[str]:
+        """Enabled commands with the same input and output types as cmd_name."""
+        if cmd_name not in self._alternatives_cache:
+            info = self.available_commands[cmd_name]
+            self._alternatives_cache[cmd_name] = [
+                name for name, other in self.available_commands.items()
+                if name != cmd_name and name not in MACRO_EXCLUDED_COMMANDS and not any(word in name for word in SWAP_EXCLUDED_WORDS)
+                and other['param_types'] == info['param_types'] and self._output_types[name] == self._output_types[cmd_name]
+            ]
+        return self._alternatives_cache[cmd_name]
+
+    def _mutated_const_value(self, command: ConstCommand, num_sides: bool = False):
+        # from the same values the generator samples
+        if num_sides:
+            return random.choice([value for value in (4, 5, 6, 7, 8, 9, 10, 11, 12) if value != command.value])
+        if command.datatype is AngleSize:
+            return random.choice([angle for angle in np.pi / 12 * np.arange(1, 13) if not np.isclose(angle, command.value)])
+        return random.choice([value for value in range(1, 13) if value != command.value])
+
+    def _replay(self, parent_commands: list, mutations: List[str]) -> bool:
+        """
+        Rebuild the parent construction in this generator, with the const and swap mutations applied to a random command each,
+        and the parent's measured command left out for retarget. Returns False if it couldn't be rebuilt.
+        """
+        measure_commands = [command for command in parent_commands if not isinstance(command, ConstCommand) and command.name == 'measure']
+        if len(measure_commands) != 1:
+            return False
+        parent_target = measure_commands[0].input_elements[0]
+        commands = [command for command in parent_commands if command is not measure_commands[0]]
+        if any(not isinstance(command, ConstCommand) and command.name not in self.available_commands for command in commands):
+            return False # made with commands outside this generator's command types
+        const_indices = [k for k, command in enumerate(commands) if isinstance(command, ConstCommand)]
+        swap_indices = [k for k, command in enumerate(commands) if not isinstance(command, ConstCommand) and self._alternatives(command.name)]
+        if ("const" in mutations and not const_indices) or ("swap" in mutations and not swap_indices):
+            return False
+        mutated_const = random.choice(const_indices) if "const" in mutations else None
+        side_counts = {id(command.input_elements[0]) for command in commands
+                       if not isinstance(command, ConstCommand) and command.name == "polygon_from_center_and_circumradius"}
+        swapped = random.choice(swap_indices) if "swap" in mutations else None
+        dropped = None
+        if "retarget" in mutations:
+            # only if nothing else uses the measured command's outputs
+            target_command = parent_target.command
+            if not any(element in target_command.output_elements for command in commands if not isinstance(command, ConstCommand)
+                       for element in command.input_elements):
+                dropped = target_command
+
+        mapping: Dict[int, Element] = {}  # id of a parent element -> the element rebuilt here
+        for k, command in enumerate(commands):
+            if command is dropped:
+                continue
+            if isinstance(command, ConstCommand):
+                value = self._mutated_const_value(command, id(command.element) in side_counts) if k == mutated_const else command.value
+                if command.datatype is int:
+                    value = int(value) # parsed as a float
+                element, _ = self._add_constant(const_type_to_str[command.datatype], value)
+                mapping[id(command.element)] = element
+                continue
+            if any(id(element) not in mapping for element in command.input_elements):
+                return False # uses a vertex which the polygon lost with its new number of sides
+            cmd_name = random.choice(self._alternatives(command.name)) if k == swapped else command.name
+            success, new_command = self._try_apply_command(cmd_name, [mapping[id(element)] for element in command.input_elements])
+            if not success:
+                return False
+            outputs = list(zip(command.output_elements, new_command.output_elements))
+            if len(new_command.output_elements) != len(command.output_elements):
+                if command.name not in POLYGON_COMMANDS:
+                    return False
+                # a different number of sides: the vertices the polygon still has, in order, then the polygon itself
+                outputs = list(zip(command.output_elements[:-1], new_command.output_elements[:-1])) \
+                    + [(command.output_elements[-1], new_command.output_elements[-1])]
+            self.command_sequence.append(new_command)
+            self._update_dependency_graph(new_command)
+            for element, new_element in outputs:
+                if element is not None:
+                    mapping[id(element)] = new_element
+        for node in self.dependency_graph.order:
+            self._parent_cone |= node.bit
+        if dropped is None:
+            self._parent_target = self.dependency_graph.nodes[mapping[id(parent_target)]]
+        return True
+
+    def _extend(self) -> bool:
+        """Sample up to INSERT_STEPS commands building on the parent, until one of them makes a new measurable quantity."""
+        for _ in range(INSERT_STEPS):
+            command = self._execute_new_command()
+            if command is None:
+                continue
+            self.command_sequence.append(command)
+            self._update_dependency_graph(command)
+            for node in self.dependency_graph.order:
+                if not node.bit & self._parent_cone:
+                    self._inserted_mask |= node.bit
+            if self._measurable_nodes():
+                return True
+        return False
+
+    def generate_construction(self, num_commands: int = 5, max_iterations=None, deadline=None, min_num_commands=None) -> List[Command]:
+        # the length comes from the parent, so num_commands and min_num_commands are unused
+        for _ in range(MAX_REPLAYS):
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            self._reset_construction()
+            parent_file = random.choice(self.parent_files)
+            try:
+                with open(parent_file, 'r') as f:
+                    parent_text = f.read()
+                parent_commands = parse_construction_commands(parent_text)
+            except Exception as e:
+                print(f"Skipping parent {parent_file}: {e}")
+                continue
+            mutations = random.sample(MUTATIONS, random.randint(1, self.max_mutations))
+            self.mutations = mutations
+            if not self._replay(parent_commands, mutations):
+                continue
+            if ("insert" in mutations or "retarget" in mutations) and not self._extend():
+                continue
+            self.parent_hash = canonical_hash_text(parent_text)
+            return self.command_sequence
+        # nothing to measure
+        self._parent_target = None
+        self._inserted_mask = 0
+        return self.command_sequence
+
+    def _choose_input(self, cmd_name: str, candidates: List[Element], chosen: List[Element]) -> Element:
+        if random.random() < PARENT_INPUT_FOCUS:
+            nodes = self.dependency_graph.nodes
+            from_parent = [element for element in candidates if element in nodes and nodes[element].bit & self._parent_cone]
+            if from_parent:
+                return random.choice(from_parent)
+        return random.choice(candidates)
+
+    def _measurable_nodes(self) -> List[Node]:
+        if "insert" in self.mutations or "retarget" in self.mutations:
+            return [node for node in super()._measurable_nodes() if node.cone & self._inserted_mask]
+        if self._parent_target is not None and isinstance(self._parent_target.element.data, MEASURABLE_TYPES):
+            return [self._parent_target]
+        return []
+
+    def format_construction(self, description: str = "Generated construction") -> str:
+        lines = super().format_construction(description).split("\n")
+        header_length = next(k for k, line in enumerate(lines) if not line.startswith("#"))
+        lines[header_length:header_length] = [f"# parent: {self.parent_hash}", f"# mutations: {', '.join(self.mutations)}"]
+        return "\n".join(lines)
+
+
+def parse_args():
+    parser = build_parser()
+    parser.add_argument("--parents_dir", type=str, default="passed", help="Directory of passed constructions to mutate (searched recursively)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    parent_files = construction_files(args.parents_dir)
+    print(f"Mutating {len(parent_files)} passed constructions from {args.parents_dir}")
+    args.generator_class = functools.partial(MutationGenerator, parent_files=parent_files)
+    base_main(args)
@@ -436,7 +436,8 @@ def format_polygon_command(command, idents: Dict[Element, str]):
         polygon_in = input_labels[0]
         angle = invert_pi_expression(input_labels[1])
         vertices = output_labels[:-1]
-        
+        vertices_str = ''.join(vertices)
+        num_sides = len(vertices) # not named in the template; keeps the renaming below from failing
         polygon_templates = [
             f"{vertices_str} is {polygon_in} rotated counterclockwise about its center by {angle} radians.",
             f"{vertices_str} is obtained by rotating {polygon_in} counterclockwise about its center by {angle} radians.",
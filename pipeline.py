@@ -1,76 +1,281 @@
+import os
 import pdb
 import time
+import math
 from pathlib import Path
 import argparse
+import functools
+from typing import Tuple
 from classical_generator import main as generator_main
 from classical_generator import ClassicalGenerator
 from polygon_rotation_generator import PolygonRotationGenerator
-from discriminator import main as discriminator_main
+from goal_directed_generator import GoalDirectedGenerator
+from beam_search_generator import BeamSearchGenerator
+from mutation_generator import MutationGenerator
+from macro_miner import construction_files
+from discriminator import PASS_AGREEMENTS, main as discriminator_main
 from mechanical_translator import main as translator_main
+from sampling_policy import update_policy_file, update_policy_from_store
+from construction_store import ConstructionStore, open_store
+import streaming_pipeline
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run the full geometry pipeline")
-    parser.add_argument("--count", type=int, default=20, help="Number of constructions to attempt")
+    parser.add_argument("--count", type=int, default=20, help="Number of constructions to attempt (per round, with --target_valid/--time_budget)")
+    parser.add_argument("--target_valid", type=int, default=None, help="Keep running generate/discriminate/translate rounds until this many constructions have passed")
+    parser.add_argument("--time_budget", type=float, default=None, help="Don't start new rounds (or generation attempts) after this many seconds")
+    parser.add_argument("--attempt_timeout", type=float, default=30.0, help="Per-attempt cap in seconds on generating the command sequence (0 for none)")
+    parser.add_argument("--max_iterations", type=int, default=None, help="Per-attempt cap on command sampling rounds (default 10 * num_commands)")
     parser.add_argument("--generator_class", type=str, default="ClassicalGenerator", help="Generator class to use")
     parser.add_argument("--generator_command_types", type=str, nargs="+", choices=["polygon", "circle", "triangle", "basic", "all"], default=["all"])
     parser.add_argument("--num_generator_commands", type=int, default=25, help="Number of commands to generate")
     parser.add_argument("--min_num_generator_commands", type=int, default=8, help="Minimum number of commands in the output sequence")
+    parser.add_argument("--targets_per_run", type=int, default=1, help="Maximum number of measure targets to extract from each generated sequence")
+    parser.add_argument("--min_target_distance", type=float, default=0.5, help="Minimum Jaccard distance between ancestor sets of targets from the same sequence")
     parser.add_argument("--nomultiprocess", action="store_false", dest="multiprocess", help="Don't run tests in parallel")
     parser.add_argument("--max_workers", type=int, default=16, help="Maximum number of threads to use")
     parser.add_argument("--generated_constructions_dir", type=str, default="generated_constructions", help="Output directory")
     parser.add_argument("--output_translations_dir", type=Path, default=Path("natural_language_problems"), help="Output directory")
     parser.add_argument("--seed", type=int, default=None, help="Seed for the generator")
     parser.add_argument("--discriminator_num_tests", type=int, default=20, help="Number of tests to run")
+    parser.add_argument("--verdict_cache", type=str, default=None, help="SQLite file of discriminator verdicts by canonical construction hash, so constructions judged in earlier runs or rounds aren't tested again")
+    parser.add_argument("--discriminator_sequential", action="store_true", help="Stop testing a file as soon as its verdict is decided (same verdicts, far fewer tests)")
+    parser.add_argument("--sampling_policy_file", type=str, default=None, help="State file of the learned command sampling weights; generation samples with them and they're updated with this run's discriminator outcomes (default: sample commands uniformly)")
+    parser.add_argument("--macro_library", type=str, default=None, help="Macro library written by macro_miner.py for the generator to apply")
+    parser.add_argument("--parents_dir", type=str, default="passed", help="Passed constructions for MutationGenerator to mutate (re-read every round)")
+    parser.add_argument("--uniform_sampling", action="store_true", help="Sample commands uniformly instead of with the learned weights (outcomes are still recorded)")
+    parser.add_argument("--streaming", action="store_true", help="Run generation, discrimination and translation at the same time in separate process pools, "
+                        "passing constructions in memory (see streaming_pipeline.py); --count is then the total number of attempts, unlimited with --target_valid/--time_budget")
+    parser.add_argument("--generation_workers", type=int, default=None, help="Streaming: generation processes (default: split max_workers)")
+    parser.add_argument("--discrimination_workers", type=int, default=None, help="Streaming: discrimination processes (default: split max_workers)")
+    parser.add_argument("--translation_workers", type=int, default=None, help="Streaming: translation processes (default max_workers // 8)")
+    parser.add_argument("--queue_size", type=int, default=256, help="Streaming: constructions waiting for the discriminator (or translator) before the stage before it waits")
+    parser.add_argument("--chunk_size", type=int, default=16, help="Constructions per discriminator process pool task")
+    parser.add_argument("--report_dir", type=str, default="discriminator_reports", help="Where to write the discriminator's failure-reason reports ('' for none)")
+    parser.add_argument("--store", action="store_true", help="Keep the run's constructions and verdicts in a sharded construction store, runs/<timestamp> "
+                        "(see construction_store.py), instead of a file per construction in generated_constructions_<ts>/, passed/ and failed/")
+    parser.add_argument("--resume", type=str, default=None, help="Continue the interrupted --store run with this id (its directory in runs/), "
+                        "skipping the attempts, verdicts and translations it finished; pass the same other arguments")
+    parser.add_argument("--dump_dir", type=str, default=None, help="Streaming: also write the judged constructions to <dump_dir>/passed and <dump_dir>/failed, for debugging")
     args = parser.parse_args()
     if args.generator_class == "ClassicalGenerator":
         args.generator_class = ClassicalGenerator
     elif args.generator_class == "PolygonRotationGenerator":
         args.generator_class = PolygonRotationGenerator
+    elif args.generator_class == "GoalDirectedGenerator":
+        args.generator_class = GoalDirectedGenerator
+    elif args.generator_class == "BeamSearchGenerator":
+        args.generator_class = BeamSearchGenerator
+    elif args.generator_class == "MutationGenerator":
+        args.generator_class = MutationGenerator
     else:
         raise ValueError(f"Invalid generator class: {args.generator_class}")
     args.generated_constructions_dir = Path(args.generated_constructions_dir + "_" + str(int(time.time())))
     return args
 
-def main():
-    args = parse_args()
-    generator_args = argparse.Namespace(
-        count=args.count,
-        generator_class=args.generator_class,
+def count_passed(timestamp, store=None) -> int:
+    if store is not None:
+        return store.round(timestamp)["passed"]
+    passed_dir = f"passed/{timestamp}"
+    return len([f for f in os.listdir(passed_dir) if f.endswith(".txt") and f != "answers.txt"])
+
+def create_store(args) -> str:
+    """Create the run's construction store, with the pipeline's arguments in its manifest, and return its directory."""
+    store_dir = os.path.join("runs", str(int(time.time())))
+    meta = {key: value if isinstance(value, (int, float, str, bool, list, type(None))) else str(value) for key, value in vars(args).items()}
+    ConstructionStore(store_dir, meta=meta).close()
+    print(f"Construction store: {store_dir}")
+    return store_dir
+
+def next_round_size(args, num_attempts: int, num_valid: int, previous_round_size: int) -> int:
+    """Number of attempts for the next round, from the yield observed so far."""
+    max_round_size = 10 * args.count
+    if args.target_valid is None or num_valid == 0:
+        return min(max_round_size, 2 * previous_round_size)
+    valid_per_attempt = num_valid / num_attempts
+    # aim a little past the target, since the yield estimate is noisy
+    needed = math.ceil(1.2 * (args.target_valid - num_valid) / valid_per_attempt)
+    return max(args.count, min(max_round_size, needed))
+
+def output_name(args, timestamp) -> str:
+    if args.generator_command_types != ["all"]:
+        return f"{timestamp}_{'_'.join(args.generator_command_types)}.jsonl"
+    return f"{timestamp}.jsonl"
+
+def translator_type(args) -> str:
+    # GoalDirectedGenerator writes ordinary measure constructions too; only PolygonRotationGenerator needs the missing-angle translator
+    return "base" if args.generator_class in (ClassicalGenerator, BeamSearchGenerator, MutationGenerator, GoalDirectedGenerator) else "missing_angle"
+
+def generator_arguments(args, count, first_attempt, time_budget, store_dir=None) -> argparse.Namespace:
+    generator_class = args.generator_class
+    if generator_class is MutationGenerator:
+        # this includes what passed in the previous rounds
+        parent_files = construction_files(args.parents_dir)
+        if not parent_files:
+            raise ValueError(f"No passed constructions in {args.parents_dir} for MutationGenerator to mutate")
+        generator_class = functools.partial(MutationGenerator, parent_files=parent_files)
+    return argparse.Namespace(
+        count=count,
+        first_attempt=first_attempt,
+        target_count=None,
+        time_budget=time_budget,
+        attempt_timeout=args.attempt_timeout,
+        max_iterations=args.max_iterations,
+        generator_class=generator_class,
         num_commands=args.num_generator_commands,
         min_num_commands=args.min_num_generator_commands,
+        targets_per_run=args.targets_per_run,
+        min_target_distance=args.min_target_distance,
         command_types=args.generator_command_types,
         multiprocess=args.multiprocess,
         max_workers=args.max_workers,
         output_dir=args.generated_constructions_dir,
         seed=args.seed,
+        sampling_policy_file=args.sampling_policy_file,
+        uniform_sampling=args.uniform_sampling,
+        telemetry_output=None,
+        health_min_attempts=50,
+        health_flag_rate=0.01,
+        keep_duplicates=False,
+        macro_library=args.macro_library,
+        store=store_dir,
     )
-    generator_main(generator_args)
-    
-    discriminator_args = argparse.Namespace(
-        path=args.generated_constructions_dir,
-        num_tests=args.discriminator_num_tests,
-        verbosity=0,
-        move_files=True,
-        multiprocess=args.multiprocess,
-        max_workers=args.max_workers,
-    )
-    timestamp = discriminator_main(discriminator_args)
-    nl_file_name = f"{timestamp}.jsonl"
-    if args.generator_command_types != ["all"]:
-        nl_file_name = f"{timestamp}_{'_'.join(args.generator_command_types)}.jsonl"
-    translator_args = argparse.Namespace(
-        input_dir=args.generated_constructions_dir,
-        output_dir=args.output_translations_dir,
-        timestamp=timestamp,
-        interpret_timestamp_as_after=False,
-        output_name=nl_file_name,
-        hash_check=False,
-        max_workers=args.max_workers,
-        sequential=not args.multiprocess,
-        translator_type="base" if args.generator_class == ClassicalGenerator else "missing_angle",
-    )
-    final_timestamp = translator_main(translator_args)
-    print (f"Final timestamp: {final_timestamp}")
+
+def save_checkpoint(store_dir, checkpoint: dict):
+    """Record the run's progress in its store's manifest, for --resume."""
+    store = open_store(store_dir)
+    store.manifest["checkpoint"] = checkpoint
+    store.save_manifest()
+
+def load_checkpoint(run_id) -> Tuple[str, dict]:
+    store_dir = os.path.join("runs", str(run_id))
+    if not os.path.exists(os.path.join(store_dir, "manifest.json")):
+        raise ValueError(f"No run {run_id} to resume in runs/")
+    checkpoint = open_store(store_dir).manifest.get("checkpoint")
+    if checkpoint is None:
+        raise ValueError(f"Run {run_id} has no checkpoint to resume from")
+    return store_dir, checkpoint
+
+def main_streaming(args, store_dir=None, checkpoint=None):
+    if checkpoint is None:
+        checkpoint = {"mode": "streaming", "timestamp": int(time.time()), "elapsed": 0.0}
+        store_dir = create_store(args) if args.store else None
+        if store_dir:
+            save_checkpoint(store_dir, checkpoint)
+    timestamp = checkpoint["timestamp"]
+    output_file = args.output_translations_dir / output_name(args, timestamp)
+    # one round without an attempt limit, unless neither a target nor a budget is given
+    count = args.count if args.target_valid is None and args.time_budget is None else None
+    time_left = args.time_budget - checkpoint["elapsed"] if args.time_budget is not None else None
+    generator_args = generator_arguments(args, count, 0, time_left, store_dir)
+    num_valid = streaming_pipeline.run(args, generator_args, str(output_file), translator_type(args), timestamp, checkpoint)
+    print(f"Pipeline finished: {num_valid} valid constructions, written to {output_file}")
+
+def main():
+    args = parse_args()
+    store_dir = None
+    checkpoint = None
+    if args.resume:
+        # the run's records are in its store; the checkpoint says which round and stage it was in
+        store_dir, checkpoint = load_checkpoint(args.resume)
+        print(f"Resuming run {args.resume} from {store_dir}: " + ", ".join(f"{key} {value}" for key, value in checkpoint.items()))
+        if checkpoint["mode"] == "streaming":
+            main_streaming(args, store_dir, checkpoint)
+            return
+    elif args.streaming:
+        main_streaming(args)
+        return
+    elif args.store:
+        store_dir = create_store(args)
+    if checkpoint is None:
+        # timestamp: the current round's discriminator run; output_name: the file every round appends to, named after the first one
+        checkpoint = {"mode": "rounds", "round": 0, "stage": "generate", "round_size": args.count, "first_attempt": 0, "timestamp": None,
+                      "num_attempts": 0, "num_valid": 0, "elapsed": 0.0, "output_name": None}
+        if store_dir:
+            save_checkpoint(store_dir, checkpoint)
+    start_time = time.monotonic() - checkpoint["elapsed"]
+    while checkpoint["stage"] != "finished":
+        if checkpoint["stage"] == "generate":
+            time_left = args.time_budget - (time.monotonic() - start_time) if args.time_budget is not None else None
+            generator_args = generator_arguments(args, checkpoint["round_size"], checkpoint["first_attempt"], time_left, store_dir)
+            generation_progress = generator_main(generator_args)
+            # attempts skipped were done by the interrupted run, before it could record them here
+            num_attempts = generation_progress.attempts + generation_progress.skipped
+            checkpoint["num_attempts"] += num_attempts
+            checkpoint["first_attempt"] += num_attempts
+            checkpoint["stage"] = "discriminate"
+            if store_dir:
+                # the store has no passed/<ts> directories to tell rounds apart, so every round gets a later timestamp than the last
+                checkpoint["timestamp"] = max(int(time.time()), (checkpoint["timestamp"] or 0) + 1)
+        elif checkpoint["stage"] == "discriminate":
+            discriminator_args = argparse.Namespace(
+                path=args.generated_constructions_dir,
+                num_tests=args.discriminator_num_tests,
+                verbosity=0,
+                move_files=True,
+                multiprocess=args.multiprocess,
+                max_workers=args.max_workers,
+                seed=args.seed,
+                sequential=args.discriminator_sequential,
+                max_disagreements=None,
+                min_agreements=PASS_AGREEMENTS,
+                verdict_cache=args.verdict_cache or None,
+                chunk_size=args.chunk_size,
+                report_dir=args.report_dir,
+                all_candidates=False,
+                store=store_dir,
+                timestamp=checkpoint["timestamp"] if store_dir else None,
+            )
+            timestamp = checkpoint["timestamp"] = discriminator_main(discriminator_args)
+            if args.sampling_policy_file:
+                if store_dir:
+                    num_files = update_policy_from_store(args.sampling_policy_file, open_store(store_dir), timestamp)
+                else:
+                    num_files = update_policy_file(args.sampling_policy_file, f"passed/{timestamp}", f"failed/{timestamp}")
+                print(f"Updated command sampling weights in {args.sampling_policy_file} from {num_files} files")
+            if checkpoint["output_name"] is None:
+                checkpoint["output_name"] = output_name(args, timestamp)
+            checkpoint["stage"] = "translate"
+        else:
+            timestamp = checkpoint["timestamp"]
+            translator_args = argparse.Namespace(
+                input_dir=args.generated_constructions_dir,
+                output_dir=args.output_translations_dir,
+                timestamp=timestamp,
+                interpret_timestamp_as_after=False,
+                output_name=checkpoint["output_name"],
+                hash_check=False,
+                max_workers=args.max_workers,
+                sequential=not args.multiprocess,
+                translator_type=translator_type(args),
+                store=store_dir,
+            )
+            final_timestamp = translator_main(translator_args)
+            print (f"Final timestamp: {final_timestamp}")
+
+            checkpoint["num_valid"] += count_passed(timestamp, open_store(store_dir) if store_dir else None)
+            num_valid = checkpoint["num_valid"]
+            num_attempts = checkpoint["num_attempts"]
+            elapsed = time.monotonic() - start_time
+            checkpoint["stage"] = "generate"
+            checkpoint["round"] += 1
+            if args.target_valid is None and args.time_budget is None:
+                checkpoint["stage"] = "finished"
+            else:
+                valid_rate = num_valid / elapsed if elapsed > 0 else 0.0
+                message = f"Progress: {num_valid} valid from {num_attempts} attempts ({100 * num_valid / max(1, num_attempts):.2f}% yield) in {elapsed:.0f}s"
+                if args.target_valid is not None and valid_rate > 0:
+                    message += f", ~{max(0, args.target_valid - num_valid) / valid_rate:.0f}s to target"
+                print(message)
+                if (args.target_valid is not None and num_valid >= args.target_valid) or (args.time_budget is not None and elapsed >= args.time_budget):
+                    checkpoint["stage"] = "finished"
+                else:
+                    checkpoint["round_size"] = next_round_size(args, num_attempts, num_valid, checkpoint["round_size"])
+        checkpoint["elapsed"] = time.monotonic() - start_time
+        if store_dir:
+            save_checkpoint(store_dir, checkpoint)
+    print(f"Pipeline finished: {checkpoint['num_valid']} valid constructions from {checkpoint['num_attempts']} attempts, "
+          f"written to {args.output_translations_dir / checkpoint['output_name']}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
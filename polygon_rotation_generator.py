@@ -12,18 +12,26 @@ from random_constr import Element, Command, ConstCommand
 # later in the pipeline, the generated problem when translated into NL will have a different form:
 # the "answer" to the measure will be given, and the new question will be to find the angle of rotation, which will be omitted.
 class PolygonRotationGenerator(ClassicalGenerator):
-    def __init__(self, seed=None):
-        super().__init__(seed)
-        self.made_polygon_already: bool = False
-        self.rotated_polygon_already: bool = False
+    def __init__(self, seed=None, command_types=None, sampling_policy=None, macros=None):
+        super().__init__(seed, command_types, sampling_policy, macros)
+
+    def reset(self, seed=None):
+        super().reset(seed)
         self.num_diagonal_constructions = random.randint(20, 30) # won't necessarily all end up in longest construction; in fact, the vast majority will not
 
+    def _reset_construction(self):
+        super()._reset_construction()
+        self.rotated_polygon_already: bool = False
+        self.num_diagonals: int = 0
+
     # override 
     def _sample_commands(self) -> Generator[str, None, None]:
+        if len(self.command_sequence) == 0:
+            yield "point_" # the polygon needs a center
         if not self.made_polygon_already:
-            yield "polygon_from_center_and_circumradius" # note: this doesn't work,  you have to construct the args first... try yielding those above and setting true after; check resulting files
+            yield "polygon_from_center_and_circumradius"
 
-        if len(self.all_segments) < self.num_diagonal_constructions:
+        if self.made_polygon_already and self.num_diagonals < self.num_diagonal_constructions:
             yield "diagonal_p"
         command_names = list(self.available_commands.keys())
         # encourage rotation of a polygon, but only after we've done a few other things
@@ -34,7 +42,7 @@ class PolygonRotationGenerator(ClassicalGenerator):
         for _ in range (3):
             command_names.append('orthogonal_line_pl')
             command_names.append('orthogonal_line_ps')
-        random.shuffle(command_names)
+        command_names = self._order_commands(command_names)
         
         for cmd_name in command_names:
             if 'prove' in cmd_name or 'measure' in cmd_name:
@@ -72,22 +80,27 @@ class PolygonRotationGenerator(ClassicalGenerator):
                     continue
             yield cmd_name
     
-    def _try_apply_command(self, cmd_name: str, input_elements: List[Element]) -> Tuple[bool, Command]:
-        result = super()._try_apply_command(cmd_name, input_elements)
-        return result
+    def _try_apply_command(self, cmd_name: str, input_elements: List[Element], label_factory=None) -> Tuple[bool, Command]:
+        success, command = super()._try_apply_command(cmd_name, input_elements, label_factory)
+        if success:
+            if cmd_name == 'rotate_polygon_about_center':
+                self.rotated_polygon_already = True
+            elif cmd_name == 'diagonal_p':
+                self.num_diagonals += 1
+        return success, command
     
-    def compute_longest_construction(self, j):
+    def compute_measure_targets(self, j, *args, **kwargs):
         if not self.made_polygon_already:
             raise Exception("How did you generate something without a polygon?")
         # this can naturally already happen because we only encouraged rotations, not required by any construction
         if not self.rotated_polygon_already:
-            return False
-        res = super().compute_longest_construction(j)
-        if not res:
-            return False
+            return
+        yield from super().compute_measure_targets(j, *args, **kwargs)
+
+    def _accept_construction(self, ordered_commands):
         # even if we did do a rotation, it doesn't necessarily end up in the longest construction
         # many failures are okay, construction is cheap
-        if not any(False if isinstance(cmd, ConstCommand) else cmd.name == 'rotate_polygon_about_center' for cmd in self.pruned_command_sequence):
+        if not any(False if isinstance(cmd, ConstCommand) else cmd.name == 'rotate_polygon_about_center' for cmd in ordered_commands):
             return False
 
         visited = set()
@@ -113,12 +126,12 @@ class PolygonRotationGenerator(ClassicalGenerator):
             for parent in node.parents:
                 dfs(parent)
         
-        start_node = self.dependency_graph.nodes[self.pruned_command_sequence[-1].output_elements[0]]
+        start_node = self.dependency_graph.nodes[ordered_commands[-1].output_elements[0]]
         # DFS from the measured node in the reverse dependency graph
         dfs(start_node)
         if not (relies_on_orig_polygon and relies_on_rotated_polygon):
             return False
-        if np.count_nonzero(np.array([False if isinstance(cmd, ConstCommand) else cmd.name == 'diagonal_p' for cmd in self.pruned_command_sequence])) < 3:
+        if np.count_nonzero(np.array([False if isinstance(cmd, ConstCommand) else cmd.name == 'diagonal_p' for cmd in ordered_commands])) < 3:
             return False
         return True
 
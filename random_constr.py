@@ -91,9 +91,9 @@ class Command:
         if not isinstance(output_data, (tuple, list)):
             output_data = (output_data,)
         if self.output_elements:
-            if len(output_data) != len(self.output_elements):
-                pdb.set_trace()
-            assert(len(output_data) == len(self.output_elements))
+            # e.g. a tangent intersection gives one point where the command names two; a degenerate case like any other
+            assert len(output_data) == len(self.output_elements), \
+                f"{self.name} gave {len(output_data)} outputs, expected {len(self.output_elements)}"
             for x,o in zip(output_data, self.output_elements):
                 if o is not None:
                     o.data = x
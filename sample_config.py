@@ -47,6 +47,7 @@ rotate_polygon_commands = [
 ]
 polygon_commands = [
     'polygon_from_center_and_circumradius',
+    'diagonal_p',
     'area_P',
     'circumcircle_p',
 ]
@@ -86,6 +87,17 @@ triangle_commands = [
     
 ]
 
+# the angle commands currently all live in basic_commands too; this list only exists so that
+# "angle" (and "all") can be selected like the other categories.
+angle_commands = [
+    'angle_ppp',
+    'angular_bisector_ll',
+    'angular_bisector_ppp',
+    'angular_bisector_ss',
+    'rotate_pAp',
+    'rotate_pap',
+]
+
 def get_commands(command_types):
     commands = basic_commands.copy()
     if "all" in command_types:
@@ -0,0 +1,153 @@
+# Learned command weights for the classical generators: commands are credited with the discriminator outcome of
+# the constructions they appear in, and sampled by Thompson sampling over each one's pass rate.
+# Usage: python sampling_policy.py --show
+
+import os
+import json
+import random
+import argparse
+from typing import Dict, List, Iterable, Optional
+
+
+def construction_command_names(contents: str) -> List[str]:
+    """Names of the (non-const, non-measure) commands used in a construction file."""
+    names = []
+    for line in contents.strip().split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name = line.split()[0]
+        if name in ('const', 'measure', 'prove'):
+            continue
+        names.append(name)
+    return names
+
+
+class CommandSamplingPolicy:
+    """
+    Per-command Beta(prior_passes + passes, prior_fails + fails) posterior over the probability that a
+    construction containing the command passes the discriminator.
+    """
+    def __init__(self, state_file: Optional[str] = None, prior_passes: float = 1.0, prior_fails: float = 19.0):
+        self.state_file = state_file
+        # the default prior is a ~5% pass rate with the weight of 20 observations, roughly what the pipeline sees
+        self.prior_passes = prior_passes
+        self.prior_fails = prior_fails
+        self.stats: Dict[str, Dict[str, int]] = {}  # command name -> {"passes": ..., "fails": ...}
+
+    @classmethod
+    def load(cls, state_file: str) -> 'CommandSamplingPolicy':
+        """Load a policy from its state file; a missing file gives a fresh (uniform) policy."""
+        policy = cls(state_file)
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                state = json.load(f)
+            policy.prior_passes = state.get("prior_passes", policy.prior_passes)
+            policy.prior_fails = state.get("prior_fails", policy.prior_fails)
+            policy.stats = state["commands"]
+        return policy
+
+    def save(self, state_file: Optional[str] = None):
+        state_file = state_file or self.state_file
+        state = {"prior_passes": self.prior_passes, "prior_fails": self.prior_fails, "commands": self.stats}
+        # write then rename, so a crash never leaves a truncated state file behind
+        tmp_file = f"{state_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, state_file)
+
+    def update(self, command_names: Iterable[str], passed: bool):
+        """Credit every (distinct) command in a construction with its discriminator outcome."""
+        for name in set(command_names):
+            entry = self.stats.setdefault(name, {"passes": 0, "fails": 0})
+            entry["passes" if passed else "fails"] += 1
+
+    def update_from_dirs(self, passed_dir: str, failed_dir: str) -> int:
+        """Update from the passed/ and failed/ directories written by one discriminator run. Returns the number of files read."""
+        num_files = 0
+        for directory, passed in ((passed_dir, True), (failed_dir, False)):
+            if not os.path.isdir(directory):
+                continue
+            for filename in os.listdir(directory):
+                if not filename.endswith('.txt') or filename == "answers.txt":
+                    continue
+                with open(os.path.join(directory, filename), 'r') as f:
+                    self.update(construction_command_names(f.read()), passed)
+                num_files += 1
+        return num_files
+
+    def pass_rate(self, cmd_name: str) -> float:
+        """Posterior mean pass rate of constructions containing cmd_name."""
+        entry = self.stats.get(cmd_name, {"passes": 0, "fails": 0})
+        alpha = self.prior_passes + entry["passes"]
+        beta = self.prior_fails + entry["fails"]
+        return alpha / (alpha + beta)
+
+    def sample_weight(self, cmd_name: str) -> float:
+        """Thompson sample of the pass rate, so that rarely seen commands keep getting explored."""
+        entry = self.stats.get(cmd_name, {"passes": 0, "fails": 0})
+        return random.betavariate(self.prior_passes + entry["passes"], self.prior_fails + entry["fails"])
+
+    def order(self, command_names: List[str]) -> List[str]:
+        """
+        Weighted random permutation of command_names (Efraimidis-Spirakis), used in place of random.shuffle.
+        Duplicated names keep their extra weight, as with the uniform shuffle.
+        """
+        # draw in first-seen order (not set order, which changes with the string hash seed), so seeded runs are reproducible
+        weights = {name: self.sample_weight(name) for name in dict.fromkeys(command_names)}
+        keys = [(random.random() ** (1.0 / max(weights[name], 1e-12)), name) for name in command_names]
+        keys.sort(reverse=True)
+        return [name for _, name in keys]
+
+    def __repr__(self):
+        return f"CommandSamplingPolicy({len(self.stats)} commands, state_file={self.state_file})"
+
+
+def load_policy(args) -> Optional[CommandSamplingPolicy]:
+    """The policy the generator should sample with, or None for uniform sampling."""
+    if args.uniform_sampling or not args.sampling_policy_file:
+        return None
+    return CommandSamplingPolicy.load(args.sampling_policy_file)
+
+
+def update_policy_file(state_file: str, passed_dir: str, failed_dir: str) -> int:
+    policy = CommandSamplingPolicy.load(state_file)
+    num_files = policy.update_from_dirs(passed_dir, failed_dir)
+    policy.save()
+    return num_files
+
+
+def update_policy_from_store(state_file: str, store, timestamp: int) -> int:
+    """Like update_policy_file, from the verdicts of one discriminator run (timestamp) in a ConstructionStore. Returns the number of verdicts read."""
+    policy = CommandSamplingPolicy.load(state_file)
+    num_verdicts = 0
+    round_counts = store.round(timestamp)
+    for verdict in store.records("verdicts", since=round_counts["verdicts_from"] if round_counts is not None else (0, 0)):
+        if verdict["round"] == timestamp:
+            policy.update(construction_command_names(store.get("constructions", verdict["key"])["text"]), verdict["status"] == "pass")
+            num_verdicts += 1
+    policy.save()
+    return num_verdicts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Update or inspect the learned command sampling weights")
+    parser.add_argument("--state_file", type=str, default="sampling_policy.json", help="Policy state file")
+    parser.add_argument("--update", type=int, nargs="*", default=[], help="Discriminator timestamps (passed/<ts>, failed/<ts>) to learn from")
+    parser.add_argument("--show", action="store_true", help="Print the posterior pass rate of every command")
+    args = parser.parse_args()
+    return args
+
+def main(args):
+    for timestamp in args.update:
+        num_files = update_policy_file(args.state_file, os.path.join("passed", str(timestamp)), os.path.join("failed", str(timestamp)))
+        print(f"Updated {args.state_file} from {num_files} files of run {timestamp}")
+    if args.show:
+        policy = CommandSamplingPolicy.load(args.state_file)
+        for name in sorted(policy.stats, key=policy.pass_rate, reverse=True):
+            entry = policy.stats[name]
+            print(f"{name:45s} {policy.pass_rate(name):.4f} ({entry['passes']} passed, {entry['fails']} failed)")
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
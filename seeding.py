@@ -0,0 +1,31 @@
+# Per-attempt random streams: attempt i draws from SeedSequence(root_entropy, spawn_key=(i,)), so workers never share
+# a stream and any attempt can be replayed from the (entropy, spawn_key) recorded in its file.
+
+import random
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def root_entropy(seed: Optional[int] = None) -> int:
+    """Entropy of the run's root SeedSequence: the given seed, or fresh entropy from the OS."""
+    if seed is not None:
+        return seed
+    return np.random.SeedSequence().entropy
+
+def attempt_seed_sequence(entropy: int, key: int) -> np.random.SeedSequence:
+    return np.random.SeedSequence(entropy, spawn_key=(key,))
+
+def filename_key(filename: str) -> int:
+    """Stable spawn key for a file, so a file's stream doesn't depend on which worker or in what order it's processed."""
+    return zlib.crc32(filename.encode())
+
+def seed_global_streams(seed_sequence: np.random.SeedSequence):
+    """Seed the global random and np.random streams (which the commands draw from) from a SeedSequence."""
+    state = seed_sequence.generate_state(4)  # 4 x uint32
+    random.seed(int.from_bytes(state.tobytes(), "little"))
+    np.random.seed(state)
+
+def describe_seed(seed_sequence: np.random.SeedSequence) -> str:
+    return f"entropy={seed_sequence.entropy} spawn_key={','.join(map(str, seed_sequence.spawn_key))}"
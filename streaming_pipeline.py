@@ -0,0 +1,241 @@
+# Streaming mode of pipeline.py (--streaming): generation, discrimination and translation run at the same time in
+# their own process pools, connected by bounded queues, and problems are appended to the output as they're translated.
+
+import concurrent.futures
+import hashlib
+import os
+import time
+import json
+from collections import deque
+from typing import Optional
+
+from classical_generator import GenerationProgress, generate_attempt, prepare_args, store_constructions
+from construction_store import open_store
+from discriminator import EvaluationProgress, FailureReport, StoreSink, Verdict, evaluate_chunk, report_name
+from mechanical_translator import process_file_contents
+from sampling_policy import CommandSamplingPolicy, construction_command_names
+
+
+def stage_workers(args):
+    """Process pool sizes for generation, discrimination and translation; the ones not given split max_workers."""
+    translation = args.translation_workers or max(1, args.max_workers // 8)
+    rest = max(2, args.max_workers - translation)
+    generation = args.generation_workers or max(1, (rest + 1) // 2)
+    discrimination = args.discrimination_workers or max(1, rest - generation)
+    return generation, discrimination, translation
+
+class DebugDump:
+    """Writes the judged constructions to <dump_dir>/passed and <dump_dir>/failed, with answers.txt, as the file-based pipeline leaves them."""
+    def __init__(self, dump_dir: str):
+        self.passed_dir = os.path.join(dump_dir, "passed")
+        self.failed_dir = os.path.join(dump_dir, "failed")
+        os.makedirs(self.passed_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+        self.answers_file = open(os.path.join(self.passed_dir, "answers.txt"), 'a')
+
+    def __call__(self, name: str, contents: str, passed: bool, answer: Optional[float]) -> str:
+        path = os.path.join(self.passed_dir if passed else self.failed_dir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        if passed:
+            self.answers_file.write(f"{name}: {answer}\n")
+            self.answers_file.flush()
+        return path
+
+    def close(self):
+        self.answers_file.close()
+
+
+def run(args, generator_args, output_file: str, translator_type: str, timestamp: int, checkpoint: Optional[dict] = None) -> int:
+    """
+    Run the streaming pipeline: args are pipeline.py's, generator_args the generator's (as for one pipeline round, with count None
+    for no attempt limit). Translations are appended to output_file. Returns the number of constructions which passed.
+    With a store (generator_args.store), checkpoint is the run's checkpoint, saved in the store's manifest as the run goes;
+    if the store has records (the run is being resumed), the work they record isn't done again.
+    """
+    # prepare_args defaults a missing count to 20 attempts; here it means no limit
+    max_attempts = generator_args.count
+    prepare_args(generator_args)
+    num_generation_workers, num_discrimination_workers, num_translation_workers = stage_workers(args)
+    print(f"Streaming with {num_generation_workers} generation, {num_discrimination_workers} discrimination and {num_translation_workers} translation workers")
+    generation_progress = GenerationProgress(max_attempts=max_attempts, time_budget=generator_args.time_budget)
+    evaluation_progress = EvaluationProgress()
+    options = dict(num_tests=args.discriminator_num_tests, verbosity=0, seed_entropy=generator_args.seed_entropy, sequential=args.discriminator_sequential,
+                   verdict_cache_path=args.verdict_cache or None)
+    report = None
+    if args.report_dir:
+        os.makedirs(args.report_dir, exist_ok=True)
+        report_file_name = report_name(args.report_dir, timestamp)
+        report = FailureReport(os.path.join(args.report_dir, f"{report_file_name}_files.jsonl"),
+                               {"timestamp": timestamp, "path": "streaming", "num_tests": args.discriminator_num_tests,
+                                "sequential": args.discriminator_sequential, "seed_entropy": generator_args.seed_entropy})
+    # outcomes are learned in memory and saved at the end; the generators keep the policy they started with, so seeded runs reproduce
+    policy = CommandSamplingPolicy.load(args.sampling_policy_file) if args.sampling_policy_file else None
+    dump = DebugDump(args.dump_dir) if args.dump_dir else None
+    store = open_store(generator_args.store) if generator_args.store else None
+    store_sink = StoreSink(store, timestamp) if store is not None else None
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+
+    to_discriminate = deque()  # (name, contents)
+    to_translate = deque()  # (name, path for the output, contents, answer)
+    in_flight = {}  # future -> (stage, its input)
+    num_passed = 0
+    num_started = 0
+    if store is not None and store.count("constructions"):
+        # resuming: pick up where the interrupted run stopped
+        generation_progress.seen.update(store.keys("canonical"))
+        written = set()
+        if os.path.exists(output_file):
+            with open(output_file, 'r') as f:
+                written = {json.loads(line)["hash"] for line in f if line.strip()}
+        for record in store.records("constructions"):
+            verdict = store.get("verdicts", record["key"])
+            if verdict is None:
+                to_discriminate.append((record["key"], record["text"]))
+            elif verdict["status"] == "pass":
+                num_passed += 1
+                if not store.has("translations", record["key"]) and hashlib.sha256(record["text"].encode()).hexdigest() not in written:
+                    to_translate.append((record["key"], f"{store.directory}/{record['key']}", record["text"], verdict["answer"]))
+        print(f"Resuming from {store.directory}: {store.count('attempts')} attempts, {store.count('verdicts')} verdicts ({num_passed} passed) "
+              f"and {store.count('translations')} translations done; {len(to_discriminate)} constructions to judge, {len(to_translate)} to translate")
+    num_translated = 0
+    first_problem_time = None
+    generating = True
+    start_time = time.monotonic()
+    last_report_time = start_time
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_generation_workers) as generation_pool, \
+         concurrent.futures.ProcessPoolExecutor(max_workers=num_discrimination_workers) as discrimination_pool, \
+         concurrent.futures.ProcessPoolExecutor(max_workers=num_translation_workers) as translation_pool, \
+         open(output_file, 'a') as output:
+        def stage_load(stage):
+            return sum(1 for name, _ in in_flight.values() if name == stage)
+
+        while True:
+            if generating and (generation_progress.done(num_started) or (args.target_valid is not None and num_passed >= args.target_valid)):
+                generating = False
+                # drop attempts which haven't started yet, and let the running ones finish
+                for future, (stage, _) in list(in_flight.items()):
+                    if stage == "generate" and future.cancel():
+                        del in_flight[future]
+            # fill the pools, last stage first, so finished work drains before new work is started
+            translating = stage_load("translate")
+            while to_translate and translating < 2 * num_translation_workers:
+                name, path, contents, answer = to_translate.popleft()
+                content_hash = hashlib.sha256(contents.encode()).hexdigest()
+                future = translation_pool.submit(process_file_contents, path, contents, str(answer), args.output_translations_dir, content_hash, translator_type)
+                in_flight[future] = ("translate", (name, content_hash))
+                translating += 1
+            discriminating = stage_load("discriminate")
+            generation_finished = not generating and stage_load("generate") == 0
+            while (to_discriminate and discriminating < 2 * num_discrimination_workers and len(to_translate) < args.queue_size
+                   # partial chunks only when discrimination would otherwise be idle, or nothing more is coming
+                   and (len(to_discriminate) >= args.chunk_size or discriminating == 0 or generation_finished)):
+                chunk = [to_discriminate.popleft() for _ in range(min(args.chunk_size, len(to_discriminate)))]
+                in_flight[discrimination_pool.submit(evaluate_chunk, chunk, options)] = ("discriminate", chunk)
+                discriminating += 1
+            generating_now = stage_load("generate")
+            while generating and generating_now < 2 * num_generation_workers and len(to_discriminate) < args.queue_size and not generation_progress.done(num_started):
+                if store is not None and store.has("attempts", str(generator_args.first_attempt + num_started)):
+                    generation_progress.skipped += 1
+                    num_started += 1
+                    continue
+                future = generation_pool.submit(generate_attempt, generator_args.first_attempt + num_started, generator_args)
+                in_flight[future] = ("generate", generator_args.first_attempt + num_started)
+                num_started += 1
+                generating_now += 1
+            if not in_flight:
+                if to_discriminate or to_translate:
+                    continue
+                break
+
+            finished, _ = concurrent.futures.wait(in_flight, timeout=generation_progress.report_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                stage, task = in_flight.pop(future)
+                if stage == "generate":
+                    try:
+                        constructions = generation_progress.record(future.result())
+                        for filename, contents, _ in constructions:
+                            to_discriminate.append((os.path.basename(filename), contents))
+                        if store is not None:
+                            store_constructions(store, constructions, task, generator_args.seed_entropy)
+                    except Exception as e:
+                        print(f"Error in generation attempt: {e}")
+                        generation_progress.record_error()
+                        if store is not None:
+                            store_constructions(store, [], task, generator_args.seed_entropy)
+                elif stage == "discriminate":
+                    try:
+                        verdicts = future.result()
+                    except Exception as e:
+                        # the worker died (e.g. killed for memory); every file of the chunk errors, as in evaluate
+                        print(f"Error processing {', '.join(name for name, _ in task)}: {e}")
+                        verdicts = [Verdict(name, "error", reason="worker_error", details={"exception": f"{type(e).__name__}: {e}"}) for name, _ in task]
+                    contents_by_name = dict(task)
+                    for verdict in verdicts:
+                        contents = contents_by_name[verdict.name]
+                        passed = verdict.status == "pass"
+                        evaluation_progress.record(verdict)
+                        if report is not None:
+                            report.record(verdict)
+                        if store_sink is not None:
+                            store_sink(verdict)
+                        if policy is not None:
+                            policy.update(construction_command_names(contents), passed)
+                        if dump is not None:
+                            path = dump(verdict.name, contents, passed, verdict.answer)
+                        else:
+                            path = f"{store.directory if store is not None else f'stream_{timestamp}'}/{verdict.name}"
+                        if passed:
+                            num_passed += 1
+                            to_translate.append((verdict.name, path, contents, verdict.answer))
+                else:
+                    name, content_hash = task
+                    try:
+                        problem_json_string = future.result()
+                    except Exception as e:
+                        print(f"Error translating {name}: {e}")
+                        problem_json_string = None
+                    if problem_json_string is not None:
+                        output.write(problem_json_string + "\n")
+                        output.flush()
+                    if store is not None:
+                        # after the line is written: a run killed in between finds the hash in the output file
+                        store.append("translations", {"key": name, "hash": content_hash, "output_file": output_file})
+                    if problem_json_string is None:
+                        continue
+                    num_translated += 1
+                    if first_problem_time is None:
+                        first_problem_time = time.monotonic() - start_time
+                        print(f"First problem written after {first_problem_time:.1f}s")
+
+            if time.monotonic() - last_report_time >= generation_progress.report_interval:
+                last_report_time = time.monotonic()
+                if store is not None:
+                    store.manifest["checkpoint"] = {**checkpoint, "elapsed": checkpoint["elapsed"] + last_report_time - start_time}
+                    store.save_manifest()
+                print(f"Streaming: {num_started} attempts started, {len(to_discriminate)} waiting for the discriminator, {len(to_translate)} for the translator; "
+                      f"{evaluation_progress.summary()}; {num_translated} problems written")
+
+    elapsed = time.monotonic() - start_time
+    print(f"Generation finished: {generation_progress.summary()}")
+    if generation_progress.duplicates:
+        print(f"Dropped {generation_progress.duplicates} duplicate constructions before discrimination, translation and grading")
+    print(generation_progress.telemetry.report(min_attempts=generator_args.health_min_attempts, max_success_rate=generator_args.health_flag_rate))
+    print(f"Discrimination finished: {evaluation_progress.summary()}")
+    if report is not None:
+        report_path = os.path.join(args.report_dir, f"{report_file_name}.json")
+        report.write(report_path)
+        report.print_summary()
+        print(f"Wrote failure-reason report to {report_path}")
+    if policy is not None:
+        policy.save()
+        print(f"Updated command sampling weights in {args.sampling_policy_file} from {sum(evaluation_progress.statuses.values())} constructions")
+    if dump is not None:
+        dump.close()
+    if store_sink is not None:
+        store.manifest["checkpoint"] = {**checkpoint, "elapsed": checkpoint["elapsed"] + elapsed, "stage": "finished"}
+        store_sink.close()
+        print(f"Wrote {store.count('constructions')} constructions and their verdicts to {store.directory}")
+    print(f"Wrote {num_translated} translations to {output_file} in {elapsed:.0f}s"
+          + (f" (first after {first_problem_time:.1f}s)" if first_problem_time is not None else ""))
+    return num_passed
@@ -0,0 +1,88 @@
+import json
+import os
+
+from construction_store import ConstructionStore, open_store
+
+# Round trips through the sharded store: records come back by key and in order, across shards and reopening,
+# and a run killed mid-write loses at most the record it was writing.
+
+def test_round_trip(tmp_path):
+    directory = str(tmp_path / "run")
+    with ConstructionStore(directory, shard_records=3, meta={"seed": 1}) as store:
+        for i in range(7):
+            store.append("constructions", {"key": f"c{i}", "text": f"construction {i}"})
+        store.append("verdicts", {"key": "c1", "status": "pass", "answer": 2.5})
+        assert store.get("constructions", "c4") == {"key": "c4", "text": "construction 4"}
+        assert store.get("constructions", "missing") is None
+    # three shards of at most 3 records
+    assert len(store.shards["constructions"]) == 3
+    with ConstructionStore(directory) as store:
+        assert store.manifest["meta"] == {"seed": 1}
+        assert store.count("constructions") == 7 and store.count("verdicts") == 1
+        assert [record["key"] for record in store.records("constructions")] == [f"c{i}" for i in range(7)]
+        assert store.get("verdicts", "c1")["answer"] == 2.5
+        assert store.has("constructions", "c6") and not store.has("verdicts", "c6")
+        # appending after reopening continues the last shard
+        store.append("verdicts", {"key": "c2", "status": "fail"})
+    with open(os.path.join(directory, "manifest.json")) as f:
+        assert json.load(f)["stages"]["verdicts"]["records"] == 2
+
+def test_superseded_records(tmp_path):
+    directory = str(tmp_path / "run")
+    with ConstructionStore(directory) as store:
+        store.append("verdicts", {"key": "a", "status": "error"})
+        store.append("verdicts", {"key": "b", "status": "fail"})
+        store.append("verdicts", {"key": "a", "status": "pass"})
+    with ConstructionStore(directory) as store:
+        assert store.count("verdicts") == 2
+        assert store.get("verdicts", "a")["status"] == "pass"
+        assert [record["key"] for record in store.records("verdicts")] == ["b", "a"]
+
+def test_recovery(tmp_path):
+    directory = str(tmp_path / "run")
+    with ConstructionStore(directory) as store:
+        for i in range(3):
+            store.append("constructions", {"key": f"c{i}"})
+    shard = os.path.join(directory, "constructions-00000.jsonl")
+    index = shard[:-len(".jsonl")] + ".index"
+    # the last index line was lost, and a record was cut off while it was written
+    with open(index) as f:
+        lines = f.readlines()
+    with open(index, 'w') as f:
+        f.writelines(lines[:-1])
+    with open(shard, 'a') as f:
+        f.write('{"key": "c3", "te')
+    with ConstructionStore(directory) as store:
+        assert [record["key"] for record in store.records("constructions")] == ["c0", "c1", "c2"]
+        store.append("constructions", {"key": "c3"})
+        assert store.get("constructions", "c3") == {"key": "c3"}
+    with ConstructionStore(directory) as store:
+        assert store.count("constructions") == 4
+
+def test_records_since(tmp_path):
+    directory = str(tmp_path / "run")
+    with ConstructionStore(directory, shard_records=2) as store:
+        assert store.end("verdicts") == (0, 0)
+        store.append("verdicts", {"key": "a"})
+        mark = store.end("verdicts")
+        for key in "bcd":
+            store.append("verdicts", {"key": key})
+        assert [record["key"] for record in store.records("verdicts", since=mark)] == ["b", "c", "d"]
+        mark = store.end("verdicts")
+        assert list(store.records("verdicts", since=mark)) == []
+        # a superseded record isn't read again, a record appended after the mark is
+        store.append("verdicts", {"key": "a", "status": "pass"})
+        assert list(store.records("verdicts", since=mark)) == [{"key": "a", "status": "pass"}]
+
+def test_open_store_is_shared(tmp_path):
+    directory = str(tmp_path / "run")
+    store = open_store(directory)
+    assert open_store(directory) is store
+    store.append("constructions", {"key": "c0"})
+    # close only releases the files
+    store.close()
+    store.append("constructions", {"key": "c1"})
+    assert store.get("constructions", "c0") == {"key": "c0"}
+    store.close()
+    with ConstructionStore(directory) as reopened:
+        assert reopened.count("constructions") == 2
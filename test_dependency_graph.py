@@ -1,67 +1,96 @@
 import classical_generator as cg
-import pprint
+from random_constr import ConstCommand, Element
 
-# Generate a construction
-generator = cg.ClassicalGenerator(seed=42)
-generator.generate_construction(num_commands=100)
+# The dependency graph keeps every node's ancestors as a bitmask over node indices; these check the masks, counts and
+# necessary command sets against a plain walk over the parents, on a small hand-built graph and on generated constructions.
+# Run directly to print the dependency graph of a generated construction.
 
-# Print the construction
-print('Generated Construction:')
-for cmd in generator.command_sequence:
-    print(cmd)
+def walk_ancestors(node):
+    ancestors = set()
+    stack = list(node.parents)
+    while stack:
+        parent = stack.pop()
+        if id(parent) not in ancestors:
+            ancestors.add(id(parent))
+            stack.extend(parent.parents)
+    return ancestors
 
-# Examine the dependency graph
-print('\nDependency Graph:')
-for identifier, node in generator.dependency_graph.nodes.items():
-    if node.parents:
-        parent_ids = [p.identifier for p in node.parents]
-        print(f'{identifier} (generated by "{node.command}") depends on: {parent_ids}')
-    else:
-        print(f'{identifier} (generated by "{node.command}") has no dependencies')
+def check_graph(graph):
+    for index, node in enumerate(graph.order):
+        assert node.index == index and graph.nodes[node.element] is node
+        assert all(parent.index < node.index for parent in node.parents)
+        ancestors = walk_ancestors(node)
+        assert {id(other) for other in graph.nodes_in(node.ancestors)} == ancestors
+        assert node.ancestor_count == len(ancestors)
+        assert node.cone == node.ancestors | (1 << node.index)
+        assert graph.necessary_commands(node) == {other.command for other in graph.nodes_in(node.cone) if other.command is not None}
 
-# Analyze ancestry of the final measurement
-measure_id = generator.command_sequence[-1].split("->")[-1].strip()
+def test_diamond():
+    element_dict = {}
+    a, b, c, d, e = [Element(label, element_dict) for label in "ABCDE"]
+    graph = cg.DependencyGraph()
+    graph.add_node(a, "point A")
+    graph.add_dependency(b, [a], "B from A")
+    graph.add_dependency(c, [a], "C from A")
+    graph.add_dependency(d, [b, c], "D from B, C")
+    graph.add_dependency(e, [a], "E from A")
+    check_graph(graph)
+    node = graph.nodes[d]
+    assert [n.element for n in graph.nodes_in(node.ancestors)] == [a, b, c]
+    assert node.ancestor_count == 3
+    assert graph.necessary_commands(node) == {"point A", "B from A", "C from A", "D from B, C"}
+    assert [n.element for n in graph.get_ancestors(e)] == [a]
 
-# Find the node with the highest ancestor count
-print("\nNode with the highest number of ancestors:")
-max_ancestors = 0
-max_node_id = None
+def test_new_parents_get_lower_indices():
+    element_dict = {}
+    a, b = [Element(label, element_dict) for label in "AB"]
+    graph = cg.DependencyGraph()
+    graph.add_dependency(b, [a], "B from A")
+    assert graph.nodes[a].index == 0 and graph.nodes[b].index == 1
+    assert graph.nodes[b].ancestors == graph.nodes[a].bit
+    check_graph(graph)
 
-for identifier in generator.dependency_graph.nodes:
-    ancestors = generator.dependency_graph.get_ancestors(identifier)
-    ancestor_count = len(ancestors)
-    
-    if ancestor_count > max_ancestors:
-        max_ancestors = ancestor_count
-        max_node_id = identifier
+def test_generated_constructions():
+    for seed in range(3):
+        generator = cg.ClassicalGenerator(seed=seed)
+        generator.generate_construction(num_commands=30)
+        check_graph(generator.dependency_graph)
 
-print(f"Node {max_node_id} has {max_ancestors} ancestors")
+def test_cone_commands():
+    generator = cg.ClassicalGenerator(seed=7)
+    generator.generate_construction(num_commands=30)
+    generator._track_new_nodes()
+    graph = generator.dependency_graph
+    assert len(generator._cone_commands) == len(graph.order)
+    for node, num_commands in zip(graph.order, generator._cone_commands):
+        commands = {id(other.command) for other in graph.nodes_in(node.cone)
+                    if other.command is not None and not isinstance(other.command, ConstCommand)}
+        assert num_commands == len(commands)
+        # compute_measure_targets stops at the first target whose cone plus the measure command can't reach min_num_commands
+        assert num_commands + 1 <= node.ancestor_count + 2
 
-# Define the function to print the dependency tree
-def print_node_tree(node_id, depth=0):
-    node = generator.dependency_graph.nodes.get(node_id)
-    if not node:
-        return
-    indent = "  " * depth
-    print(f"{indent}{node_id}: {node.command}")
-    for parent in node.parents:
-        print_node_tree(parent.identifier, depth + 1)
+if __name__ == "__main__":
+    generator = cg.ClassicalGenerator(seed=42)
+    generator.generate_construction(num_commands=100)
 
-# Print the complete dependency chain for the node with the most ancestors
-print("\nComplete dependency chain for node with most ancestors:")
+    print('Generated Construction:')
+    for cmd in generator.command_sequence:
+        print(cmd)
 
+    print('\nDependency Graph:')
+    for node in generator.dependency_graph.order:
+        if node.parents:
+            print(f'{node.element.label} (generated by "{node.command}") depends on: {[p.element.label for p in node.parents]}')
+        else:
+            print(f'{node.element.label} (generated by "{node.command}") has no dependencies')
 
+    max_node = max(generator.dependency_graph.order, key=lambda node: node.ancestor_count)
+    print(f"\nNode {max_node.element.label} has the most ancestors: {max_node.ancestor_count}")
 
-'''
-# Print the complete dependency chain for the final measurement
-print("\nComplete dependency chain:")
-def print_node_tree(node_id, depth=0):
-    node = generator.dependency_graph.nodes.get(node_id)
-    if not node:
-        return
-    indent = "  " * depth
-    print(f"{indent}{node_id}: {node.command}")
-    for parent in node.parents:
-        print_node_tree(parent.identifier, depth + 1)
-'''
-print_node_tree(max_node_id) 
\ No newline at end of file
+    def print_node_tree(node, depth=0):
+        print(f"{'  ' * depth}{node.element.label}: {node.command}")
+        for parent in node.parents:
+            print_node_tree(parent, depth + 1)
+
+    print("\nComplete dependency chain for node with most ancestors:")
+    print_node_tree(max_node)
@@ -0,0 +1,25 @@
+import json
+
+import discriminator
+from discriminator import FailureReport, Verdict
+
+# The failure-reason report counts passes by status, so verdicts without a reason (crashed or lost work) aren't passes.
+
+def test_error_verdicts_are_not_passes(tmp_path):
+    report = FailureReport(str(tmp_path / "files.jsonl"), {})
+    report.record(Verdict("a.txt", "pass", answer=2.5))
+    report.record(Verdict("b.txt", "fail", reason="non_constant"))
+    report.record(Verdict("c.txt", "error", reason="worker_error"))
+    report.record(Verdict("d.txt", "error"))
+    report.write(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as f:
+        reasons = json.load(f)["reasons"]
+    assert reasons == {"pass": 1, "non_constant": 1, "worker_error": 1, "error": 1}
+    with open(tmp_path / "files.jsonl") as f:
+        assert [json.loads(line)["reason"] for line in f] == [None, "non_constant", "worker_error", None]
+
+def test_evaluate_chunk_errors(tmp_path):
+    # evaluate_one raises on a construction that is neither text nor a Construction
+    verdicts = discriminator.evaluate_chunk([("a.txt", None)], {})
+    assert [(verdict.status, verdict.reason) for verdict in verdicts] == [("error", "worker_error")]
+    assert "worker_error" in discriminator.FAILURE_REASONS
@@ -0,0 +1,58 @@
+import sqlite3
+
+import verdict_cache
+
+# Round trips through the verdict cache: a verdict is found again only with the same canonical hash, engine version
+# and test parameters, survives reopening the file, and older cache files without failure reasons still open.
+
+RESULTS = {"trials": 20, "mode_count": 19, "successful_tests": 20, "failed_tests": 0, "counts": {2.5: 19, 2.4: 1}, "exceptions": {}}
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    parameters = verdict_cache.test_parameters(20, rel_tol=1e-9, pass_agreements=18)
+    assert verdict_cache.lookup(path, "abc", parameters) is None
+    verdict_cache.store(path, "abc", parameters, "pass", 2.5, RESULTS)
+    verdict_cache.store(path, "def", parameters, "fail", None, RESULTS, reason="non_constant")
+    verdict_cache.store(path, "ghi", parameters, "error", None, None, reason="load_error")
+    assert verdict_cache.lookup(path, "abc", parameters) == ("pass", 2.5, None)
+    assert verdict_cache.lookup(path, "def", parameters) == ("fail", None, "non_constant")
+    assert verdict_cache.lookup(path, "ghi", parameters) == ("error", None, "load_error")
+    # a new verdict for the same key replaces the old one
+    verdict_cache.store(path, "abc", parameters, "fail", None, RESULTS, reason="zero_measure")
+    assert verdict_cache.lookup(path, "abc", parameters) == ("fail", None, "zero_measure")
+    # a new process opens the file again
+    verdict_cache._connections.clear()
+    assert verdict_cache.lookup(path, "def", parameters) == ("fail", None, "non_constant")
+
+def test_parameters_are_part_of_the_key(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    parameters = verdict_cache.test_parameters(20, rel_tol=1e-9, pass_agreements=18)
+    verdict_cache.store(path, "abc", parameters, "pass", 2.5, RESULTS)
+    for other in (verdict_cache.test_parameters(30, rel_tol=1e-9, pass_agreements=18),
+                  verdict_cache.test_parameters(20, precision=6, rel_tol=1e-9, pass_agreements=18),
+                  verdict_cache.test_parameters(20, rel_tol=1e-6, pass_agreements=18),
+                  verdict_cache.test_parameters(20, rel_tol=1e-9, pass_agreements=15),
+                  verdict_cache.test_parameters(20, sequential=True, min_agreements=18, rel_tol=1e-9, pass_agreements=18)):
+        assert other != parameters
+        assert verdict_cache.lookup(path, "abc", other) is None
+    assert verdict_cache.test_parameters(20, rel_tol=1e-9, pass_agreements=18) == parameters
+
+def test_engine_version_is_part_of_the_key(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite")
+    parameters = verdict_cache.test_parameters(20)
+    verdict_cache.store(path, "abc", parameters, "pass", 2.5, RESULTS)
+    monkeypatch.setattr(verdict_cache, "_engine_version", "edited")
+    assert verdict_cache.lookup(path, "abc", parameters) is None
+
+def test_cache_without_reasons(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    parameters = verdict_cache.test_parameters(20)
+    connection = sqlite3.connect(path)
+    connection.execute("""CREATE TABLE verdicts (canonical_hash TEXT NOT NULL, engine_version TEXT NOT NULL, parameters TEXT NOT NULL,
+        status TEXT NOT NULL, answer REAL, trials INTEGER, mode_count INTEGER, successful_tests INTEGER, failed_tests INTEGER, counts TEXT,
+        exceptions TEXT, created REAL, PRIMARY KEY (canonical_hash, engine_version, parameters))""")
+    connection.execute("INSERT INTO verdicts (canonical_hash, engine_version, parameters, status, answer) VALUES (?, ?, ?, ?, ?)",
+                       ("abc", verdict_cache.engine_version(), parameters, "pass", 2.5))
+    connection.commit()
+    connection.close()
+    assert verdict_cache.lookup(path, "abc", parameters) == ("pass", 2.5, None)
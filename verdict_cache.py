@@ -0,0 +1,83 @@
+# SQLite cache of discriminator verdicts, keyed by canonical hash, engine version and test parameters,
+# so reruns only test constructions they haven't seen.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+# the files whose contents decide verdicts; editing any of them starts a new cache generation
+ENGINE_FILES = ("discriminator.py", "random_constr.py", "commands.py", "geo_types.py")
+
+_engine_version: Optional[str] = None
+_connections: Dict[str, sqlite3.Connection] = {}
+
+
+def engine_version() -> str:
+    global _engine_version
+    if _engine_version is None:
+        digest = hashlib.blake2b(digest_size=8)
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for filename in ENGINE_FILES:
+            with open(os.path.join(directory, filename), 'rb') as f:
+                digest.update(f.read())
+        _engine_version = digest.hexdigest()
+    return _engine_version
+
+def test_parameters(num_tests: int, precision: int = 4, sequential: bool = False, max_disagreements: Optional[int] = None,
+                    min_agreements: Optional[int] = None, rel_tol: Optional[float] = None, pass_agreements: Optional[int] = None) -> str:
+    """The part of the key describing how the construction was tested."""
+    rule = {"sequential": sequential, "max_disagreements": max_disagreements, "min_agreements": min_agreements} if sequential else {}
+    return json.dumps({"num_tests": num_tests, "precision": precision, "rel_tol": rel_tol, "pass_agreements": pass_agreements, **rule},
+                      sort_keys=True)
+
+def _connection(path: str) -> sqlite3.Connection:
+    # one connection per process and file; a forked worker must not reuse its parent's
+    key = f"{os.getpid()}:{path}"
+    if key not in _connections:
+        connection = sqlite3.connect(path, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS verdicts (
+            canonical_hash TEXT NOT NULL,
+            engine_version TEXT NOT NULL,
+            parameters TEXT NOT NULL,
+            status TEXT NOT NULL,
+            answer REAL,
+            trials INTEGER,
+            mode_count INTEGER,
+            successful_tests INTEGER,
+            failed_tests INTEGER,
+            counts TEXT,
+            exceptions TEXT,
+            created REAL,
+            reason TEXT,
+            PRIMARY KEY (canonical_hash, engine_version, parameters))""")
+        # caches made before failure reasons were recorded
+        if "reason" not in [column[1] for column in connection.execute("PRAGMA table_info(verdicts)")]:
+            connection.execute("ALTER TABLE verdicts ADD COLUMN reason TEXT")
+        connection.commit()
+        _connections[key] = connection
+    return _connections[key]
+
+def lookup(path: str, canonical_hash: str, parameters: str) -> Optional[Tuple[str, Optional[float], Optional[str]]]:
+    """The cached (status, answer, failure reason) of a construction, or None if it hasn't been tested with these parameters."""
+    row = _connection(path).execute(
+        "SELECT status, answer, reason FROM verdicts WHERE canonical_hash = ? AND engine_version = ? AND parameters = ?",
+        (canonical_hash, engine_version(), parameters)).fetchone()
+    return None if row is None else tuple(row)
+
+def store(path: str, canonical_hash: str, parameters: str, status: str, answer: Optional[float], test_results: Optional[dict],
+          reason: Optional[str] = None):
+    """Record a verdict; test_results is test_measure_construction's dictionary (None for errors)."""
+    test_results = test_results or {}
+    connection = _connection(path)
+    connection.execute(
+        "INSERT OR REPLACE INTO verdicts (canonical_hash, engine_version, parameters, status, answer, trials, mode_count, successful_tests, "
+        "failed_tests, counts, exceptions, created, reason) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (canonical_hash, engine_version(), parameters, status, answer, test_results.get("trials"), test_results.get("mode_count"),
+         test_results.get("successful_tests"), test_results.get("failed_tests"),
+         json.dumps({str(value): count for value, count in test_results.get("counts", {}).items()}),
+         json.dumps(test_results.get("exceptions", {})), time.time(), reason))
+    connection.commit()